@@ -0,0 +1,183 @@
+import asyncio
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable
+
+from power.power import Power, _args, _kwargs
+
+
+class AsyncPower:
+    """
+    asyncio front end of Power. Tasks still run in the worker threads of Power, awaiting one only suspends the
+    coroutine until a worker finishes it, so a single event loop can have many simulations in flight while it serves
+    its clients (see AsyncSocketServer). Nothing waits in a thread pool or polls. Only queueing a task runs in the
+    default executor when Power has a cache, because looking it up reads SQLite, or when it has to wait for the pool
+    to stop resizing.
+
+    Usage:
+
+    >>> async with AsyncPower(Power(4)) as pw:
+    ...     result = await pw.submit(threaded_func, 'foo')
+    ...     results = await pw.map(threaded_func, ['foo', 'bar'])
+    ...     async for task, result in pw.batch(threaded_func, arg_sets, max_in_flight=8):
+    ...         print(task.thread_id, result)
+
+    With a server, new tasks wait while a client has paused the application. The pause of PowerSocketServer doesn't
+    apply, that one is for gevent applications.
+
+    :param power: Power object, its collection is created when entering the async with block if it wasn't yet. It's
+        reset when leaving the block, so it can't be used for another one.
+    :param server: Optional AsyncSocketServer that can pause the application
+    :type power: Power
+    """
+    def __init__(self, power: Power, server=None):
+        self.power = power
+        self.server = server
+
+    async def start(self, warmup: Callable=None, progress: Callable=None) -> dict:
+        """
+        Create the collection of simulators, see Power.create_pw_collection(). It blocks, so it runs in a thread.
+
+        :return: Dictionary of thread ID to a dictionary with the seconds spent on each startup step
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, partial(self.power.create_pw_collection, warmup, progress))
+
+    async def close(self):
+        """Reset Power, in a thread as it waits for the worker threads to exit"""
+        await asyncio.get_running_loop().run_in_executor(None, self.power.reset)
+
+    async def __aenter__(self):
+        if self.power._threads is None:
+            raise RuntimeError('Power was reset, create a new one')
+        if not self.power._threads:
+            await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def submit(self, f: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Run a method once, in whichever thread is free first, like Power.submit()
+
+        :param f: The method you want to call in a thread, same as for Power.add_task()
+        :return: Future with the return value of your method. Cancelling it cancels the task if it hasn't started.
+        """
+        return asyncio.ensure_future(self._result(f, args, kwargs))
+
+    async def map(self, f: Callable, *iterables: Iterable) -> list:
+        """
+        Run a method for every set of items from the iterables, spread over all threads, like Power.map()
+
+        :param f: The method you want to call in a thread, same as for Power.add_task()
+        :param iterables: Iterables of positional arguments for the method
+        :return: List of the return values of your method, in order. Raises the exception of the first call that
+            failed, the calls that didn't start yet are cancelled.
+        """
+        fs = [self.submit(f, *args) for args in zip(*iterables)]
+        try:
+            return await asyncio.gather(*fs)
+        finally:
+            for future in fs:
+                future.cancel()
+
+    async def add_task(self, f: Callable, threads: str=None, *args, **kwargs) -> list:
+        """
+        Run a method in a number of threads, like Power.add_task()
+
+        :param f: The method you want to call in a thread
+        :param threads: Optional string of threads to run the method in, like '0-7' or '1,2,5-7'. All threads if not
+            provided.
+        :rtype: list[(_PowerTask, T)]
+        :return: List of result tuples, the same as for Power.add_task()
+        """
+        await self._unpaused()
+        # Waits for the resize lock
+        tasks = await asyncio.get_running_loop().run_in_executor(
+            None, partial(self.power._put_pinned, f, threads, args, kwargs))
+        await asyncio.wait([asyncio.wrap_future(task.future) for task in tasks])
+        return [(task, task.exc_info if task.exception else task.future.result()) for task in tasks]
+
+    async def batch(self, f: Callable, arg_sets: Iterable, max_in_flight: int=None) -> AsyncIterator:
+        """
+        Run a method for every argument set of a (possibly lazy and very long) iterable, yielding results as they
+        complete, like Power.batch(). Only max_in_flight tasks are queued or running at any time, leaving the async for
+        loop early cancels the remaining queued tasks. Works with the journal of Power the same way.
+
+        :param f: The method you want to call in a thread, same as for Power.add_task()
+        :param arg_sets: Iterable of argument sets, see Power.batch()
+        :param max_in_flight: Optional maximum number of tasks queued or running at once, defaults to twice the number
+            of threads
+        :rtype: AsyncIterator[(_PowerTask, T)]
+        :return: Async iterator over result tuples in order of completion
+        """
+        power = self.power
+        if max_in_flight is None:
+            max_in_flight = 2 * power.num_threads
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight should be at least 1')
+        arg_sets = iter(arg_sets)
+        # asyncio future to the task it waits for
+        in_flight = {}
+        try:
+            while True:
+                # Top up with new tasks
+                for arg_set in arg_sets:
+                    key = power._journal_key(f, arg_set)
+                    if key is not None and key in power.journal:
+                        power.metrics.count('skipped')
+                        continue
+                    await self._unpaused()
+                    task = await self._put(f, _args(arg_set), _kwargs(arg_set))
+                    if key is not None:
+                        task.future.add_done_callback(partial(power._journal_result, key))
+                    in_flight[asyncio.wrap_future(task.future)] = task
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
+                    break
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    task = in_flight.pop(future)
+                    yield task, task.exc_info if task.exception else task.future.result()
+        finally:
+            for task in in_flight.values():
+                task.future.cancel()
+            if power.journal is not None:
+                power.journal.flush()
+
+    async def _unpaused(self):
+        """Wait while the application is paused"""
+        if self.server is not None and not self.server.resumed.is_set():
+            await self.server.resumed.wait()
+
+    async def _put(self, f: Callable, args: tuple, kwargs: dict):
+        """
+        Queue a task for any thread, looking it up in the cache of Power in the default executor if there is one
+
+        :rtype: _PowerTask
+        :return: The task that was queued
+        """
+        if self.power.cache is None:
+            return self.power._put_task(f, None, args, kwargs)
+        put = asyncio.get_running_loop().run_in_executor(None, partial(self.power._put_task, f, None, args, kwargs))
+        try:
+            return await asyncio.shield(put)
+        except asyncio.CancelledError:
+            # It's queued anyway, cancel it once it is
+            put.add_done_callback(_cancel_task)
+            raise
+
+    async def _result(self, f: Callable, args: tuple, kwargs: dict):
+        await self._unpaused()
+        return await asyncio.wrap_future((await self._put(f, args, kwargs)).future)
+
+
+def _cancel_task(put: asyncio.Future):
+    """
+    Cancel the task a cancelled call to AsyncPower._put() queued
+
+    :param put: Future of the _PowerTask
+    """
+    if not put.cancelled() and put.exception() is None:
+        put.result().future.cancel()
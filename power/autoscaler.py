@@ -0,0 +1,162 @@
+import logging as log
+import time
+from collections import deque
+from threading import Event, Thread
+
+from power.lazy import optional
+
+
+class Autoscaler:
+    """
+    Grows and shrinks the pool of threads and simulators of Power with the load, so licenses aren't held by idle
+    simulators at night and interactive work doesn't wait behind a batch during the day.
+
+    The pool grows by step threads whenever a task has been waiting in the queue for longer than target_wait. It shrinks
+    by step when, for a whole cooldown period, there were idle threads and nothing waiting. Only the simulators of the
+    threads that are added or retired are created or released, the others keep running their tasks. Threads are
+    retired from the highest ID down. When idle, only threads that aren't running a task are retired, so the pool
+    may shrink less than step; when memory is low, a retired thread finishes the task it is running first.
+
+    Available memory is checked with psutil if installed, or /proc/meminfo on Linux. The pool doesn't grow when
+    starting another simulator would leave less than min_available bytes, and shrinks when there already is less.
+
+    Usage:
+
+    >>> pw = Power(2, autoscaler=Autoscaler(min_threads=2, max_threads=16, target_wait=5, cooldown=600))
+    >>> pw.create_pw_collection()
+
+    :param min_threads: Minimum number of threads
+    :param max_threads: Maximum number of threads, e.g. the number of simulator licenses
+    :param target_wait: Seconds a task may wait in the queue before the pool grows
+    :param cooldown: Seconds threads have to be idle before the pool shrinks, also the minimum time between a resize
+        and shrinking
+    :param step: Number of threads to add or retire at a time
+    :param min_available: Optional number of bytes of memory to keep available
+    :param instance_memory: Estimated number of bytes of memory a simulator uses
+    :param interval: Seconds between checks
+    :type resizes: int
+    """
+    def __init__(self, min_threads: int=1, max_threads: int=8, target_wait: float=1.0, cooldown: float=60.0,
+                 step: int=1, min_available: int=None, instance_memory: int=0, interval: float=1.0):
+        if not 1 <= min_threads <= max_threads:
+            raise ValueError('Expected 1 <= min_threads <= max_threads, got %s and %s' % (min_threads, max_threads))
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+        self.target_wait = target_wait
+        self.cooldown = cooldown
+        self.step = step
+        self.min_available = min_available
+        self.instance_memory = instance_memory
+        self.interval = interval
+        self.resizes = 0
+        self._power = None
+        self._thread = None
+        self._wake = Event()
+        self._stopping = False
+        # (time, idle threads) samples since the last resize
+        self._samples = deque()
+        self._resized = 0.0
+
+    def start(self, power):
+        """
+        Start resizing the pool of a Power object, called by Power once its collection has been created
+
+        :param power: Power object
+        """
+        self._power = power
+        self._stopping = False
+        self._samples.clear()
+        self._resized = time.monotonic()
+        self._thread = Thread(target=self._run, name='PowerAutoscaler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop resizing, called by Power when it's reset"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def check(self):
+        """Check the load once and resize the pool if needed"""
+        power = self._power
+        now = time.monotonic()
+        size = power.num_threads
+        available = available_memory()
+        low_memory = self.min_available is not None and available is not None and available < self.min_available
+
+        if size < self.min_threads:
+            self._resize(self.min_threads - size, 'below the minimum')
+        elif size > self.max_threads:
+            self._resize(self.max_threads - size, 'above the maximum')
+        elif low_memory and size > self.min_threads:
+            self._resize(-min(self.step, size - self.min_threads), 'only %s bytes of memory available' % available)
+        elif power._tasks.oldest_wait() > self.target_wait and size < self.max_threads:
+            n = min(self.step, self.max_threads - size)
+            if self.min_available is not None and available is not None:
+                # Only as many as fit in memory
+                n = min(n, int((available - self.min_available) // max(self.instance_memory, 1)))
+            if n > 0:
+                self._resize(n, 'tasks waiting over %ss' % self.target_wait)
+        else:
+            # Threads are only spare if nothing is waiting for them
+            idle = 0 if power._tasks.qsize() else sum(thread.current_task is None for thread in power._threads)
+            self._samples.append((now, idle))
+            while self._samples and self._samples[0][0] < now - self.cooldown:
+                self._samples.popleft()
+            spare = min(idle for _, idle in self._samples)
+            if now - self._resized >= self.cooldown and spare and size > self.min_threads:
+                self._resize(-min(self.step, spare, size - self.min_threads), 'idle for %ss' % self.cooldown, True)
+
+    def _resize(self, n: int, reason: str, idle_only: bool=False):
+        """
+        Grow or shrink the pool
+
+        :param n: Number of threads to add, negative to retire
+        :param reason: Reason for the log
+        :param idle_only: Only retire threads that aren't running a task
+        """
+        log.info('%s %s threads: %s', 'Adding' if n > 0 else 'Retiring', abs(n), reason)
+        if n > 0:
+            self._power.grow(n)
+        else:
+            self._power.shrink(-n, idle_only)
+        self.resizes += 1
+        self._samples.clear()
+        self._resized = time.monotonic()
+
+    def _run(self):
+        """Main loop of the autoscaler thread"""
+        self._power._backend.enter_thread()
+        try:
+            while True:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                if self._stopping:
+                    break
+                try:
+                    self.check()
+                except Exception:
+                    log.exception('Autoscaler check failed')
+        finally:
+            self._power._backend.exit_thread()
+
+
+def available_memory() -> int:
+    """
+    :return: Bytes of memory available to new processes, or None if unknown
+    """
+    psutil = optional('psutil')
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    # Without psutil, only Linux tells
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
@@ -0,0 +1,358 @@
+import traceback
+
+from power.fakesimauto import FakeSimAuto, SimulatorCrashed
+from power.lazy import optional
+
+
+class Backend:
+    """
+    A backend decides how simulator instances are created and how tasks are executed against them.
+
+    Every worker thread of Power owns one simulator handle. The lifecycle is:
+    create() on the main thread when the collection is created, attach() and detach() in the worker thread when it
+    starts and stops, and release() on the main thread when Power is reset. Subclasses override whichever of these
+    they need.
+
+    If parallel_create is set, create() is called by the worker thread itself right before attach(), so all
+    simulators start at the same time.
+
+    Threads that live on and create or use simulators, like the worker threads, the supervisor and the autoscaler,
+    call enter_thread() once when they start and exit_thread() once when they stop.
+
+    If in_thread is set, task functions run in the worker thread and call the simulator through auto_sim there, so a
+    TaskHook can stand in for auto_sim, e.g. to time the calls.
+    """
+    parallel_create = True
+    in_thread = False
+
+    def enter_thread(self):
+        """
+        Prepare the current thread for creating and using simulators, called once when a long-lived thread starts.
+        """
+        pass
+
+    def exit_thread(self):
+        """
+        Undo enter_thread(), called once when the thread stops, after it released its simulators.
+        """
+        pass
+
+    def create(self, i: int):
+        """
+        Create the simulator for worker i, called on the main thread unless parallel_create is set.
+
+        :param i: Worker ID
+        :return: Handle that is passed to the other methods
+        """
+        raise NotImplementedError
+
+    def attach(self, handle):
+        """
+        Make the simulator usable in the current worker thread.
+
+        :param handle: Handle returned by create()
+        :return: The auto_sim object passed to task functions
+        """
+        return handle
+
+    def detach(self, handle):
+        """
+        Stop using the simulator in the current worker thread, called right before the thread exits.
+
+        :param handle: Handle returned by create()
+        """
+        pass
+
+    def release(self, handle):
+        """
+        Release the simulator, called on the main thread, or once it has detached by a worker thread the supervisor
+        abandoned.
+
+        :param handle: Handle returned by create()
+        """
+        pass
+
+    def execute(self, task, thread_id: int, auto_sim):
+        """
+        Run a task in the current worker thread.
+
+        :param task: _PowerTask to run
+        :param thread_id: ID of the worker running the task
+        :param auto_sim: Object returned by attach()
+        :return: Return value of the task function
+        """
+        return task.f(*task.args, thread_id=thread_id, auto_sim=auto_sim, **task.kwargs)
+
+    def alive(self, handle) -> bool:
+        """
+        Check if the simulator is still running, called periodically by the supervisor from its own thread.
+
+        :param handle: Handle returned by create()
+        :return: False if the simulator is known to be dead
+        """
+        return True
+
+    def crashed(self, exception: BaseException) -> bool:
+        """
+        Check if an exception raised by execute() means the simulator died, rather than the task failing.
+
+        :param exception: Exception raised by execute()
+        :return: True if the simulator has to be replaced
+        """
+        return False
+
+    def terminate(self, handle):
+        """
+        Forcefully stop a hung or crashed simulator, called by the supervisor before release(). The thread using it may
+        still be blocked in a call.
+
+        :param handle: Handle returned by create()
+        """
+        pass
+
+
+class ComBackend(Backend):
+    """
+    Threads backend: one PowerWorld SimAuto COM object per thread. This is the default.
+
+    The COM objects are created on the main thread and marshalled into a stream, so each worker thread can unmarshal
+    its own object into its apartment. This also means they are created one after the other.
+    """
+    prog_id = 'pwrworld.SimulatorAuto'
+    parallel_create = False
+    in_thread = True
+    # HRESULTs of calls to a simulator process that has gone away
+    disconnected = (-2147417848, -2147023174, -2147023170)
+
+    def __init__(self):
+        # PowerWorld only runs on Windows, the COM modules are not available elsewhere. They take a while to load, so
+        # only when the first ComBackend is created.
+        if optional('win32com.client') is None or optional('pythoncom') is None:
+            raise RuntimeError('ComBackend requires pypiwin32 and PowerWorld Simulator, use FakeBackend instead')
+
+    def enter_thread(self):
+        # Enable COM in this thread, the main thread has it already
+        optional('pythoncom').CoInitialize()
+
+    def exit_thread(self):
+        # Indicate that no more COM objects will be called in this thread
+        optional('pythoncom').CoUninitialize()
+
+    def create(self, i: int):
+        pythoncom = optional('pythoncom')
+        # Create COM object
+        pw = optional('win32com.client').Dispatch(self.prog_id)
+        # Create stream that will hold COM object
+        pw_stream = pythoncom.CreateStreamOnHGlobal()
+        # Convert COM object into stream to allow re-usage
+        pythoncom.CoMarshalInterface(pw_stream,
+                                     pythoncom.IID_IDispatch,
+                                     pw._oleobj_,
+                                     pythoncom.MSHCTX_LOCAL,
+                                     pythoncom.MSHLFLAGS_TABLESTRONG)
+        # No need for the COM reference anymore now that it's a stream
+        pw = None
+        return pw_stream
+
+    def attach(self, pw_stream):
+        pythoncom = optional('pythoncom')
+        # Make sure we're at the start of the stream, reset the pointer
+        pw_stream.Seek(0, 0)
+        # Unmarshal the stream, going back to the original interface
+        pw_interface = pythoncom.CoUnmarshalInterface(pw_stream, pythoncom.IID_IDispatch)
+        # And finally return the COM object that was created earlier
+        return optional('win32com.client').Dispatch(pw_interface)
+
+    def detach(self, pw_stream):
+        # Revert stream back to start position
+        pw_stream.Seek(0, 0)
+
+    def release(self, pw_stream):
+        optional('pythoncom').CoReleaseMarshalData(pw_stream)
+
+    def crashed(self, exception: BaseException) -> bool:
+        return isinstance(exception, optional('pythoncom').com_error) and exception.hresult in self.disconnected
+
+
+class FakeBackend(Backend):
+    """
+    Threads backend with a FakeSimAuto per thread instead of PowerWorld, works on any platform.
+
+    :param latency: Seconds every simulator call takes, or a dictionary of method name to seconds
+    :param jitter: Relative random variation of the latency
+    :param seed: Base seed, worker i uses seed + i so workers don't share a latency sequence
+    :param elements: Optional dictionary of object type to number of elements in every case
+    """
+    in_thread = True
+
+    def __init__(self, latency=0.0, jitter: float=0.0, seed: int=0, elements: dict=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.elements = elements
+
+    def create(self, i: int):
+        return FakeSimAuto(latency=self.latency, jitter=self.jitter, seed=self.seed + i, elements=self.elements)
+
+    def alive(self, sim: FakeSimAuto) -> bool:
+        return not sim.dead
+
+    def crashed(self, exception: BaseException) -> bool:
+        return isinstance(exception, SimulatorCrashed)
+
+    def terminate(self, sim: FakeSimAuto):
+        sim.crash()
+
+
+class ProcessBackend(Backend):
+    """
+    Process backend: every worker thread drives a worker process that owns its own simulator instance, so task
+    functions run in parallel without sharing the GIL.
+
+    Task functions, their arguments and return values have to be picklable, which means the functions need to be
+    defined at module level. The worker thread in the main process only forwards tasks and waits for their results.
+
+    :param backend: Backend used inside every worker process to create the simulator, defaults to ComBackend
+    :param context: Multiprocessing start method, defaults to 'spawn' as forking a multithreaded process is unsafe
+    """
+    def __init__(self, backend: Backend=None, context: str='spawn'):
+        self._backend = backend if backend is not None else ComBackend()
+        # Only loaded when needed, it's slow to import
+        import multiprocessing
+        self._context = multiprocessing.get_context(context)
+
+    def create(self, i: int):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_process_worker, args=(self._backend, i, child_conn),
+                                        name='PowerProcess-%s' % i, daemon=True)
+        process.start()
+        # Only the worker process should hold this end, otherwise we won't notice it exiting
+        child_conn.close()
+        return _WorkerProcess(process, conn)
+
+    def attach(self, worker):
+        # Wait until the worker process has created its simulator
+        worker.wait_ready()
+        return worker
+
+    def execute(self, task, thread_id: int, auto_sim):
+        return auto_sim.call(task, thread_id)
+
+    def alive(self, worker) -> bool:
+        return worker.process.is_alive()
+
+    def crashed(self, exception: BaseException) -> bool:
+        # Lost connection to the worker process, unless the task itself raised it there
+        return isinstance(exception, (EOFError, OSError)) and not isinstance(exception.__cause__, _RemoteTraceback)
+
+    def terminate(self, worker):
+        worker.process.kill()
+
+    def release(self, worker):
+        worker.close()
+
+
+class _WorkerProcess:
+    """
+    Main process side of a worker process started by ProcessBackend.
+
+    :type process: multiprocessing.Process
+    :type conn: multiprocessing.connection.Connection
+    """
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def wait_ready(self):
+        """
+        Wait for the worker process to report that its simulator was created.
+        Raises the exception of the worker process if it couldn't.
+        """
+        self._receive()
+
+    def call(self, task, thread_id: int):
+        """
+        Run a task in the worker process and wait for the result.
+        Exceptions raised by the task are raised again here, with the remote traceback as cause.
+
+        :param task: _PowerTask to run
+        :param thread_id: ID of the worker running the task
+        :return: Return value of the task function
+        """
+        self.conn.send((task.f, task.args, task.kwargs, thread_id))
+        return self._receive()
+
+    def _receive(self):
+        """
+        Receive a result from the worker process, raising it if it's an exception.
+
+        :return: Result
+        """
+        ok, value = self.conn.recv()
+        if ok:
+            return value
+        exception, tb = value
+        exception.__cause__ = _RemoteTraceback(tb)
+        raise exception
+
+    def close(self):
+        """Ask the worker process to exit and wait for it."""
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            # Process is already gone
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class _RemoteTraceback(Exception):
+    """Carries the formatted traceback of an exception raised in a worker process."""
+    def __init__(self, tb: str):
+        super().__init__(tb)
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+def _process_worker(backend: Backend, i: int, conn):
+    """
+    Main loop of a worker process: create a simulator with the wrapped backend and run tasks until told to stop.
+
+    :param backend: Backend creating the simulator inside this process
+    :param i: Worker ID
+    :param conn: Connection to the main process
+    """
+    try:
+        handle = backend.create(i)
+        auto_sim = backend.attach(handle)
+    except BaseException as e:
+        conn.send((False, (e, traceback.format_exc())))
+        conn.close()
+        return
+    conn.send((True, None))
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                # Main process went away
+                break
+            if message is None:
+                break
+            f, args, kwargs, thread_id = message
+            try:
+                result = (True, f(*args, thread_id=thread_id, auto_sim=auto_sim, **kwargs))
+            except BaseException as e:
+                result = (False, (e, traceback.format_exc()))
+            try:
+                conn.send(result)
+            except Exception as e:
+                # Result or exception can't be pickled, report that instead
+                conn.send((False, (RuntimeError('Could not send result: %r' % e), traceback.format_exc())))
+    finally:
+        auto_sim = None
+        backend.detach(handle)
+        backend.release(handle)
+        conn.close()
@@ -0,0 +1,371 @@
+"""
+Benchmarks of the Power dispatcher and the socket server, run against FakeSimAuto so they work on any machine.
+
+Usage:
+
+    python -m power.benchmark --threads 1,2,4,8 --output results.json
+    python -m power.benchmark --quick --compare results.json
+    python -m power.benchmark --imports power.config,power.power --threads '' --clients ''
+
+Results are written as JSON: the version, platform and settings, and one entry per measurement. Comparing against an
+earlier file prints the relative change of every measurement both files have.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from statistics import median
+
+import gevent
+from gevent import socket
+from geventwebsocket import WebSocketServer, Resource
+
+import power
+from power.backends import FakeBackend
+from power.com.powersocketserver import PowerSocketServer, build_message
+from power.power import Power
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'pareto')
+IMPORTS = ('power.config', 'power.power', 'power.aio', 'power.com', 'power.remote')
+# Dependencies that are slow to import, the modules above should only load them when they're used
+HEAVY = ('gevent', 'geventwebsocket', 'pydispatch', 'numpy', 'msgpack', 'psutil', 'win32com', 'pythoncom')
+
+
+def task_sizes(distribution: str, mean: int, count: int, seed: int=0) -> list:
+    """
+    Number of simulator calls of every task
+
+    :param distribution: 'fixed', 'uniform' between 1 and twice the mean, or 'pareto' for a heavy tail of slow tasks
+    :param mean: Average number of calls
+    :param count: Number of tasks
+    :param seed: Seed, so every run gets the same sizes
+    :return: List of sizes
+    """
+    rng = random.Random(seed)
+    if distribution == 'fixed':
+        return [mean] * count
+    if distribution == 'uniform':
+        return [rng.randint(1, 2 * mean - 1) for _ in range(count)]
+    if distribution == 'pareto':
+        # Shape 1.5 has a mean of 3 times the scale, capped so a single task can't take the whole run
+        return [min(max(1, round(rng.paretovariate(1.5) * mean / 3)), 50 * mean) for _ in range(count)]
+    raise ValueError('Unknown distribution %s' % distribution)
+
+
+def percentiles(values: list) -> dict:
+    """
+    :param values: Latencies in seconds
+    :return: Dictionary with the median, 90th, 99th percentile and maximum
+    """
+    values = sorted(values)
+    if not values:
+        return {'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+    return {
+        'p50': median(values),
+        'p90': values[min(len(values) - 1, int(0.9 * len(values)))],
+        'p99': values[min(len(values) - 1, int(0.99 * len(values)))],
+        'max': values[-1],
+    }
+
+
+def _work(calls, thread_id, auto_sim):
+    for _ in range(calls):
+        auto_sim.GetFieldList('Bus')
+    return calls
+
+
+def bench_dispatch(num_threads: int, mode: str='submit', distribution: str='fixed', tasks: int=200, calls: int=2,
+                   latency: float=0.001, jitter: float=0.2, seed: int=0) -> dict:
+    """
+    Throughput and latency of running tasks through Power
+
+    :param num_threads: Pool size
+    :param mode: 'submit' to queue all tasks at once, or 'add_task' to run rounds of one task per thread
+    :param distribution: Distribution of task sizes, see task_sizes()
+    :param tasks: Number of tasks
+    :param calls: Average number of simulator calls per task
+    :param latency: Seconds every simulator call takes
+    :param jitter: Relative random variation of the latency
+    :param seed: Seed of the task sizes and the latency jitter
+    :return: Dictionary with tasks per second, the overhead compared to the simulator time and latency percentiles
+    """
+    sizes = task_sizes(distribution, calls, tasks, seed)
+    pw = Power(num_threads, backend=FakeBackend(latency=latency, jitter=jitter, seed=seed))
+    pw.create_pw_collection()
+    latencies = []
+    try:
+        started = time.perf_counter()
+        if mode == 'submit':
+            done = {}
+            submitted = {}
+            fs = []
+            for i, size in enumerate(sizes):
+                submitted[i] = time.perf_counter()
+                future = pw.submit(_work, size)
+                future.add_done_callback(lambda f, i=i: done.__setitem__(i, time.perf_counter()))
+                fs.append(future)
+            for future in fs:
+                future.result()
+            latencies = [done[i] - submitted[i] for i in range(len(sizes))]
+        elif mode == 'add_task':
+            # Every round runs the same task on all threads, like a broadcast call
+            rounds = sizes[::num_threads]
+            for size in rounds:
+                round_started = time.perf_counter()
+                pw.add_task(_work, None, size)
+                latencies.append(time.perf_counter() - round_started)
+            tasks = len(rounds) * num_threads
+            sizes = [size for size in rounds for _ in range(num_threads)]
+        else:
+            raise ValueError('Unknown mode %s' % mode)
+        elapsed = time.perf_counter() - started
+    finally:
+        pw.reset()
+    # The time the simulator calls alone would take with perfect parallelism
+    ideal = sum(sizes) * latency / num_threads
+    return dict({
+        'benchmark': 'dispatch',
+        'mode': mode,
+        'threads': num_threads,
+        'distribution': distribution,
+        'tasks': tasks,
+        'elapsed': elapsed,
+        'tasks_per_second': tasks / elapsed,
+        'efficiency': ideal / elapsed if elapsed else 0.0,
+    }, **percentiles(latencies))
+
+
+def bench_import(module: str, repeat: int=5) -> dict:
+    """
+    Time importing a module in a fresh interpreter, as a short-lived tool or worker process would
+
+    :param module: Name of the module
+    :param repeat: Number of interpreters to start, the median counts
+    :return: Dictionary with the import time of the module itself, the startup time of the whole interpreter and the
+        slow dependencies the import loaded
+    """
+    code = 'import sys, %s; print(",".join(m for m in %r if m in sys.modules))' % (module, HEAVY)
+    imports, startups = [], []
+    loaded = ''
+    for _ in range(repeat):
+        started = time.perf_counter()
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        startups.append(time.perf_counter() - started)
+        loaded = process.stdout.strip()
+        # Lines are 'import time: self [us] | cumulative | name', indented by depth
+        for line in process.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module and not fields[2].startswith('  ', 1):
+                imports.append(int(fields[1]) / 1e6)
+    return {
+        'benchmark': 'import',
+        'module': module,
+        'import_time': median(imports) if imports else 0.0,
+        'startup_time': median(startups),
+        'heavy': loaded.split(',') if loaded else [],
+    }
+
+
+class _BenchmarkSocketServer(PowerSocketServer):
+    """PowerSocketServer with queues big enough to never drop a message, so every client receives all of them"""
+    queue_size = 10 ** 6
+
+
+class _Client:
+    """Minimal WebSocket client that counts the messages it receives"""
+    def __init__(self, address):
+        self.sock = socket.create_connection(address)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall(('GET /socket HTTP/1.1\r\nHost: %s:%s\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                           'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n' % (address + (key,))).encode())
+        self.buffer = b''
+        while b'\r\n\r\n' not in self.buffer:
+            self.buffer += self.sock.recv(4096)
+        self.buffer = self.buffer.split(b'\r\n\r\n', 1)[1]
+        self.received = 0
+
+    def _read(self, n: int) -> bytes:
+        while len(self.buffer) < n:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('Server closed the connection')
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def receive(self) -> bytes:
+        """Read one frame, server frames aren't masked"""
+        header = self._read(2)
+        length = header[1] & 0x7f
+        if length == 126:
+            length = int.from_bytes(self._read(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(self._read(8), 'big')
+        self.received += 1
+        return self._read(length)
+
+    def receive_many(self, n: int):
+        for _ in range(n):
+            self.receive()
+
+    def close(self):
+        self.sock.close()
+
+
+def bench_broadcast(clients: int, messages: int=100, size: int=1024) -> dict:
+    """
+    Throughput of PowerSocketServer.broadcast to a number of local clients
+
+    :param clients: Number of connected clients
+    :param messages: Number of messages to broadcast
+    :param size: Approximate size of a message in bytes
+    :return: Dictionary with messages delivered per second, the time spent in broadcast() itself and the maximum
+        time a message waited in a send queue
+    """
+    server = WebSocketServer(('127.0.0.1', 0), Resource([('^/socket', _BenchmarkSocketServer)]))
+    server.start()
+    connected = []
+    try:
+        address = server.address[:2]
+        connected = [_Client(address) for _ in range(clients)]
+        # Every client first gets the config
+        gevent.joinall([gevent.spawn(client.receive) for client in connected], raise_error=True)
+        while len(PowerSocketServer.connections) < clients:
+            gevent.sleep(0.001)
+        sender = next(iter(PowerSocketServer.connections))
+        message = build_message(200, state={'payload': 'x' * size})
+        readers = [gevent.spawn(client.receive_many, messages) for client in connected]
+        started = time.perf_counter()
+        send_time = 0.0
+        for _ in range(messages):
+            send_started = time.perf_counter()
+            sender.broadcast(message)
+            send_time += time.perf_counter() - send_started
+            # Let the readers run, like a server busy with other work would
+            gevent.sleep(0)
+        gevent.joinall(readers, raise_error=True)
+        elapsed = time.perf_counter() - started
+        max_lag = max(stats['max_lag'] for stats in PowerSocketServer.client_stats())
+    finally:
+        for client in connected:
+            client.close()
+        server.stop()
+        for connection in list(PowerSocketServer.connections):
+            connection.on_close('Benchmark done')
+    return {
+        'benchmark': 'broadcast',
+        'clients': clients,
+        'messages': messages,
+        'size': size,
+        'elapsed': elapsed,
+        'deliveries_per_second': clients * messages / elapsed,
+        'broadcast_mean': send_time / messages,
+        'max_lag': max_lag,
+    }
+
+
+def run(threads=(1, 2, 4, 8), modes=('submit', 'add_task'), distributions=DISTRIBUTIONS, tasks=200, calls=2,
+        latency=0.001, jitter=0.2, clients=(1, 10, 50), messages=100, size=1024, seed=0, imports=IMPORTS) -> dict:
+    """
+    Run all benchmarks
+
+    :return: Dictionary with the environment, the settings and a list of results
+    """
+    settings = {'tasks': tasks, 'calls': calls, 'latency': latency, 'jitter': jitter, 'messages': messages,
+                'size': size, 'seed': seed}
+    results = []
+    for mode in modes:
+        for distribution in distributions:
+            for num_threads in threads:
+                results.append(bench_dispatch(num_threads, mode, distribution, tasks, calls, latency, jitter, seed))
+    for n in clients:
+        results.append(bench_broadcast(n, messages, size))
+    for module in imports:
+        results.append(bench_import(module))
+    return {
+        'version': power.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.time(),
+        'settings': settings,
+        'results': results,
+    }
+
+
+def _identity(result: dict) -> tuple:
+    """Fields that identify a measurement, so results of different runs can be matched"""
+    return tuple((k, result[k]) for k in ('benchmark', 'mode', 'threads', 'distribution', 'clients', 'module')
+                 if k in result)
+
+
+def compare(old: dict, new: dict) -> list:
+    """
+    Relative change of the main figures of every measurement in both runs
+
+    :param old: Output of an earlier run()
+    :param new: Output of run()
+    :return: List of (identity, figure, old value, new value, relative change) tuples
+    """
+    figures = ('tasks_per_second', 'p99', 'deliveries_per_second', 'import_time')
+    previous = {_identity(result): result for result in old['results']}
+    changes = []
+    for result in new['results']:
+        before = previous.get(_identity(result))
+        if before is None:
+            continue
+        for figure in figures:
+            if figure in result and before.get(figure):
+                changes.append((_identity(result), figure, before[figure], result[figure],
+                                result[figure] / before[figure] - 1))
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Power dispatcher and socket server')
+    parser.add_argument('--threads', default='1,2,4,8', help='Comma separated pool sizes')
+    parser.add_argument('--modes', default='submit,add_task')
+    parser.add_argument('--distributions', default=','.join(DISTRIBUTIONS))
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--calls', type=int, default=2, help='Average simulator calls per task')
+    parser.add_argument('--latency', type=float, default=0.001, help='Seconds per simulator call')
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--clients', default='1,10,50', help='Comma separated numbers of socket clients')
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--imports', default=','.join(IMPORTS), help='Comma separated modules to time importing')
+    parser.add_argument('--size', type=int, default=1024, help='Bytes per broadcast message')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help='Small run for a quick check')
+    parser.add_argument('--output', help='Write the results to this JSON file instead of stdout')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.threads, args.tasks, args.clients, args.messages = '1,4', 40, '1,10', 20
+    results = run([int(n) for n in args.threads.split(',') if n], args.modes.split(','),
+                  args.distributions.split(','), args.tasks, args.calls, args.latency, args.jitter,
+                  [int(n) for n in args.clients.split(',') if n], args.messages, args.size, args.seed,
+                  [module for module in args.imports.split(',') if module])
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)
+        for identity, figure, before, after, change in compare(old, results):
+            print('%-60s %-22s %12.4g %12.4g %+7.1f%%' % (
+                ' '.join('%s=%s' % field for field in identity), figure, before, after, 100 * change),
+                file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
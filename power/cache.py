@@ -0,0 +1,185 @@
+import hashlib
+import logging as log
+import os
+import pickle
+import sqlite3
+import time
+from threading import Lock
+from typing import Callable
+
+from power.store import qualified_name
+
+
+class ResultCache:
+    """
+    Persistent cache of task results, stored in a SQLite database.
+
+    Results are keyed on a hash of the task function (its module, name and bytecode, so editing the function
+    invalidates its results), the case it declares (the file contents and modifications) and its arguments. Arguments
+    and results have to be picklable, tasks with arguments that aren't are simply not cached. Exceptions are never
+    cached.
+
+    Usage:
+
+    Tasks submitted without a thread are looked up in the cache first, cache hits never reach a simulator
+    >>> pw = Power(4, cache=ResultCache('results.db', max_bytes=2 ** 30))
+    Opt out for a single method
+    >>> future = pw.submit(Task(threaded_func, cache=False))
+
+    Drop results of a method or case after changing something the key doesn't cover
+    >>> pw.cache.invalidate(f=threaded_func)
+
+    :param path: Path of the SQLite database, created if it doesn't exist
+    :param max_bytes: Optional maximum total size of the stored results. The least recently used ones are evicted.
+    :type hits: int
+    :type misses: int
+    """
+    def __init__(self, path: str, max_bytes: int=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        # Memoized file hashes by (path, size, modification time)
+        self._fingerprints = {}
+        # Results are stored from the worker threads
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, function TEXT, "case" TEXT, '
+                         'value BLOB, size INTEGER, accessed REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def key(self, f: Callable, case_key: tuple, args: tuple, kwargs: dict) -> str:
+        """
+        Stable key of a task
+
+        :param f: Task function
+        :param case_key: Tuple of case and modifications, or None
+        :param args: Positional arguments
+        :param kwargs: Named arguments
+        :return: Hex digest, or None if the arguments can't be pickled
+        """
+        try:
+            arguments = pickle.dumps((args, sorted(kwargs.items())), protocol=4)
+        except Exception as e:
+            log.debug('Not caching %s: %r', qualified_name(f), e)
+            return None
+        digest = hashlib.sha256()
+        digest.update(qualified_name(f).encode())
+        code = getattr(f, '__code__', None)
+        if code is not None:
+            digest.update(code.co_code)
+            digest.update(repr(code.co_consts).encode())
+        if case_key is not None:
+            case, modifications = case_key
+            digest.update(self._fingerprint(case).encode())
+            digest.update(repr(modifications).encode())
+        digest.update(arguments)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> tuple:
+        """
+        Look up a result
+
+        :param key: Key returned by key()
+        :return: Tuple of a hit flag and the result
+        """
+        with self._lock:
+            row = self._db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+        return True, pickle.loads(row[0])
+
+    def put(self, key: str, f: Callable, case_key: tuple, result):
+        """
+        Store a result, evicting the least recently used ones if the cache grows too big
+
+        :param key: Key returned by key()
+        :param f: Task function
+        :param case_key: Tuple of case and modifications, or None
+        :param result: Return value of the task function
+        """
+        try:
+            value = pickle.dumps(result, protocol=4)
+        except Exception as e:
+            log.debug('Not caching result of %s: %r', qualified_name(f), e)
+            return
+        case = case_key[0] if case_key is not None else None
+        with self._lock:
+            old = self._db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, qualified_name(f), case, value, len(value), time.time()))
+            self._size += len(value) - (old[0] if old else 0)
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                self._evict()
+
+    def invalidate(self, f: Callable=None, case: str=None) -> int:
+        """
+        Remove the results of a function, a case, or both. Removes everything if neither is provided.
+
+        :param f: Optional task function
+        :param case: Optional path of a case
+        :return: Number of results removed
+        """
+        conditions, parameters = [], []
+        if f is not None:
+            conditions.append('function = ?')
+            parameters.append(qualified_name(f))
+        if case is not None:
+            conditions.append('"case" = ?')
+            parameters.append(case)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        with self._lock:
+            removed = self._db.execute('DELETE FROM results' + where, parameters).rowcount
+            self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        return removed
+
+    def clear(self):
+        """Remove all results"""
+        self.invalidate()
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def _evict(self):
+        """Remove the least recently used results until the cache fits, must be called with the lock held"""
+        # Only reads as many rows as needed
+        rows = self._db.execute('SELECT key, size FROM results ORDER BY accessed')
+        evicted = []
+        for key, size in rows:
+            if self._size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+        rows.close()
+        self._db.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+    def _fingerprint(self, case: str) -> str:
+        """
+        Hash of the contents of a case file, memoized as long as its size and modification time don't change
+
+        :param case: Path of the case
+        :return: Hex digest, or the path itself if the file doesn't exist here
+        """
+        try:
+            stat = os.stat(case)
+        except OSError:
+            return case
+        memo = (case, stat.st_size, stat.st_mtime_ns)
+        if memo not in self._fingerprints:
+            digest = hashlib.sha256()
+            with open(case, 'rb') as file:
+                for chunk in iter(lambda: file.read(2 ** 20), b''):
+                    digest.update(chunk)
+            self._fingerprints[memo] = digest.hexdigest()
+        return self._fingerprints[memo]
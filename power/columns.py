@@ -0,0 +1,114 @@
+from array import array
+from typing import Sequence
+
+from power.lazy import optional
+
+
+def columns(auto_sim, object_type: str, fields: Sequence[str], filter_name: str='', dtypes: dict=None,
+            use_numpy: bool=None) -> dict:
+    """
+    Read fields of all elements of a type in one call, as typed columns. Meant to be called from task functions with
+    the auto_sim they get.
+
+    Usage:
+
+    >>> def read_voltages(thread_id, auto_sim):
+    >>>    buses = columns(auto_sim, 'Bus', ['BusNum', 'BusPUVolt', 'BusAngle'])
+    >>>    return buses['BusNum'][buses['BusPUVolt'] < 0.95]
+
+    :param auto_sim: SimAuto object
+    :param object_type: Object type, e.g. 'Bus'
+    :param fields: Field names
+    :param filter_name: Optional name of a PowerWorld filter
+    :param dtypes: Optional dictionary of field name to 'float', 'int' or 'str'. Fields ending in 'num', before any
+        ':n' suffix like in 'BusNum:1', default to 'int', other fields to 'float'. An int column with blank values
+        becomes a float column with NaN for them.
+    :param use_numpy: Return NumPy arrays, defaults to True if NumPy is installed
+    :return: Dictionary of field name to a NumPy array, or an array.array (list for strings) without NumPy
+    :raises RuntimeError: If SimAuto returns an error
+    """
+    result = auto_sim.GetParametersMultipleElement(object_type, list(fields), filter_name)
+    if result[0]:
+        raise RuntimeError('Could not read %s fields of %s: %s' % (', '.join(fields), object_type, result[0]))
+    return to_columns(result[1], fields, dtypes, use_numpy)
+
+
+def records(auto_sim, object_type: str, fields: Sequence[str], filter_name: str='', dtypes: dict=None,
+            use_numpy: bool=None):
+    """
+    Same as columns(), but returns a row per element
+
+    :return: NumPy record array with a field per column, or a list of tuples without NumPy
+    """
+    cols = columns(auto_sim, object_type, fields, filter_name, dtypes, use_numpy)
+    if _numpy(use_numpy):
+        return optional('numpy').rec.fromarrays([cols[field] for field in fields], names=list(fields))
+    return list(zip(*(cols[field] for field in fields)))
+
+
+def to_columns(data: Sequence[Sequence], fields: Sequence[str], dtypes: dict=None, use_numpy: bool=None) -> dict:
+    """
+    Convert the values returned by a multiple element SimAuto call to typed columns
+
+    :param data: Tuple with a tuple of values per field, the second element of what SimAuto returns. Values can be
+        numbers or strings (as COM returns them), empty strings become NaN in float columns.
+    :param fields: Field names, in the same order
+    :param dtypes: Optional dictionary of field name to 'float', 'int' or 'str', see columns()
+    :param use_numpy: Return NumPy arrays, defaults to True if NumPy is installed
+    :return: Dictionary of field name to column
+    """
+    if data is None:
+        # No elements
+        data = [()] * len(fields)
+    numpy = _numpy(use_numpy)
+    result = {}
+    for field, values in zip(fields, data):
+        dtype = (dtypes or {}).get(field) or _dtype(field)
+        result[field] = _column(values, dtype) if numpy else _column_python(values, dtype)
+    return result
+
+
+def _numpy(use_numpy: bool) -> bool:
+    # Without NumPy, columns are array.array objects and records lists of tuples instead
+    installed = optional('numpy') is not None
+    if use_numpy and not installed:
+        raise ImportError('NumPy is not installed')
+    return installed if use_numpy is None else use_numpy
+
+
+def _dtype(field: str) -> str:
+    """Default type of a field, the ':n' suffix of a field like 'BusNum:1' doesn't count"""
+    return 'int' if field.split(':')[0].lower().endswith('num') else 'float'
+
+
+def _column(values: Sequence, dtype: str):
+    """Convert values to a NumPy array in one go, element by element only if that fails"""
+    np = optional('numpy')
+    if dtype == 'str':
+        return np.array([str(value).strip() for value in values], dtype=str)
+    try:
+        return np.array(values, dtype=np.float64 if dtype == 'float' else np.int64)
+    except (TypeError, ValueError):
+        return np.array(_column_python(values, dtype))
+
+
+def _column_python(values: Sequence, dtype: str):
+    """Convert values to an array.array, or a list for strings"""
+    if dtype == 'str':
+        return [str(value).strip() for value in values]
+    if dtype == 'float':
+        return array('d', (_float(value) for value in values))
+    floats = [_float(value) for value in values]
+    if any(value != value for value in floats):
+        # Blanks, NaN doesn't fit in an int column
+        return array('d', floats)
+    return array('q', (int(value) for value in floats))
+
+
+def _float(value) -> float:
+    """Convert a value to float, blanks (as SimAuto returns for missing values) to NaN"""
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return float('nan')
+    return float(value)
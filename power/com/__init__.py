@@ -1,4 +1,22 @@
-from power.com.signals import Signal
-from power.com.powersocketserver import PowerSocketServer
+import importlib
 
-__all__ = ['Signal', 'PowerSocketServer']
+from power.com.signals import Signal, Topic
+
+__all__ = ['Signal', 'Topic', 'PowerSocketServer', 'StateStore', 'TopicHub', 'CommandQueue', 'CommandRule',
+           'AsyncSocketServer']
+
+# The socket servers pull in gevent, geventwebsocket or pydispatch, so these are only imported when they're first used
+_lazy = {
+    'PowerSocketServer': 'power.com.powersocketserver',
+    'StateStore': 'power.com.state',
+    'TopicHub': 'power.com.hub',
+    'CommandQueue': 'power.com.commands',
+    'CommandRule': 'power.com.commands',
+    'AsyncSocketServer': 'power.com.aioserver',
+}
+
+
+def __getattr__(name: str):
+    if name in _lazy:
+        return getattr(importlib.import_module(_lazy[name]), name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
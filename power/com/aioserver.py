@@ -0,0 +1,415 @@
+import asyncio
+import inspect
+import logging as log
+import time
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+from power import config
+from power.com import Signal, wire
+from power.com.commands import CommandQueue, CommandRule
+from power.com.hub import TopicHub
+from power.com.messages import ClientProtocol, Outbox, ack_command, build_message
+from power.com.state import StateStore
+from pydispatch import dispatcher
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+
+class AsyncCommandQueue(CommandQueue):
+    """
+    Command queue of AsyncSocketServer, dispatching from a task of the running event loop instead of a greenlet. When
+    dispatch returns an awaitable it's awaited before the next message is dispatched, so commands that keep coming
+    while the application is busy are coalesced.
+    """
+    def _start(self):
+        if self._worker is None or self._worker.done():
+            self._ready = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        self._ready.set()
+
+    def close(self):
+        """Stop dispatching, pending messages are dropped"""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._pending.clear()
+
+    async def _run(self):
+        """Main loop of the dispatch task"""
+        while True:
+            key, wait = self._next()
+            if key is None:
+                self._ready.clear()
+                try:
+                    await asyncio.wait_for(self._ready.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            message = self._pending.pop(key)[0]
+            result = self._send(message)
+            if inspect.isawaitable(result):
+                try:
+                    await result
+                except Exception:
+                    log.exception('Could not dispatch command %r', message)
+            await asyncio.sleep(0)
+
+
+class AsyncSocketServer:
+    """
+    The socket server on an asyncio event loop, for applications built on AsyncPower: one loop serves the clients and
+    awaits the simulations, no greenlets or threads wait in between. PowerSocketServer remains for gevent applications.
+
+    Clients talk to it the same way as to PowerSocketServer. They get the full state on connect and deltas after, can
+    resync, subscribe to topics, change the encoding, and pause and resume. Their commands go through a command queue
+    (the same rules and acks, configured by the same config keys) to PW_COMMAND_SIGNAL. Receivers of the signal may be
+    coroutine functions, their coroutine is awaited before the next command is dispatched. Messages sent with
+    UPDATE_UI_SIGNAL reach the clients too, from any thread.
+
+    The WebSocket protocol is handled by the websockets package, including pings and permessage-deflate. Clients can
+    also ask for compressed messages with the encoding command.
+
+    Usage:
+
+    >>> async def main():
+    ...     server = AsyncSocketServer(port=7000, metrics=pw.metrics)
+    ...     await server.start()
+    ...     async with AsyncPower(pw, server) as apw:
+    ...         server.state.update({'voltages': await apw.map(solve, cases)})
+    ...         await server.serve_forever()
+    >>> asyncio.run(main())
+
+    State, the connections and the command queue belong to the event loop, use them from coroutines and callbacks of
+    that loop only.
+
+    :param host: Address to listen on
+    :param port: Port to listen on, defaults to the Port config key or 7000. 0 picks a free port, see port after start()
+    :param metrics: Optional Metrics of a Power object, served at /metrics and put in the state every MetricsInterval
+        seconds (5 by default, 0 to disable)
+    :param max_size: Maximum number of bytes of a message from a client, the connection is closed on larger ones.
+        Compressed messages that decompress to more are rejected.
+    :type connections: set[_AsyncConnection]
+    :type state: StateStore
+    :type hub: TopicHub
+    :type commands: AsyncCommandQueue
+    :type resumed: asyncio.Event
+    """
+    def __init__(self, host: str='127.0.0.1', port: int=None, metrics=None, max_size: int=wire.MAX_SIZE):
+        self.host = host
+        self.port = port if port is not None else config.get('Port', 7000)
+        self.metrics = metrics
+        self.max_size = max_size
+        self.queue_size = config.get('SendQueueSize', 100)
+        self.overflow_policy = config.get('OverflowPolicy', 'drop_oldest')
+        self.connections = set()
+        self.hub = TopicHub()
+        self.state = _LoopStateStore(config.data(), publish=self._publish_delta, window=config.get('StateWindow', 0.05))
+        self.commands = AsyncCommandQueue(
+            self._dispatch, rules={'set': CommandRule(debounce=config.get('SetDebounce', 0.05), coalesce=True,
+                                                      key=('key',))},
+            rate=config.get('CommandRate', 0) or None, burst=config.get('CommandBurst', 20), ack=ack_command)
+        self.paused = config.get('Paused', False)
+        self.resumed = asyncio.Event()
+        if not self.paused:
+            self.resumed.set()
+        self._loop = None
+        self._server = None
+        self._publisher = None
+
+    async def start(self):
+        """Start listening, returns once clients can connect"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await serve(self._handle, self.host, self.port, process_request=self._route,
+                                   max_size=self.max_size)
+        self.port = list(self._server.sockets)[0].getsockname()[1]
+        # Weakly referenced, close() disconnects it
+        dispatcher.connect(self._update_ui, signal=Signal.UPDATE_UI_SIGNAL, sender=dispatcher.Any)
+        if self.metrics is not None:
+            self.metrics.gauge('socket_clients', lambda: len(self.connections))
+            self.metrics.gauge('socket_queued', lambda: sum(stats['queued'] for stats in self.client_stats()))
+            self.metrics.gauge('socket_dropped', lambda: sum(stats['dropped'] for stats in self.client_stats()))
+            self.metrics.gauge('socket_max_lag', lambda: max([stats['max_lag'] for stats in self.client_stats()],
+                                                             default=0.0))
+            self.metrics.gauge('socket_commands_pending', self.commands.pending)
+            interval = config.get('MetricsInterval', 5)
+            if interval:
+                self._publisher = self._loop.create_task(self._publish_metrics(interval))
+        log.info('Listening on %s:%s', self.host, self.port)
+
+    async def serve_forever(self):
+        """Serve clients until cancelled or closed"""
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            if self._server.is_serving():
+                raise
+
+    async def close(self):
+        """Stop listening and close all connections, pending commands are dropped"""
+        dispatcher.disconnect(self._update_ui, signal=Signal.UPDATE_UI_SIGNAL, sender=dispatcher.Any)
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        self.commands.close()
+        if self._server is not None:
+            # Closes the connections too
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def broadcast(self, message):
+        """
+        Queue a message for all connected clients, doesn't wait for it to be sent
+
+        :param message: Message constructed using build_message
+        """
+        for connection in list(self.connections):
+            connection.send(message)
+
+    def publish(self, topic, message=None, state=None) -> int:
+        """
+        Send a message to the clients subscribed to a topic, see PowerSocketServer.publish()
+
+        :return: Number of clients it was sent to
+        """
+        return self.hub.publish(topic, build_message(200, message, state, topic=topic))
+
+    def client_stats(self) -> list:
+        """
+        :return: How far behind every connected client is, see PowerSocketServer.client_stats()
+        """
+        return [connection.outbox.stats() for connection in list(self.connections)]
+
+    def pause(self, connection=None):
+        """
+        Pause the application, AsyncPower queues no new tasks until resume()
+
+        :param connection: Optional connection that asked for it, it gets the new state right away
+        """
+        if self.paused:
+            return
+        self.paused = True
+        self.resumed.clear()
+        log.info('Pause PW')
+        config.put('paused', True)
+        self.state.update({'paused': True})
+        if connection is not None:
+            connection.send(build_message(200, state={'paused': 1}))
+
+    def resume(self, connection=None):
+        """
+        Resume the application
+
+        :param connection: Optional connection that asked for it, it gets the new state right away
+        """
+        if not self.paused:
+            return
+        self.paused = False
+        self.resumed.set()
+        log.info('Resume PW')
+        config.put('paused', False)
+        self.state.update({'paused': False})
+        if connection is not None:
+            connection.send(build_message(200, state={'paused': 0}))
+
+    def _publish_delta(self, delta):
+        self.broadcast(build_message(200, delta=delta))
+
+    async def _dispatch(self, message):
+        """
+        Pass a client command on to the application, awaiting the receivers that are coroutine functions
+
+        :param message: Client message
+        """
+        for receiver, response in dispatcher.send(signal=Signal.PW_COMMAND_SIGNAL, message=message):
+            if inspect.isawaitable(response):
+                await response
+
+    def _update_ui(self, message, topic=None):
+        """
+        UPDATE_UI_SIGNAL handler, see handle_ui_update(). The signal may be sent from any thread.
+        """
+        if not message or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not self._loop:
+            self._loop.call_soon_threadsafe(self._update_ui, message, topic)
+        elif topic is None:
+            self.broadcast(message)
+        else:
+            self.hub.publish(topic, message)
+
+    async def _publish_metrics(self, interval: float):
+        """Put a metrics snapshot in the state every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            self.state.update({'metrics': self.metrics.snapshot()})
+
+    def _route(self, ws: ServerConnection, request):
+        """Answer plain HTTP requests, WebSocket handshakes on /socket go on to _handle()"""
+        path = urlsplit(request.path).path
+        if path.startswith('/metrics') and self.metrics is not None:
+            response = ws.respond(200, self.metrics.prometheus())
+            del response.headers['Content-Type']
+            response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+            return response
+        if not path.startswith('/socket'):
+            return ws.respond(404, 'Not found\n')
+        return None
+
+    async def _handle(self, ws: ServerConnection):
+        """Serve one WebSocket client"""
+        await _AsyncConnection(self, ws).serve(parse_qs(urlsplit(ws.request.path).query))
+
+
+class _AsyncConnection(ClientProtocol):
+    """
+    A client of AsyncSocketServer, like a PowerSocketServer connection
+
+    :type server: AsyncSocketServer
+    :type ws: ServerConnection
+    :type outbox: _AsyncOutbox
+    """
+    def __init__(self, server: AsyncSocketServer, ws: ServerConnection):
+        self.server = server
+        self.ws = ws
+        self.outbox = None
+        self._closing = None
+
+    @property
+    def state(self) -> StateStore:
+        return self.server.state
+
+    @property
+    def hub(self) -> TopicHub:
+        return self.server.hub
+
+    @property
+    def commands(self) -> AsyncCommandQueue:
+        return self.server.commands
+
+    async def serve(self, query: dict):
+        """
+        Send the state and handle messages until the client goes away
+
+        :param query: Parsed query string of the handshake
+        """
+        log.info('Client connected')
+        self.outbox = _AsyncOutbox(self, self.server.queue_size, self.server.overflow_policy)
+        # Config changes made since the last client connected reach the others as a delta, before this one joins them
+        self.state.update(config.data())
+        self.state.flush()
+        self.server.connections.add(self)
+        reason = 'Client closed'
+        try:
+            if 'encoding' in query or 'compress' in query:
+                error = self.set_encoding(query.get('encoding', ['json'])[0], query.get('compress', [0])[0])
+                if error:
+                    self.send(build_message(400, error))
+            # Send full state whenever a client connects
+            revision, state = self.state.snapshot()
+            self.send(build_message(200, state=state, revision=revision))
+            async for message in self.ws:
+                self.on_message(message)
+        except ConnectionClosed as e:
+            reason = str(e)
+        finally:
+            self.server.connections.discard(self)
+            self.hub.unsubscribe(self)
+            self.outbox.close()
+            log.info('Connection closed: %s', reason)
+
+    def on_message(self, message):
+        """
+        Message received handler, see PowerSocketServer.on_message()
+
+        :param message: Message received from client, str for text frames or bytes for binary ones
+        """
+        try:
+            message = wire.decode(message, self.server.max_size)
+        except ValueError:
+            self.send(build_message(400, 'Invalid JSON'))
+            return
+        if self.check_resync(message) or self.check_subscribe(message) or self.check_encoding(message):
+            return
+        # Pausing first, so it's never dropped by the rate limit
+        if isinstance(message, dict) and message.get('command') == 'pause':
+            self.server.pause(self)
+        elif isinstance(message, dict) and message.get('command') == 'resume':
+            self.server.resume(self)
+        # Queue message for the application, dropped if the client sends too many
+        self.commands.submit(message, self)
+
+    def send(self, message):
+        """
+        Queue a message for this client only, doesn't wait for it to be sent
+
+        :param message: Message constructed using build_message
+        """
+        if self.outbox is not None:
+            self.outbox.put(message)
+
+    async def write(self, data):
+        """
+        Write a message in the wire format to the socket
+
+        :param data: String for a text frame or bytes for a binary frame
+        """
+        await self.ws.send(data)
+
+    def close(self):
+        """Close the connection without waiting, e.g. when the client is too far behind"""
+        if self._closing is None:
+            self._closing = asyncio.get_running_loop().create_task(self.ws.close(1008, 'Too far behind'))
+
+
+class _AsyncOutbox(Outbox):
+    """
+    Outbox written to the socket by a task of the event loop
+
+    :type ws: _AsyncConnection
+    """
+    def _start(self):
+        self._ready = asyncio.Event()
+        self._writer = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        """Main loop of the writer task"""
+        while True:
+            while not self.messages and not self.closed:
+                self._ready.clear()
+                await self._ready.wait()
+            if self.closed:
+                return
+            queued_at, message = self.messages.popleft()
+            try:
+                await self.ws.write(wire.encode(message, self.encoding, self.compress))
+            except (ConnectionClosed, OSError) as e:
+                log.info('Client gone, stop sending: %r', e)
+                self.close()
+                return
+            self.sent += 1
+            self.lag = time.monotonic() - queued_at
+            self.max_lag = max(self.max_lag, self.lag)
+
+
+class _LoopStateStore(StateStore):
+    """
+    State store that waits for more changes on the running event loop instead of in a greenlet
+    """
+    def _later(self, delay: float, f: Callable):
+        return asyncio.get_running_loop().call_later(delay, f)
+
+    def _cancel(self, handle):
+        handle.cancel()
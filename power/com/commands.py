@@ -0,0 +1,209 @@
+import itertools
+import logging as log
+import time
+from collections import OrderedDict
+from typing import Callable
+from weakref import WeakKeyDictionary
+
+
+class CommandRule:
+    """
+    How the command queue treats the messages of one command
+
+    :param debounce: Seconds to hold a message before it's dispatched, a newer message with the same key restarts the
+        wait when coalescing, so a burst is dispatched once it's over
+    :param coalesce: Only dispatch the latest of the pending messages with the same key, for commands that set a value
+        and where only the last value matters
+    :param key: Names of the message fields that, with the command, tell which value a message sets
+    :param max_delay: Optional maximum number of seconds a message is held while newer ones keep arriving, so a client
+        dragging a slider still sees results along the way
+    """
+    def __init__(self, debounce: float=0.0, coalesce: bool=False, key: tuple=(), max_delay: float=None):
+        self.debounce = debounce
+        self.coalesce = coalesce
+        self.key = tuple(key)
+        self.max_delay = max_delay
+
+
+class CommandQueue:
+    """
+    Sits between the clients of the socket server and the consumers of PW_COMMAND_SIGNAL, so a burst of slider moves
+    from the UI doesn't turn into a burst of simulator runs.
+
+    Messages are dispatched by a greenlet of their own (a task with AsyncCommandQueue of power.com.aioserver), in the
+    order they arrived, once their debounce window is over. A coalesced message takes the place of the pending one
+    with the same command and key: the consumer only sees the latest requested value. Commands without a rule are
+    dispatched as soon as the dispatcher gets to them.
+
+    Every client may send rate messages per second on average, with bursts of up to burst messages. Messages over that
+    are dropped.
+
+    Senders get an acknowledgement right away through ack, called with the sender, the message and its status:
+    'queued', 'rate_limited', or later 'superseded' when a newer message replaced it.
+
+    Usage:
+
+    >>> queue = CommandQueue(print, rules={'set': CommandRule(debounce=0.05, coalesce=True, key=('key',))})
+    >>> for value in range(10):
+    ...     queue.submit({'command': 'set', 'key': 'load', 'value': value})
+    After 50ms only the last value is dispatched
+    {'command': 'set', 'key': 'load', 'value': 9}
+
+    Like the rest of the socket server, it should be used from the thread of the gevent hub, or the event loop with
+    AsyncCommandQueue.
+
+    :param dispatch: Method called with every message to pass on
+    :param rules: Optional dictionary of command to CommandRule
+    :param rate: Optional number of messages per second every client may send, unlimited if not set
+    :param burst: Number of messages a client may send at once
+    :param ack: Optional method called with the sender, the message and its status
+    :type rules: dict[str, CommandRule]
+    """
+    def __init__(self, dispatch: Callable, rules: dict=None, rate: float=None, burst: int=10, ack: Callable=None):
+        self.dispatch = dispatch
+        self.rules = dict(rules or {})
+        self.rate = rate
+        self.burst = burst
+        self.ack = ack
+        self.received = 0
+        self.dispatched = 0
+        self.superseded = 0
+        self.rate_limited = 0
+        # Key to [message, sender, time it's due, latest time it's due], in the order they arrived
+        self._pending = OrderedDict()
+        self._sequence = itertools.count()
+        # Sender to [tokens, time of the last refill]
+        self._buckets = WeakKeyDictionary()
+        # Set whenever there is something new for the dispatcher
+        self._ready = None
+        self._worker = None
+
+    def rule(self, command: str, **kwargs):
+        """
+        Set the rule of a command, see CommandRule for the arguments
+
+        >>> PowerSocketServer.commands.rule('set_load', debounce=0.1, coalesce=True, key=('bus',), max_delay=1)
+
+        :param command: Name of the command
+        """
+        self.rules[command] = CommandRule(**kwargs)
+
+    def submit(self, message, sender=None) -> str:
+        """
+        Queue a message for dispatch
+
+        :param message: Decoded client message
+        :param sender: Optional object the message came from, e.g. the connection, used for rate limits and acks. Must
+            support weak references if there is a rate limit.
+        :return: 'queued', or 'rate_limited' if it was dropped
+        """
+        self.received += 1
+        if not self._allow(sender):
+            self.rate_limited += 1
+            self._ack(sender, message, 'rate_limited')
+            return 'rate_limited'
+        rule = self.rules.get(message.get('command')) if isinstance(message, dict) else None
+        now = time.monotonic()
+        if rule is not None and rule.coalesce:
+            key = (message.get('command'),) + tuple(repr(message.get(field)) for field in rule.key)
+        else:
+            key = next(self._sequence)
+        entry = self._pending.get(key)
+        if entry is not None:
+            # Last value wins, in the place of the first so the order of different commands is kept
+            self.superseded += 1
+            self._ack(entry[1], entry[0], 'superseded')
+            entry[0], entry[1] = message, sender
+            entry[2] = min(now + rule.debounce, entry[3])
+        else:
+            debounce = rule.debounce if rule is not None else 0.0
+            max_delay = rule.max_delay if rule is not None and rule.max_delay is not None else float('inf')
+            self._pending[key] = [message, sender, now + debounce, now + max(debounce, max_delay)]
+        self._ack(sender, message, 'queued')
+        self._start()
+        return 'queued'
+
+    def flush(self):
+        """Dispatch all pending messages now, e.g. before shutting down"""
+        while self._pending:
+            self._send(self._pending.popitem(last=False)[1][0])
+
+    def pending(self) -> int:
+        """
+        :return: Number of messages waiting to be dispatched
+        """
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        """
+        :return: Dictionary with the number of received, dispatched, superseded, rate limited and pending messages
+        """
+        return {'received': self.received, 'dispatched': self.dispatched, 'superseded': self.superseded,
+                'rate_limited': self.rate_limited, 'pending': len(self._pending)}
+
+    def _allow(self, sender) -> bool:
+        """Take a token from the bucket of a sender, if it has one"""
+        if not self.rate or sender is None:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(sender)
+        if bucket is None:
+            bucket = self._buckets[sender] = [float(self.burst), now]
+        bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _ack(self, sender, message, status: str):
+        if self.ack is None or sender is None:
+            return
+        try:
+            self.ack(sender, message, status)
+        except Exception:
+            log.exception('Could not acknowledge command')
+
+    def _send(self, message):
+        """
+        :return: Return value of dispatch, None if it failed
+        """
+        self.dispatched += 1
+        try:
+            return self.dispatch(message)
+        except Exception:
+            log.exception('Could not dispatch command %r', message)
+
+    def _next(self) -> tuple:
+        """
+        :return: Tuple of the key of the first message that is due, or None, and the seconds until the first one is
+            due, None if nothing is pending
+        """
+        if not self._pending:
+            return None, None
+        now = time.monotonic()
+        key = next((key for key, entry in self._pending.items() if entry[2] <= now), None)
+        return key, (None if key is not None else min(entry[2] for entry in self._pending.values()) - now)
+
+    def _start(self):
+        """Start the dispatch greenlet if it isn't running, and wake it up"""
+        # Only the gevent socket server needs gevent, see AsyncCommandQueue
+        import gevent
+        from gevent.event import Event
+        if self._worker is None or self._worker.dead:
+            self._ready = Event()
+            self._worker = gevent.spawn(self._run)
+        self._ready.set()
+
+    def _run(self):
+        """Main loop of the dispatch greenlet"""
+        import gevent
+        while True:
+            key, wait = self._next()
+            if key is None:
+                self._ready.clear()
+                self._ready.wait(wait)
+                continue
+            self._send(self._pending.pop(key)[0])
+            # Let the socket greenlets queue and coalesce more in between
+            gevent.sleep(0)
@@ -0,0 +1,77 @@
+import logging as log
+
+
+class TopicHub:
+    """
+    Delivers messages to the subscribers of a topic, every subscriber gets the same serialized message.
+
+    Subscribers are any objects with a send(message) method, normally PowerSocketServer connections. They have to
+    unsubscribe when they go away, the hub keeps strong references.
+
+    Usage:
+
+    >>> hub = TopicHub()
+    >>> hub.subscribe(connection, Topic.BUS_VOLTAGES, Topic.RUN_STATUS)
+    >>> hub.publish(Topic.BUS_VOLTAGES, build_message(200, state={'voltages': voltages}, topic=Topic.BUS_VOLTAGES))
+    1
+    >>> hub.unsubscribe(connection)
+
+    Subscribing to ALL ('*') gets the messages of every topic.
+
+    :type _subscribers: dict[str, set]
+    """
+    ALL = '*'
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, subscriber, *topics: str):
+        """
+        :param subscriber: Object with a send() method
+        :param topics: Names of the topics
+        """
+        for topic in topics:
+            self._subscribers.setdefault(topic, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber, *topics: str):
+        """
+        :param subscriber: Object that subscribed
+        :param topics: Names of the topics, unsubscribes from all if none are provided
+        """
+        for topic in topics or list(self._subscribers):
+            subscribers = self._subscribers.get(topic)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    def topics(self, subscriber) -> set:
+        """
+        :param subscriber: Object that subscribed
+        :return: Set of topic names the subscriber gets messages of
+        """
+        return {topic for topic, subscribers in self._subscribers.items() if subscriber in subscribers}
+
+    def subscribers(self, topic: str) -> set:
+        """
+        :param topic: Name of the topic
+        :return: Set of subscribers that get messages of the topic, including those subscribed to ALL
+        """
+        return self._subscribers.get(topic, set()) | self._subscribers.get(self.ALL, set())
+
+    def publish(self, topic: str, message) -> int:
+        """
+        Send a message to the subscribers of a topic
+
+        :param topic: Name of the topic
+        :param message: Serialized message, sent as is
+        :return: Number of subscribers it was sent to
+        """
+        subscribers = self.subscribers(topic)
+        for subscriber in subscribers:
+            try:
+                subscriber.send(message)
+            except Exception:
+                log.exception('Could not send %s message', topic)
+        return len(subscribers)
@@ -0,0 +1,230 @@
+import json
+import logging as log
+import time
+from collections import deque
+
+from power.com import wire
+
+
+def build_message(status, message=None, state=None, revision=None, delta=None, topic=None):
+    """
+    Build message string to send to connected clients.
+
+    :param status: HTTP status code of the message, int
+    :param message: Optional free-form message to display to the client, can be string or dictionary.
+        Either this, state or delta should be set.
+    :param state: Optional state to pass to the client. This can be the full state by passing in config.data() or a
+        subset that you define yourself. Should be a dictionary. Either this, message or delta should be set.
+    :param revision: Optional revision of the StateStore that state is the full state of
+    :param delta: Optional delta of the StateStore, see StateStore
+    :param topic: Optional topic the message is published on, see TopicHub
+    :return: JSON string, a wire.Message. It keeps message, state and delta to pack them for msgpack clients when it's
+        sent, so don't change them after.
+    """
+    # The server needs to send either a message or state to inform other clients what's going on.
+    # The client sending a command will know that its action was successful and can update its UI, but the other
+    # clients would only know that something was successful, not what.
+    if message is None and state is None and delta is None:
+        raise ValueError('Either message, state or delta should be set')
+    msg = {'status': status, 'message': message, 'state': state}
+    if revision is not None:
+        msg['revision'] = revision
+    if delta is not None:
+        msg['delta'] = delta
+    if topic is not None:
+        msg['topic'] = topic
+    return wire.message(msg)
+
+
+def ack_command(connection, message, status):
+    """
+    Tell a client what became of its command, before the application got it
+
+    :param connection: Connection the command came from, with a send() method
+    :param message: Client message
+    :param status: 'queued', 'superseded' or 'rate_limited'
+    """
+    message = message if isinstance(message, dict) else {}
+    ack = {'command': message.get('command'), 'status': status}
+    if message.get('id') is not None:
+        ack['id'] = message['id']
+    connection.send(build_message(429 if status == 'rate_limited' else 202, ack))
+
+
+class ClientProtocol:
+    """
+    Commands every socket server answers itself, they mean nothing to the application. Shared by PowerSocketServer and
+    AsyncSocketServer, which provide state (a StateStore), hub (a TopicHub), outbox (an Outbox) and send().
+    """
+    def check_subscribe(self, message):
+        """
+        Handle subscribe and unsubscribe commands, and tell the client what it is subscribed to
+
+        :param message: Client message
+        :return: True if it was one of these commands
+        """
+        if not isinstance(message, dict) or message.get('command') not in ('subscribe', 'unsubscribe'):
+            return False
+        topics = message.get('topics', [])
+        topics = [topics] if isinstance(topics, str) else [str(topic) for topic in topics]
+        if message['command'] == 'subscribe':
+            self.hub.subscribe(self, *topics)
+        elif topics:
+            self.hub.unsubscribe(self, *topics)
+        else:
+            self.hub.unsubscribe(self)
+        self.send(build_message(200, {'topics': sorted(self.hub.topics(self))}))
+        return True
+
+    def check_resync(self, message):
+        """
+        Answer a resync command with a delta from the revision the client has, or the full state
+
+        :param message: Client message
+        :return: True if it was a resync command
+        """
+        if not isinstance(message, dict) or message.get('command') != 'resync':
+            return False
+        try:
+            delta = self.state.since(int(message.get('revision')))
+        except (TypeError, ValueError):
+            delta = None
+        if delta is not None:
+            self.send(build_message(200, delta=delta))
+        else:
+            revision, state = self.state.snapshot()
+            self.send(build_message(200, state=state, revision=revision))
+        return True
+
+    def set_encoding(self, encoding, compress=0):
+        """
+        Change the format of the messages sent to this client
+
+        :param encoding: 'json' or 'msgpack'
+        :param compress: Compress messages of at least this many bytes, 0 to never compress
+        :return: Error message, or None if the format was changed
+        """
+        if not wire.available(encoding):
+            return 'Encoding %s is not available' % encoding
+        try:
+            compress = max(0, int(compress or 0))
+        except (TypeError, ValueError):
+            return 'Invalid compress value %s' % compress
+        self.outbox.encoding, self.outbox.compress = encoding, compress
+        return None
+
+    def check_encoding(self, message):
+        """
+        Handle the encoding command
+
+        :param message: Client message
+        :return: True if it was the encoding command
+        """
+        if not isinstance(message, dict) or message.get('command') != 'encoding':
+            return False
+        error = self.set_encoding(message.get('encoding', 'json'), message.get('compress', 0))
+        if error:
+            self.send(build_message(400, error))
+        else:
+            self.send(build_message(200, {'encoding': self.outbox.encoding, 'compress': self.outbox.compress}))
+        return True
+
+
+class Outbox:
+    """
+    Bounded queue of outgoing messages of a single connection, written to the socket by a writer of its own, so a slow
+    client only falls behind itself. Subclasses start the writer for their event loop in _start().
+
+    :param ws: WebSocket to write to
+    :param size: Maximum number of queued messages
+    :param policy: What to do when the queue is full: 'drop_oldest', 'coalesce' or 'disconnect'
+    :type messages: deque
+    :type encoding: str
+    :type compress: int
+    """
+    policies = ('drop_oldest', 'coalesce', 'disconnect')
+
+    def __init__(self, ws, size: int, policy: str='drop_oldest'):
+        if policy not in self.policies:
+            raise ValueError('Unknown overflow policy %s' % policy)
+        self.ws = ws
+        self.size = max(1, size)
+        self.policy = policy
+        # Elements are (time queued, message) tuples
+        self.messages = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.closed = False
+        # Messages are queued as JSON and converted when written, see wire.encode()
+        self.encoding = 'json'
+        self.compress = 0
+        # Set whenever there is something for the writer to do
+        self._ready = None
+        self._writer = None
+        self._start()
+
+    def put(self, message):
+        """
+        Queue a message, applying the overflow policy if the queue is full
+
+        :param message: JSON string
+        """
+        if self.closed:
+            return
+        if len(self.messages) >= self.size:
+            if self.policy == 'disconnect':
+                log.warning('Disconnecting client that is %s messages behind', len(self.messages))
+                self.dropped += len(self.messages) + 1
+                self.close()
+                self.ws.close()
+                return
+            if self.policy == 'coalesce':
+                self._coalesce()
+            # Coalescing doesn't help if nothing in the queue is a state update
+            while len(self.messages) >= self.size:
+                self.messages.popleft()
+                self.dropped += 1
+        self.messages.append((time.monotonic(), message))
+        self._ready.set()
+
+    def close(self):
+        """Stop writing, queued messages are dropped"""
+        self.closed = True
+        self.messages.clear()
+        self._ready.set()
+
+    def stats(self) -> dict:
+        """
+        :return: Dictionary with the queue length, counts and lag in seconds
+        """
+        return {'queued': len(self.messages), 'sent': self.sent, 'dropped': self.dropped, 'lag': self.lag,
+                'max_lag': self.max_lag, 'policy': self.policy}
+
+    def _coalesce(self):
+        """
+        Merge the queued state updates of every topic into a single one at the end of the queue, updates without a
+        topic count as a topic of their own. Full states and deltas of the state store are kept as they are, the store
+        already coalesces those.
+        """
+        # Topic to [time queued of the oldest update, merged state], in the order the topics first appear
+        merged, kept = {}, deque()
+        for item in self.messages:
+            message = json.loads(item[1])
+            if message['status'] == 200 and message['message'] is None and isinstance(message['state'], dict) and \
+                    'revision' not in message:
+                # Lag counts from the oldest update it replaces
+                merged.setdefault(message.get('topic'), [item[0], {}])[1].update(message['state'])
+            else:
+                kept.append(item)
+        if not merged:
+            return
+        self.dropped += len(self.messages) - len(kept) - len(merged)
+        for topic, (queued_at, state) in merged.items():
+            kept.append((queued_at, build_message(200, state=state, topic=topic)))
+        self.messages = kept
+
+    def _start(self):
+        """Create _ready and start the writer"""
+        raise NotImplementedError
@@ -1,89 +1,197 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import json
 import logging as log
+import time
+from threading import Event
+from urllib.parse import parse_qs
 
-from power.com import Signal
+from power.com import Signal, wire
+from power.com.commands import CommandQueue, CommandRule
+from power.com.hub import TopicHub
+from power.com.messages import ClientProtocol, Outbox, ack_command, build_message
+from power.com.state import StateStore
 
+import gevent
+from gevent.event import Event as GeventEvent
 from gevent.lock import BoundedSemaphore
-from geventwebsocket import WebSocketServer, WebSocketApplication, Resource
+from geventwebsocket import WebSocketServer, WebSocketApplication, WebSocketError, Resource
 from power import config
 from pydispatch import dispatcher
 
 
-def build_message(status, message=None, state=None):
+def _publish_delta(delta):
     """
-    Build message string to send to connected clients.
+    Send a delta of the state store to all connected clients
 
-    :param status: HTTP status code of the message, int
-    :param message: Optional free-form message to display to the client, can be string or dictionary.
-        Either this or state should be set.
-    :param state: Optional state to pass to the client. This can be the full state by passing in config.data() or a
-        subset that you define yourself. Should be a dictionary. Either this or message should be set.
-    :return: JSON string
+    :param delta: Delta dictionary
     """
-    # The server needs to send either a message or state to inform other clients what's going on.
-    # The client sending a command will know that its action was successful and can update its UI, but the other
-    # clients would only know that something was successful, not what.
-    if message is None and state is None:
-        raise ValueError('Either  message or state should be set')
-    msg = {'status': status, 'message': message, 'state': state}
-    return json.dumps(msg)
+    message = build_message(200, delta=delta)
+    for connection in list(PowerSocketServer.connections):
+        connection.send(message)
 
 
-class PowerSocketServer(WebSocketApplication):
+def _dispatch_command(message):
     """
-    A socket server to communicate UI updates to connected clients, and receive commands to control PW.
+    Pass a client command on to the application, called by the command queue
+
+    :param message: Client message
+    """
+    dispatcher.send(signal=Signal.PW_COMMAND_SIGNAL, message=message)
+
+
+class _Shared:
+    """
+    Class attribute created on first use, so it's made with the config at that time rather than the one at import
+
+    :param factory: Method returning the value
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.owner = self.name = None
+
+    def __set_name__(self, owner, name):
+        self.owner, self.name = owner, name
+
+    def __get__(self, instance, owner):
+        value = self.factory()
+        # From now on a plain attribute of the class that defines it, shared by subclasses too
+        setattr(self.owner, self.name, value)
+        return value
+
+
+class PowerSocketServer(WebSocketApplication, ClientProtocol):
+    """
+    A socket server to communicate UI updates to connected clients, and receive commands to control PW. Applications
+    on asyncio rather than gevent use AsyncSocketServer, which speaks the same protocol.
 
     The following data format should be followed:
     For the client to the server: { “action”: “foo”, “value”: 1 } - Value is optional
     For the server to the client: {“status”: 200, “message”: “Some message”, “state”: {}} - Message and state are
     optional, but not both at the same time.
+
+    Application state lives in the state store, a StateStore, which starts out with the config when it's first used
+    and picks up config changes whenever a client connects. Change it with PowerSocketServer.state.update() and
+    clients get a delta: {"status": 200, "message": null, "state": null, "delta": {"from": 4, "to": 6, "patch": []}}.
+    A connecting client gets the full state with its revision: {"status": 200, "state": {}, "revision": 6, ...}.
+    A client that missed deltas sends { "command": "resync", "revision": 4 } to get a delta from the revision it has,
+    or the full state if that revision is too old.
+
+    Messages are JSON text by default. A client can ask for MessagePack (if installed) and zlib compression of messages
+    over a number of bytes in the handshake, ws://host:7000/socket?encoding=msgpack&compress=4096, or later with
+    { "command": "encoding", "encoding": "msgpack", "compress": 4096 }. The answer to that command already uses the new
+    format. Anything other than uncompressed JSON is sent as binary frames: one header byte (see wire) and the payload.
+    Clients can send binary frames in the same format.
+
+    Other updates are published on topics (see Topic), only clients that subscribed get them:
+    { "command": "subscribe", "topics": ["bus_voltages", "run_status"] }, and unsubscribe the same way. Publish with
+    PowerSocketServer.publish(), or send UPDATE_UI_SIGNAL with a topic argument. Without a topic the signal still goes
+    to every client.
+
+    Pausing holds sem, which blocks greenlets adding tasks to Power. Plain threads can't use a gevent semaphore, they
+    wait for the resumed event instead.
+
+    Commands reach PW_COMMAND_SIGNAL through the command queue, a CommandQueue, which the sender hears from first:
+    {"status": 202, "message": {"command": "set", "status": "queued", "id": 7}, ...}, with the id the client gave the
+    command if any. Rules per command debounce commands and coalesce the ones that set a value, so the application only
+    recomputes the latest requested state. By default { "command": "set", "key": "load", "value": 1 } is coalesced per
+    key and held for SetDebounce seconds (0.05). The sender of a replaced command gets "superseded". Every client may
+    send CommandRate commands per second (unlimited if not set) in bursts of up to CommandBurst, others are answered
+    with status 429 and dropped. These keys are read when the command queue is first used. Pausing and resuming take
+    effect right away.
+
+    Messages aren't written to the socket right away: every connection has a bounded queue that its own greenlet
+    writes from, so a slow client only falls behind itself. When its queue is full the overflow policy decides:
+    'drop_oldest' drops the oldest message, 'coalesce' merges the queued state updates of every topic into one
+    message with the latest state, and 'disconnect' closes the connection. The queue size and policy are read from the
+    SendQueueSize and OverflowPolicy config keys when a client connects, unless a subclass sets queue_size or
+    overflow_policy. See client_stats() for how far behind every client is.
+
+    :type connections: set[PowerSocketServer]
+    :type state: StateStore
+    :type hub: TopicHub
+    :type outbox: _Outbox
+    :type commands: CommandQueue
     """
     sem = BoundedSemaphore(1)
+    resumed = Event()
+    resumed.set()
+    connections = set()
+    # From the config when a client connects if not set
+    queue_size = None
+    overflow_policy = None
+    state = _Shared(lambda: StateStore(config.data(), publish=_publish_delta, window=config.get('StateWindow', 0.05)))
+    hub = TopicHub()
+    commands = _Shared(lambda: CommandQueue(
+        _dispatch_command, rules={'set': CommandRule(debounce=config.get('SetDebounce', 0.05), coalesce=True,
+                                                     key=('key',))},
+        rate=config.get('CommandRate', 0) or None, burst=config.get('CommandBurst', 20), ack=ack_command))
 
     def __init__(self, ws):
         self.paused = config.get('Paused', False)
-        # Register update UI signal
-        dispatcher.connect(self.handle_ui_update, signal=Signal.UPDATE_UI_SIGNAL, sender=dispatcher.Any)
+        self.outbox = None
         super().__init__(ws)
 
     def on_open(self):
         """ Client connected handler, send new client application state """
         log.info('Client connected')
-        # Send full config whenever a client connects
-        self.ws.send(build_message(200, state=config.data()))
+        queue_size = self.queue_size if self.queue_size is not None else config.get('SendQueueSize', 100)
+        overflow_policy = self.overflow_policy or config.get('OverflowPolicy', 'drop_oldest')
+        self.outbox = _Outbox(self.ws, queue_size, overflow_policy)
+        # Config changes made since the last client connected reach the others as a delta, before this one joins them
+        self.state.update(config.data())
+        self.state.flush()
+        PowerSocketServer.connections.add(self)
+        query = parse_qs(getattr(self.ws, 'environ', {}).get('QUERY_STRING', ''))
+        if 'encoding' in query or 'compress' in query:
+            error = self.set_encoding(query.get('encoding', ['json'])[0], query.get('compress', [0])[0])
+            if error:
+                self.send(build_message(400, error))
+        # Send full state whenever a client connects
+        revision, state = self.state.snapshot()
+        self.send(build_message(200, state=state, revision=revision))
 
     def on_message(self, message, **kwargs):
         """
         Message received handler
 
-        :param message: Message received from client, of type str
+        :param message: Message received from client, str for text frames or bytes for binary ones
         :param kwargs:
         """
         if message is None:
             return
         # Check for invalid JSON
         try:
-            message = json.loads(message)
+            message = wire.decode(message)
         except ValueError:
             # Let the client know about it (only the one who sent it)
-            self.ws.send(build_message(400, 'Invalid JSON'))
+            self.send(build_message(400, 'Invalid JSON'))
         else:
-            # Check for pause
+            # Resyncing and the like are handled here, they mean nothing to the application
+            if self.check_resync(message) or self.check_subscribe(message) or self.check_encoding(message):
+                return
+            # Check for pause, first so it's never dropped by the rate limit
             self.check_pause(message)
-            # Send message to poweralgorithm.py
-            dispatcher.send(signal=Signal.PW_COMMAND_SIGNAL, message=message)
+            # Queue message for poweralgorithm.py, dropped if the client sends too many
+            self.commands.submit(message, self)
+
+    def send(self, message):
+        """
+        Queue a message for this client only, doesn't wait for it to be sent
+
+        :param message: Message constructed using build_message
+        """
+        if self.outbox is not None:
+            self.outbox.put(message)
 
     def broadcast(self, message):
         """
-        Broadcast message to all connected clients
+        Queue a message for all connected clients, doesn't wait for it to be sent
 
-        :param message: Message to broadcast, of type dictionary
+        :param message: Message constructed using build_message
         """
-        for client in self.ws.handler.server.clients.values():
-            client.ws.send(message)
+        for connection in list(PowerSocketServer.connections):
+            connection.send(message)
 
     def on_close(self, reason):
         """
@@ -91,17 +199,33 @@ class PowerSocketServer(WebSocketApplication):
 
         :param reason: Reason for closing socket
         """
+        PowerSocketServer.connections.discard(self)
+        PowerSocketServer.hub.unsubscribe(self)
+        if self.outbox is not None:
+            self.outbox.close()
         print('Connection closed: %s' % reason)
 
-    def handle_ui_update(self, sender, message):
+    @staticmethod
+    def client_stats():
+        """
+        How far behind every connected client is
+
+        :return: List of dictionaries with the number of queued, sent and dropped messages, and the seconds the last
+            sent message waited in the queue (lag) and the most any message waited (max_lag)
+        """
+        return [connection.outbox.stats() for connection in list(PowerSocketServer.connections)]
+
+    @staticmethod
+    def publish(topic, message=None, state=None):
         """
-        Event handler for UI updates
+        Send a message to the clients subscribed to a topic, it's serialized only once
 
-        :param sender: Signal sender, not used
-        :param message: Message to broadcast to connected clients, must be constructed using build_message
+        :param topic: Name of the topic, see Topic
+        :param message: Optional free-form message, like for build_message
+        :param state: Optional state, like for build_message
+        :return: Number of clients it was sent to
         """
-        if message:
-            self.broadcast(message)
+        return PowerSocketServer.hub.publish(topic, build_message(200, message, state, topic=topic))
 
     def check_pause(self, message):
         """
@@ -125,10 +249,12 @@ class PowerSocketServer(WebSocketApplication):
         if not self.paused:
             # Acquire lock, power.add_task won't run anymore
             PowerSocketServer.sem.acquire()
+            PowerSocketServer.resumed.clear()
             log.info('Pause PW')
             self.paused = True
             config.put('paused', True)
-            self.ws.send(build_message(200, state={'paused': 1}))
+            PowerSocketServer.state.update({'paused': True})
+            self.send(build_message(200, state={'paused': 1}))
 
     def resume(self):
         """
@@ -137,18 +263,111 @@ class PowerSocketServer(WebSocketApplication):
         if self.paused:
             # Release lock, power.add_task will continue
             PowerSocketServer.sem.release()
+            PowerSocketServer.resumed.set()
             log.info('Resume PW')
             self.paused = False
             config.put('paused', False)
-            self.ws.send(build_message(200, state={'paused': 0}))
+            PowerSocketServer.state.update({'paused': False})
+            self.send(build_message(200, state={'paused': 0}))
+
+
+class _Outbox(Outbox):
+    """
+    Outbox written to the socket by its own greenlet
+    """
+    def _start(self):
+        self._ready = GeventEvent()
+        self._writer = gevent.spawn(self._run)
+
+    def _run(self):
+        """Main loop of the writer greenlet"""
+        while True:
+            while not self.messages and not self.closed:
+                self._ready.clear()
+                self._ready.wait()
+            if self.closed:
+                return
+            queued_at, message = self.messages.popleft()
+            try:
+                self.ws.send(wire.encode(message, self.encoding, self.compress))
+            except (WebSocketError, OSError) as e:
+                log.info('Client gone, stop sending: %r', e)
+                self.close()
+                return
+            self.sent += 1
+            self.lag = time.monotonic() - queued_at
+            self.max_lag = max(self.max_lag, self.lag)
+
+
+def handle_ui_update(message, topic=None):
+    """
+    Event handler for UI updates, connected once for all connections
+
+    :param message: Message to send, must be constructed using build_message
+    :param topic: Optional topic, only its subscribers get the message. Every client gets it if not provided.
+    """
+    if not message:
+        return
+    if topic is None:
+        for connection in list(PowerSocketServer.connections):
+            connection.send(message)
+    else:
+        PowerSocketServer.hub.publish(topic, message)
+
+
+# Module level functions are kept alive, so the weak reference pydispatch holds stays valid
+dispatcher.connect(handle_ui_update, signal=Signal.UPDATE_UI_SIGNAL, sender=dispatcher.Any)
 
 
-def init():
+def metrics_app(metrics):
+    """
+    Plain HTTP endpoint serving metrics in the Prometheus text format, for scrapers and curl
+
+    :param metrics: Metrics of a Power object
+    :return: WSGI application
+    """
+    def app(environ, start_response):
+        body = metrics.prometheus().encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'), ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+
+def publish_metrics(metrics, interval=5.0):
+    """
+    Put a metrics snapshot in the state store every interval seconds, until the greenlet is killed. Clients get what
+    changed.
+
+    :param metrics: Metrics of a Power object
+    :param interval: Seconds between broadcasts
+    """
+    while True:
+        gevent.sleep(interval)
+        PowerSocketServer.state.update({'metrics': metrics.snapshot()})
+
+
+def init(metrics=None):
+    """
+    Run the socket server, blocks forever
+
+    :param metrics: Optional Metrics of a Power object, served at /metrics and broadcast every MetricsInterval seconds
+        (5 by default, 0 to disable)
+    """
+    routes = [('^/socket', PowerSocketServer)]
+    if metrics is not None:
+        metrics.gauge('socket_clients', lambda: len(PowerSocketServer.connections))
+        metrics.gauge('socket_queued', lambda: sum(stats['queued'] for stats in PowerSocketServer.client_stats()))
+        metrics.gauge('socket_dropped', lambda: sum(stats['dropped'] for stats in PowerSocketServer.client_stats()))
+        metrics.gauge('socket_max_lag', lambda: max([stats['max_lag'] for stats in PowerSocketServer.client_stats()],
+                                                    default=0.0))
+        metrics.gauge('socket_commands_pending', PowerSocketServer.commands.pending)
+        routes.append(('^/metrics', metrics_app(metrics)))
+        interval = config.get('MetricsInterval', 5)
+        if interval:
+            gevent.spawn(publish_metrics, metrics, interval)
     WebSocketServer(
             ('127.0.0.1', config.get('Port', 7000)),
-            Resource([
-                ('^/socket', PowerSocketServer)
-            ]),
+            Resource(routes),
             debug=config.get('DebugSocketServer', 0)
     ).serve_forever()
 
@@ -1,3 +1,10 @@
 class Signal:
     UPDATE_UI_SIGNAL = 'update_ui_signal'
     PW_COMMAND_SIGNAL = 'pw_command_signal'
+
+
+class Topic:
+    """Topics clients can subscribe to, see PowerSocketServer"""
+    BUS_VOLTAGES = 'bus_voltages'
+    LINE_FLOWS = 'line_flows'
+    RUN_STATUS = 'run_status'
@@ -0,0 +1,218 @@
+import copy
+import logging as log
+from collections import deque
+from typing import Callable
+
+
+class StateStore:
+    """
+    Versioned application state shared with the UI clients.
+
+    Every change bumps the revision. Clients get the full state with its revision once, after that only deltas: lists of
+    JSON Patch (RFC 6902) operations that take the state from one revision to the next. Changes made within window
+    seconds of each other are coalesced into a single delta, the difference between the state at the start of the
+    window and the state at its end, so a value added and removed again within a window isn't sent at all. The last
+    deltas are kept, so a client that lost its connection can catch up from the revision it has instead of getting
+    the full state again.
+
+    Usage:
+
+    >>> store = StateStore({'paused': False}, publish=print, window=0.05)
+    >>> store.update({'voltages': {'1': 1.02, '2': 0.98}})
+    >>> store.update({'voltages': {'1': 1.01, '2': 0.98}})
+    After 50ms a single delta is published
+    {'from': 0, 'to': 2, 'patch': [{'op': 'add', 'path': '/voltages', 'value': {'1': 1.01, '2': 0.98}}]}
+    >>> store.delete('voltages')
+
+    Changes should be made from the thread of the gevent hub (the main thread), like all socket server calls, or from
+    the event loop of an AsyncSocketServer that owns the store.
+
+    :param state: Optional initial state, a dictionary
+    :param publish: Method called with every delta, a dictionary with the from and to revision and the patch
+    :param window: Seconds to wait for more changes before publishing a delta, 0 to publish every change right away
+    :param history: Number of deltas kept for clients catching up
+    :type revision: int
+    """
+    def __init__(self, state: dict=None, publish: Callable=None, window: float=0.05, history: int=1000):
+        self._state = copy.deepcopy(state) if state else {}
+        self.publish = publish
+        self.window = window
+        self.revision = 0
+        # Revision of the last published delta, changes after it are pending
+        self._published = 0
+        # Top level key to its value at the start of the window, or _MISSING, for the keys changed since
+        self._base = {}
+        self._flusher = None
+        # Elements are (from revision, to revision, patch) tuples
+        self._history = deque(maxlen=history)
+
+    def get(self, key: str, fallback=None):
+        """
+        :param key: Top level key
+        :param fallback: Optional value returned if the key doesn't exist
+        :return: Copy of the value
+        """
+        return copy.deepcopy(self._state.get(key, fallback))
+
+    def update(self, changes: dict):
+        """
+        Change top level values of the state, nested dictionaries are compared so only what changed is sent
+
+        :param changes: Dictionary of key to new value
+        """
+        changed = False
+        for key, value in changes.items():
+            old = self._state.get(key, _MISSING)
+            patch = []
+            _diff(old, value, '/' + _escape(key), patch)
+            if patch:
+                # Values are replaced, never changed in place, so the old one can serve as the base
+                self._base.setdefault(key, old)
+                self._state[key] = copy.deepcopy(value)
+                changed = True
+        if changed:
+            self._change()
+
+    def delete(self, key: str):
+        """
+        Remove a top level value
+
+        :param key: Key to remove
+        """
+        if key in self._state:
+            self._base.setdefault(key, self._state.pop(key))
+            self._change()
+
+    def snapshot(self) -> tuple:
+        """
+        Full state, publishing pending changes first so the revision matches what clients have seen
+
+        :return: Tuple of revision and a copy of the state
+        """
+        self.flush()
+        return self.revision, copy.deepcopy(self._state)
+
+    def since(self, revision: int) -> dict:
+        """
+        Delta that brings a client from a revision to the current one
+
+        :param revision: Revision the client has
+        :return: Delta dictionary, or None if the revision is unknown or too old and the client needs a snapshot
+        """
+        self.flush()
+        if revision == self.revision:
+            return {'from': revision, 'to': revision, 'patch': []}
+        deltas = [delta for delta in self._history if delta[0] >= revision]
+        if not deltas or deltas[0][0] != revision or revision > self.revision:
+            return None
+        return {'from': revision, 'to': self.revision, 'patch': [op for delta in deltas for op in delta[2]]}
+
+    def flush(self):
+        """Publish pending changes now"""
+        if self._flusher is not None:
+            self._cancel(self._flusher)
+            self._flusher = None
+        if not self._base:
+            return
+        patch = []
+        for key, old in self._base.items():
+            new = self._state.get(key, _MISSING)
+            if new is not _MISSING:
+                _diff(old, new, '/' + _escape(key), patch)
+            elif old is not _MISSING:
+                patch.append({'op': 'remove', 'path': '/' + _escape(key)})
+        self._base = {}
+        if not patch:
+            # Everything changed in the window was changed back, no client has seen the revisions in between
+            self.revision = self._published
+            return
+        delta = {'from': self._published, 'to': self.revision, 'patch': patch}
+        self._history.append((self._published, self.revision, patch))
+        self._published = self.revision
+        if self.publish is not None:
+            try:
+                self.publish(delta)
+            except Exception:
+                log.exception('Could not publish state delta')
+
+    def _change(self):
+        """Count a change and publish it, now or when the window is over"""
+        self.revision += 1
+        if not self.window:
+            self.flush()
+        elif self._flusher is None:
+            self._flusher = self._later(self.window, self._flush_later)
+
+    def _later(self, delay: float, f: Callable):
+        """
+        Call a method after a delay, in a greenlet. AsyncSocketServer uses its event loop instead.
+
+        :return: Handle for _cancel()
+        """
+        import gevent
+        return gevent.spawn_later(delay, f)
+
+    def _cancel(self, handle):
+        """
+        :param handle: Handle returned by _later()
+        """
+        handle.kill(block=False)
+
+    def _flush_later(self):
+        # Clear first, so flush() doesn't kill the greenlet it's running in
+        self._flusher = None
+        self.flush()
+
+
+def apply_patch(state: dict, patch: list) -> dict:
+    """
+    Apply the operations of a delta to a state, the way a client does
+
+    :param state: State dictionary, changed in place
+    :param patch: List of operations
+    :return: The state
+    """
+    for op in patch:
+        *parents, key = [_unescape(part) for part in op['path'].split('/')[1:]]
+        target = state
+        for part in parents:
+            target = target[part]
+        if op['op'] == 'remove':
+            del target[key]
+        else:
+            target[key] = copy.deepcopy(op['value'])
+    return state
+
+
+# Marks a value that doesn't exist, None is a valid value
+_MISSING = object()
+
+
+def _diff(old, new, path: str, patch: list):
+    """
+    Add the operations that turn one value into another
+
+    :param old: Current value, or _MISSING
+    :param new: New value, not _MISSING
+    :param path: JSON Pointer of the value
+    :param patch: List to add operations to
+    """
+    if old is _MISSING:
+        patch.append({'op': 'add', 'path': path, 'value': copy.deepcopy(new)})
+    elif isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                patch.append({'op': 'remove', 'path': path + '/' + _escape(key)})
+        for key, value in new.items():
+            _diff(old.get(key, _MISSING), value, path + '/' + _escape(key), patch)
+    elif old != new or type(old) is not type(new):
+        patch.append({'op': 'replace', 'path': path, 'value': copy.deepcopy(new)})
+
+
+def _escape(key) -> str:
+    """Escape a key for use in a JSON Pointer"""
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(part: str) -> str:
+    return part.replace('~1', '/').replace('~0', '~')
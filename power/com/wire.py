@@ -0,0 +1,125 @@
+import json
+import zlib
+from functools import lru_cache
+
+try:
+    import msgpack
+except ImportError:
+    # JSON only
+    msgpack = None
+
+# First byte of a binary frame: the encoding, with COMPRESSED set if the rest is zlib compressed
+JSON = 0x01
+MSGPACK = 0x02
+COMPRESSED = 0x80
+
+ENCODINGS = {'json': JSON, 'msgpack': MSGPACK}
+
+# Maximum number of bytes a compressed frame from a client may decompress to
+MAX_SIZE = 2 ** 24
+
+
+class Message(str):
+    """
+    JSON string of a message that keeps the object it was made from, so it's packed with msgpack without parsing the
+    JSON again. Made by build_message.
+
+    :type data: dict
+    """
+
+
+def message(data: dict) -> Message:
+    """
+    :param data: Message object
+    :return: Message with the JSON of the object
+    """
+    text = Message(json.dumps(data, default=default))
+    text.data = data
+    return text
+
+
+def default(obj):
+    """
+    Turn objects JSON and msgpack don't know, like numpy arrays and numbers, into ones they do
+
+    :param obj: Object to convert
+    :return: List or plain number
+    :raises TypeError: If the object can't be converted
+    """
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError('Object of type %s is not serializable' % type(obj).__name__)
+
+
+def available(encoding: str) -> bool:
+    """
+    :param encoding: Name of an encoding, 'json' or 'msgpack'
+    :return: True if messages can be sent in this encoding here
+    """
+    return encoding == 'json' or (encoding == 'msgpack' and msgpack is not None)
+
+
+@lru_cache(maxsize=64)
+def encode(message: str, encoding: str='json', compress: int=0):
+    """
+    Convert a message built by build_message to the wire format of a client. Memoized, so a message broadcast to many
+    clients with the same settings is only converted once.
+
+    Plain JSON without compression is sent as a text frame, like it has always been. Anything else is a binary frame
+    of one header byte followed by the payload.
+
+    :param message: JSON string, a Message is packed with msgpack from the object it was made from
+    :param encoding: 'json' or 'msgpack'
+    :param compress: Compress messages of at least this many bytes with zlib, 0 to never compress
+    :return: String for a text frame or bytes for a binary frame
+    """
+    if encoding == 'json':
+        if not compress or len(message) < compress:
+            return message
+        header, payload = JSON, message.encode()
+    elif encoding == 'msgpack':
+        data = message.data if isinstance(message, Message) else json.loads(message)
+        header, payload = MSGPACK, msgpack.packb(data, use_bin_type=True, default=default)
+    else:
+        raise ValueError('Unknown encoding %s' % encoding)
+    if compress and len(payload) >= compress:
+        header, payload = header | COMPRESSED, zlib.compress(payload, 1)
+    return bytes((header,)) + payload
+
+
+def decode(frame, max_size: int=MAX_SIZE):
+    """
+    Read a message from a client, in any encoding
+
+    :param frame: String of a text frame or bytes of a binary frame
+    :param max_size: Maximum number of bytes a compressed frame may decompress to, so a small frame can't take all
+        memory
+    :return: Decoded message
+    :raises ValueError: If the message can't be decoded or decompresses to more than max_size bytes
+    """
+    if isinstance(frame, str):
+        return json.loads(frame)
+    if not frame:
+        raise ValueError('Empty frame')
+    header, payload = frame[0], bytes(frame[1:])
+    if header & COMPRESSED:
+        decompressor = zlib.decompressobj()
+        try:
+            payload = decompressor.decompress(payload, max_size)
+        except zlib.error as e:
+            raise ValueError('Invalid compressed frame: %s' % e)
+        if decompressor.unconsumed_tail:
+            raise ValueError('Compressed frame is larger than %d bytes' % max_size)
+        if not decompressor.eof:
+            raise ValueError('Invalid compressed frame: incomplete')
+    encoding = header & ~COMPRESSED
+    if encoding == JSON:
+        return json.loads(payload.decode())
+    if encoding == MSGPACK and msgpack is not None:
+        try:
+            return msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise ValueError('Invalid msgpack frame: %s' % e)
+    raise ValueError('Unknown encoding %#x' % encoding)
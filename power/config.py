@@ -1,15 +1,18 @@
 import configparser
 import os
 import ast
+import time
+from threading import Lock
 
 
-def _build_dict():
+def _build_dict(conf: configparser.ConfigParser) -> dict:
     """
     Turn config object into dictionary.
     Config values are usually represented as strings, no matter the actual data type. You need to use config.getfloat()
     and others when appropriate to get the right values. This parses everything automatically for you and puts it in a
     flat dictionary (sections are not kept).
 
+    :param conf: Parsed config file
     :return: Parsed flat config file as dictionary
     """
     _obj = {}
@@ -40,11 +43,56 @@ def _parse_string(s):
         # Not int, float or boolean, return the original value
         return s
 
-# Read config file
-conf = configparser.ConfigParser()
+
 # Get parent of parent dir, then append config.ini
-conf.read(os.path.abspath(os.sep.join(__file__.split(os.sep)[:-2]) + os.sep + 'config.ini'))
-_dict = _build_dict()
+path = os.path.abspath(os.sep.join(__file__.split(os.sep)[:-2]) + os.sep + 'config.ini')
+# Seconds between checks whether the config file changed
+check_interval = 1.0
+
+# The config file is only read when a value is first needed, and again when it has changed since
+_dict = {}
+# Values set with put(), they win over the file
+_overrides = {}
+_signature = None
+_checked = None
+_lock = Lock()
+
+
+def _current() -> dict:
+    """
+    Config dictionary, read from the file on first use and again when the file has changed. Checks at most once every
+    check_interval seconds, so calling this is cheap.
+
+    :return: Config dictionary
+    """
+    global _signature, _checked
+    now = time.monotonic()
+    if _checked is not None and now - _checked < check_interval:
+        return _dict
+    with _lock:
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            # No config file is the same as an empty one
+            signature = ()
+        if signature != _signature:
+            conf = configparser.ConfigParser()
+            conf.read(path)
+            # Updated in place, so dictionaries returned by data() before stay current
+            _dict.clear()
+            _dict.update(_build_dict(conf))
+            _dict.update(_overrides)
+            _signature = signature
+        _checked = now
+    return _dict
+
+
+def reload():
+    """Read the config file again on the next call, whether it changed or not"""
+    global _signature, _checked
+    with _lock:
+        _signature = _checked = None
 
 
 def get(key, fallback=None):
@@ -55,17 +103,19 @@ def get(key, fallback=None):
     :param fallback: Optional fallback value if key doesn't exist
     :return: Value from config dict or fallback
     """
-    return _dict.get(key.lower(), fallback)
+    return _current().get(key.lower(), fallback)
 
 
 def put(key, value):
     """
-    Set value to config file
+    Set value to config file. Only kept in memory, it stays set when the file is read again.
 
     :param key: Key to set value under, will be made lowercase
     :param value: Value to set
     """
-    _dict[key.lower()] = value
+    with _lock:
+        _overrides[key.lower()] = value
+        _dict[key.lower()] = value
 
 
 def data():
@@ -74,4 +124,4 @@ def data():
 
     :return: Config dictionary
     """
-    return _dict
+    return _current()
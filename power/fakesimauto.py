@@ -0,0 +1,180 @@
+import random
+import time
+from collections import Counter
+from threading import Event
+
+
+class SimulatorCrashed(ConnectionError):
+    """Raised by every call to a FakeSimAuto after crash(), like calls to a real simulator process that died."""
+    pass
+
+
+class FakeSimAuto:
+    """
+    In-process stand-in for the PowerWorld SimAuto COM object, to be used on machines without PowerWorld (or Windows).
+
+    It implements the commonly used SimAuto methods with the same signatures and return conventions: every call returns
+    a tuple whose first element is an error string, empty on success. Field values are generated deterministically from
+    the open case, object type, field name and element index, so repeated runs give identical results. Each call sleeps
+    for a configurable latency to mimic the cost of the real simulator.
+
+    Usage:
+
+    Every call takes 10ms, +/- 20%
+    >>> sim = FakeSimAuto(latency=0.01, jitter=0.2)
+    >>> sim.OpenCase('case.pwb')
+    ('',)
+    >>> error, (numbers, voltages) = sim.GetParametersMultipleElement('Bus', ['BusNum', 'BusPUVolt'], '')
+
+    Failures can be simulated as well: after hang() the next call blocks until crash() is called, after which every
+    call raises SimulatorCrashed.
+
+    :param latency: Seconds every call takes, or a dictionary of method name to seconds. Methods missing from the
+        dictionary fall back to the value under the 'default' key, or 0.
+    :param jitter: Relative random variation of the latency, 0.2 means +/- 20%
+    :param seed: Seed for the jitter, so the latency sequence is reproducible
+    :param elements: Optional dictionary of object type to the number of elements in the case, defaults to 10 each
+    :type calls: Counter
+    """
+    def __init__(self, latency=0.0, jitter: float=0.0, seed: int=0, elements: dict=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.elements = {k.lower(): v for k, v in (elements or {}).items()}
+        self.calls = Counter()
+        self.case = None
+        self.CurrentDir = ''
+        self.ProcessID = 0
+        self.UIVisible = False
+        self.dead = False
+        self._random = random.Random(seed)
+        self._changes = {}
+        self._hung = Event()
+        self._hung.set()
+
+    def OpenCase(self, FileName: str):
+        self._call('OpenCase')
+        self.case = FileName
+        self._changes = {}
+        return '',
+
+    def CloseCase(self):
+        self._call('CloseCase')
+        self.case = None
+        self._changes = {}
+        return '',
+
+    def SaveCase(self, FileName: str, FileType: str='PWB', Overwrite: bool=True):
+        self._call('SaveCase')
+        return self._error_without_case() or ('',)
+
+    def RunScriptCommand(self, Statements: str):
+        self._call('RunScriptCommand')
+        return self._error_without_case() or ('',)
+
+    def ProcessAuxFile(self, FileName: str):
+        self._call('ProcessAuxFile')
+        return self._error_without_case() or ('',)
+
+    def GetFieldList(self, ObjectType: str):
+        self._call('GetFieldList')
+        return '', (('*1*', 'BusNum', 'Integer', 'Number', 'Number'),)
+
+    def ListOfDevices(self, ObjType: str, filterName: str=''):
+        self._call('ListOfDevices')
+        error = self._error_without_case()
+        if error:
+            return error
+        return '', (tuple(range(1, self._count(ObjType) + 1)),)
+
+    def GetParametersSingleElement(self, ObjectType: str, ParamList: list, Values: list):
+        self._call('GetParametersSingleElement')
+        error = self._error_without_case()
+        if error:
+            return error
+        # The first value identifies the element, by default its number
+        index = int(Values[0]) - 1 if Values and Values[0] not in (None, '') else 0
+        return '', tuple(self._value(ObjectType, field, index) for field in ParamList)
+
+    def GetParametersMultipleElement(self, ObjectType: str, ParamList: list, FilterName: str=''):
+        self._call('GetParametersMultipleElement')
+        error = self._error_without_case()
+        if error:
+            return error
+        count = self._count(ObjectType)
+        return '', tuple(tuple(self._value(ObjectType, field, i) for i in range(count)) for field in ParamList)
+
+    def ChangeParametersSingleElement(self, ObjectType: str, ParamList: list, Values: list):
+        self._call('ChangeParametersSingleElement')
+        error = self._error_without_case()
+        if error:
+            return error
+        index = int(Values[0]) - 1 if Values and Values[0] not in (None, '') else 0
+        for field, value in zip(ParamList[1:], Values[1:]):
+            self._changes[(ObjectType.lower(), field.lower(), index)] = value
+        return '',
+
+    def ChangeParametersMultipleElement(self, ObjectType: str, ParamList: list, ValueList: list):
+        self._call('ChangeParametersMultipleElement')
+        error = self._error_without_case()
+        if error:
+            return error
+        for values in ValueList:
+            self.ChangeParametersSingleElement(ObjectType, ParamList, values)
+        return '',
+
+    def hang(self):
+        """Make the next call block until crash() is called"""
+        self._hung.clear()
+
+    def crash(self):
+        """Make every call raise SimulatorCrashed from now on, including a call that is hanging"""
+        self.dead = True
+        self._hung.set()
+
+    def _call(self, name: str):
+        """
+        Register a call and sleep for the configured latency
+
+        :param name: SimAuto method name
+        """
+        self._hung.wait()
+        if self.dead:
+            raise SimulatorCrashed('Simulator is gone')
+        self.calls[name] += 1
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(name, latency.get('default', 0))
+        if self.jitter:
+            latency *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def _error_without_case(self):
+        """
+        SimAuto returns an error string instead of raising when no case is open
+
+        :return: Error tuple or None if a case is open
+        """
+        if self.case is None:
+            return 'Error: No case open',
+        return None
+
+    def _count(self, object_type: str) -> int:
+        return self.elements.get(object_type.lower(), 10)
+
+    def _value(self, object_type: str, field: str, index: int):
+        """
+        Deterministic value for a field of an element in the currently open case
+
+        :param object_type: Object type, e.g. 'Bus'
+        :param field: Field name, e.g. 'BusPUVolt'
+        :param index: Zero-based element index
+        :return: Changed value if set, element number for number fields or a float otherwise
+        """
+        key = (object_type.lower(), field.lower(), index)
+        if key in self._changes:
+            return self._changes[key]
+        if field.lower().endswith('num'):
+            return index + 1
+        # String seeds are hashed with sha512, which is stable between runs unlike hash()
+        return round(random.Random('%s:%s' % (self.case, ':'.join(map(str, key)))).uniform(0.9, 1.1), 6)
@@ -0,0 +1,106 @@
+import os
+import time
+from threading import Lock
+
+
+class Journal:
+    """
+    Append-only record of finished tasks, so a sweep that was interrupted can continue where it left off.
+
+    Every line holds a task key (see task_key()) and whether the task succeeded. Lines are written in batches, so
+    recording a task is cheap. A line that was only partly written when the process died is ignored on loading.
+
+    Usage:
+
+    Tasks of batch() that succeeded in an earlier run are skipped, failed and missing ones run again
+    >>> pw = Power(4, journal=Journal('sweep.journal'))
+    >>> for task, result in pw.batch(Task(threaded_func, case='case.pwb'), scenarios):
+    >>>    print(result)
+
+    Together with a ColumnStore the results of the earlier run stay available. Pausing from PowerSocketServer and
+    Power.reset() flush the journal.
+
+    :param path: Path of the journal file, created if it doesn't exist
+    :param batch_size: Number of records to collect before writing them
+    :param interval: Maximum number of seconds to keep records before writing them, checked when recording
+    :param sync: Also wait for the operating system to write to disk, survives a crash of the machine
+    :type done: set[str]
+    :type failed: set[str]
+    """
+    def __init__(self, path: str, batch_size: int=100, interval: float=1.0, sync: bool=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.sync = sync
+        self.done = set()
+        self.failed = set()
+        self._pending = []
+        self._lock = Lock()
+        self._flushed = time.monotonic()
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a')
+        if self._file.tell() and not self._ends_with_newline():
+            # Finish a line cut off by a crash, so it doesn't run into the next record
+            self._file.write('\n')
+
+    def __contains__(self, key: str):
+        """Whether the task succeeded before"""
+        return key in self.done
+
+    def record(self, key: str, ok: bool=True):
+        """
+        Record a finished task, written with the next batch
+
+        :param key: Task key
+        :param ok: Whether the task succeeded
+        """
+        with self._lock:
+            if ok:
+                self.done.add(key)
+                self.failed.discard(key)
+            else:
+                self.failed.add(key)
+                self.done.discard(key)
+            self._pending.append('%s %s\n' % (key, 'done' if ok else 'failed'))
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._flushed >= self.interval:
+                self._write()
+
+    def flush(self):
+        """Write recorded tasks now"""
+        with self._lock:
+            self._write()
+
+    def close(self):
+        with self._lock:
+            self._write()
+            self._file.close()
+
+    def _write(self):
+        """Write pending records, must be called with the lock held"""
+        self._flushed = time.monotonic()
+        if not self._pending or self._file.closed:
+            return
+        self._file.write(''.join(self._pending))
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        self._pending = []
+
+    def _load(self):
+        """Read the records of earlier runs, the last record of a task counts"""
+        with open(self.path) as file:
+            for line in file:
+                # Lines cut off by a crash have no or only part of a status
+                key, _, status = line.rstrip('\n').partition(' ')
+                if status == 'done':
+                    self.done.add(key)
+                    self.failed.discard(key)
+                elif status == 'failed':
+                    self.failed.add(key)
+                    self.done.discard(key)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b'\n'
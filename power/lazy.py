@@ -0,0 +1,23 @@
+import importlib
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def optional(name: str):
+    """
+    Import an optional dependency when it's first needed rather than when the module using it is imported, so tools
+    that never need it don't pay for loading it.
+
+    Usage:
+
+    >>> np = optional('numpy')
+    >>> if np is not None:
+    >>>    values = np.array(values)
+
+    :param name: Name of the module
+    :return: The module, or None if it isn't installed
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
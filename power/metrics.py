@@ -0,0 +1,219 @@
+import time
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+from typing import Callable, Sequence
+
+# Upper bounds in seconds, from 100µs to 15 minutes
+DEFAULT_BUCKETS = tuple(m * 10 ** e for e in range(-4, 3) for m in (1, 2, 5)) + (1000.0,)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, cheap enough to record every task.
+
+    :param buckets: Optional sorted upper bounds of the buckets, values above the last one go in an overflow bucket
+    :type counts: list[int]
+    """
+    def __init__(self, buckets: Sequence[float]=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        """
+        Record a value
+
+        :param value: Value to record, usually in seconds
+        """
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in
+
+        :param q: Quantile between 0 and 1
+        :return: Estimate, the maximum if it falls in the overflow bucket, 0 if nothing was recorded
+        """
+        with self._lock:
+            counts, count, maximum = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= q * count:
+                return min(bound, maximum)
+        return maximum
+
+    def snapshot(self) -> dict:
+        """
+        :return: Dictionary with count, sum, mean, max and estimates of the median, 90th and 99th percentile
+        """
+        with self._lock:
+            count, total, maximum = self.count, self.sum, self.max
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else 0.0,
+            'max': maximum,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Performance metrics of a Power pool: how long tasks wait in the queue and run, how many fail, and how busy each
+    thread is. Power keeps one as its metrics property and records every task in it.
+
+    Usage:
+
+    >>> pw.metrics.snapshot()['run_time']['p99']
+    Text in the Prometheus exposition format, e.g. for a scrape endpoint
+    >>> print(pw.metrics.prometheus())
+    Add your own values, they are read whenever a snapshot is taken
+    >>> pw.metrics.gauge('open_cases', lambda: len(cases))
+
+    :type queue_wait: Histogram
+    :type run_time: Histogram
+    :type counters: Counter
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.queue_wait = Histogram()
+        self.run_time = Histogram()
+        self.counters = Counter()
+        self._workers = {}
+        self._gauges = {}
+        self._lock = Lock()
+
+    def count(self, event: str, n: int=1):
+        """
+        Increase an event counter, e.g. 'submitted' or 'cancelled'
+
+        :param event: Name of the event
+        :param n: Amount to increase by
+        """
+        with self._lock:
+            self.counters[event] += n
+
+    def gauge(self, name: str, f: Callable):
+        """
+        Register a value that is read when taking a snapshot
+
+        :param name: Name of the value
+        :param f: Method without parameters returning a number
+        """
+        self._gauges[name] = f
+
+    def worker_started(self, thread_id: int):
+        """
+        Start tracking a thread, called when the thread starts
+
+        :param thread_id: Thread ID
+        """
+        with self._lock:
+            self._workers.setdefault(thread_id, _WorkerStats())
+
+    def task_started(self, thread_id: int, wait: float):
+        """
+        Record a task being taken by a thread
+
+        :param thread_id: Thread ID
+        :param wait: Seconds the task spent in the queue
+        """
+        self.queue_wait.observe(wait)
+
+    def task_finished(self, thread_id: int, run_time: float, failed: bool):
+        """
+        Record a task that finished running
+
+        :param thread_id: Thread ID
+        :param run_time: Seconds the task ran
+        :param failed: Whether the task raised an exception
+        """
+        self.run_time.observe(run_time)
+        with self._lock:
+            self.counters['failed' if failed else 'completed'] += 1
+            worker = self._workers.setdefault(thread_id, _WorkerStats())
+            worker.tasks += 1
+            worker.failed += failed
+            worker.busy += run_time
+            worker.max = max(worker.max, run_time)
+
+    def snapshot(self) -> dict:
+        """
+        :return: Dictionary of all metrics, can be serialized to JSON
+        """
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self.counters)
+            workers = {thread_id: {
+                'tasks': worker.tasks,
+                'failed': worker.failed,
+                'busy': worker.busy,
+                'max': worker.max,
+                'utilization': worker.busy / (now - worker.since) if now > worker.since else 0.0,
+            } for thread_id, worker in self._workers.items()}
+        return {
+            'uptime': now - self.started,
+            'tasks': counters,
+            'queue_wait': self.queue_wait.snapshot(),
+            'run_time': self.run_time.snapshot(),
+            'workers': workers,
+            'gauges': {name: f() for name, f in self._gauges.items()},
+        }
+
+    def prometheus(self, prefix: str='power') -> str:
+        """
+        Render the metrics in the Prometheus text exposition format
+
+        :param prefix: Prefix of every metric name
+        :return: Text, one metric per line
+        """
+        snapshot = self.snapshot()
+        lines = ['# TYPE %s_tasks_total counter' % prefix]
+        for event, n in sorted(snapshot['tasks'].items()):
+            lines.append('%s_tasks_total{event="%s"} %s' % (prefix, event, n))
+        for name, histogram in (('queue_wait', self.queue_wait), ('run_time', self.run_time)):
+            metric = '%s_%s_seconds' % (prefix, name)
+            with histogram._lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            lines.append('# TYPE %s histogram' % metric)
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, counts):
+                cumulative += n
+                lines.append('%s_bucket{le="%s"} %s' % (metric, bound, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %s' % (metric, count))
+            lines.append('%s_sum %s' % (metric, total))
+            lines.append('%s_count %s' % (metric, count))
+        for key, kind in (('tasks', 'counter'), ('failed', 'counter'), ('busy', 'counter'), ('utilization', 'gauge')):
+            metric = '%s_worker_%s' % (prefix, key + '_seconds' if key == 'busy' else key)
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for thread_id, worker in sorted(snapshot['workers'].items()):
+                lines.append('%s{thread="%s"} %s' % (metric, thread_id, worker[key]))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            lines.append('%s_%s %s' % (prefix, name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class _WorkerStats:
+    """Totals of a single thread"""
+    def __init__(self):
+        self.since = time.monotonic()
+        self.tasks = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.max = 0.0
@@ -1,18 +1,33 @@
-import win32com.client
-
+import logging as log
 import sys
-import traceback
-import pythoncom
+import time
 import queue
-from queue import Queue
+import threading
+from concurrent.futures import CancelledError, Executor, Future
+from concurrent import futures
+from contextlib import contextmanager
+from functools import partial
 from threading import Thread
 from threading import Lock
-from typing import Sequence, List, Callable
-import gevent
-from power.com import PowerSocketServer
+from typing import Sequence, List, Callable, Iterable, Iterator
+from power.autoscaler import Autoscaler
+from power.backends import Backend, ComBackend
+from power.cache import ResultCache
+from power.journal import Journal
+from power.com.signals import Signal
+from power.metrics import Metrics
+from power.profiling import TaskHook
+from power.scheduler import TaskQueue
+from power.store import ColumnStore, qualified_name, task_key
+from power.supervisor import Supervisor
+
 
+class ThreadRetired(RuntimeError):
+    """The thread a task was for was retired before it got to the task."""
+    pass
 
-class Power:
+
+class Power(Executor):
     """
     Power provides a multithreaded PowerWorld Simulator workflow.
 
@@ -21,8 +36,14 @@ class Power:
     Initiate with 4 threads
     >>> pw = Power(4)
 
-    Create PowerWorld COM objects and threads
+    Or with a different backend, e.g. 4 worker processes or a fake simulator that takes 10ms per call
+    >>> pw = Power(4, backend=ProcessBackend())
+    >>> pw = Power(4, backend=FakeBackend(latency=0.01))
+
+    Create PowerWorld COM objects and threads, and wait until all are ready
     >>> pw.create_pw_collection()
+    Optionally warm up every simulator (in parallel) before it takes tasks, and report progress
+    >>> pw.create_pw_collection(warmup=open_case, progress=lambda thread_id, timings: print(thread_id, timings))
 
     Call method in all 4 threads, blocks until all results have arrived
     >>> results = pw.add_task(threaded_func)
@@ -40,6 +61,60 @@ class Power:
     Task has thread_id and exception property
     >>> print(results[0][1])
 
+    Power is also a concurrent.futures.Executor. Submit a single call without blocking, it runs in whichever thread
+    is free first. Tasks for specific threads, like add_task() calls, still go first.
+    >>> future = pw.submit(threaded_func, 'foo', bar='bar')
+    >>> print(future.result())
+    Or call it for every item of one or more iterables, results are yielded in order
+    >>> for result in pw.map(threaded_func, ['foo', 'baz']):
+    >>>    print(result)
+
+    All of these can be called from several greenlets or threads at the same time, every call only gets its own
+    results back.
+
+    Tasks that need a case opened can say so by wrapping the method in a Task. They preferably run in a thread that
+    has the case open already, other threads only open it when they have nothing else to do.
+    >>> future = pw.submit(Task(threaded_func, case='case.pwb'), 'foo')
+
+    Tasks can also have a priority, a deadline after which they're dropped if they haven't started yet, and a group to
+    cancel them by. Clients of PowerSocketServer can cancel a group with { "command": "cancel", "group": "sweep" }.
+    >>> results = pw.batch(Task(threaded_func, priority=-1, group='sweep'), range(1000))
+    >>> future = pw.submit(Task(threaded_func, priority=10, deadline=5), 'what-if')
+    >>> pw.cancel(group='sweep')
+
+    Replace simulators that hang for over a minute or crash, and retry what they were running
+    >>> pw = Power(4, supervisor=Supervisor(task_timeout=60))
+
+    Grow the pool when tasks wait for over 5 seconds and shrink it again after 10 idle minutes, see Autoscaler. Or
+    resize it yourself, only the simulators of the added or retired threads are created or released.
+    >>> pw = Power(2, autoscaler=Autoscaler(min_threads=2, max_threads=16, target_wait=5, cooldown=600))
+    >>> pw.grow(2)
+    >>> pw.shrink(2)
+
+    Keep results on disk and return them right away when the same method runs with the same case and arguments again.
+    Only applies to tasks that aren't for specific threads, unlike add_task().
+    >>> pw = Power(4, cache=ResultCache('results.db'))
+
+    Write numeric results of a big sweep to memory-mapped column files instead of keeping them in memory, the futures
+    of tasks with store=True get the row number
+    >>> pw = Power(4, store=ColumnStore('sweep', {'bus': 'q', 'voltage': 'd'}))
+
+    Record finished tasks of batch() in a journal, running the same batch again after a crash skips the ones that
+    succeeded
+    >>> pw = Power(4, journal=Journal('sweep.journal'))
+
+    Queue wait and run time of tasks, failures and how busy every thread is, see Metrics
+    >>> print(pw.metrics.snapshot())
+
+    Call hooks before and after every task, e.g. a Tracer that records where the time goes as a Chrome trace and
+    samples the stacks of a tenth of the tasks for a flame graph
+    >>> tracer = Tracer(profile=0.1)
+    >>> pw.add_hook(tracer)
+    >>> tracer.write_trace('trace.json')
+
+    Await tasks from asyncio code, see AsyncPower and AsyncSocketServer
+    >>> results = await AsyncPower(pw).map(threaded_func, range(100))
+
     Kill all threads and COM object
     >>> pw.reset()
 
@@ -55,49 +130,222 @@ class Power:
 
 
     :param num_threads: Integer, amount of threads and COM objects you want to create.
+    :param backend: Optional Backend that creates the simulators and runs tasks, defaults to ComBackend
+    :param supervisor: Optional Supervisor that replaces hung or crashed simulators
+    :param cache: Optional ResultCache for tasks that aren't for specific threads
+    :param store: Optional ColumnStore that tasks with store=True write their result to
+    :param journal: Optional Journal of the tasks of batch() that finished
+    :param autoscaler: Optional Autoscaler that grows and shrinks the number of threads with the load
     :type _num_threads: int
+    :type _backend: Backend
+    :type _supervisor: Supervisor
+    :type _autoscaler: Autoscaler
+    :type cache: ResultCache
+    :type store: ColumnStore
+    :type journal: Journal
+    :type metrics: Metrics
     :type _pw_objects: list
     :type _threads: list[_PowerThread]
     :type _dismissed_threads: list[_PowerThread]
-    :type _tasks: list[Queue]
-    :type _results: Queue
+    :type _tasks: TaskQueue
     :type _lock: Lock
+    :type _resize_lock: Lock
     """
-    def __init__(self, num_threads: int):
+    def __init__(self, num_threads: int, backend: Backend=None, supervisor: Supervisor=None,
+                 cache: ResultCache=None, store: ColumnStore=None, journal: Journal=None,
+                 autoscaler: Autoscaler=None):
         if num_threads < 1:
             raise ValueError('Power should be instantiated with at least 1 thread')
         self._num_threads = num_threads
+        self._backend = backend if backend is not None else ComBackend()
+        self._supervisor = supervisor
+        self._autoscaler = autoscaler
+        self.cache = cache
+        self.store = store
+        self.journal = journal
+        self._warmup = None
+        self._hooks = []
         self._pw_objects = []
         self._threads = []
         self._dismissed_threads = []
-        self._tasks = [Queue() for _ in range(num_threads)] # _ is a throwaway variable name that isn't used elsewhere
-        self._results = Queue()
+        self._tasks = TaskQueue(num_threads)
         self._lock = Lock()
+        # Held while threads are added, retired or replaced
+        self._resize_lock = Lock()
+        self.metrics = Metrics()
+        self.metrics.gauge('threads', lambda: self._num_threads)
+        self.metrics.gauge('queue_depth', lambda: self._tasks.qsize() if self._tasks is not None else 0)
+        self.metrics.gauge('threads_busy', lambda: sum(thread.current_task is not None
+                                                       for thread in self._threads or ()))
+        # Imported here, like gevent and PowerSocketServer below, so importing this module stays fast
+        from pydispatch import dispatcher
+        # Weakly referenced, so it doesn't keep this object alive
+        dispatcher.connect(self._handle_command, signal=Signal.PW_COMMAND_SIGNAL, sender=dispatcher.Any)
 
-    def create_pw_collection(self):
+    def create_pw_collection(self, warmup: Callable=None, progress: Callable=None) -> dict:
         """
         Create the collection of COM objects, equal to the thread count defined earlier when creating the Power object.
-        All COM objects correspond to a specific thread and task queue.
-        You should call this before add_task()
+        All COM objects correspond to a specific thread and task queue. The backend decides what these objects are.
+        Blocks until every simulator is ready. You should call this before add_task()
+
+        :param warmup: Optional method every thread calls once before taking tasks, e.g. to open a case. Takes thread_id
+            and auto_sim, like any task.
+        :param progress: Optional method called with thread_id and timings whenever a simulator is ready
+        :return: Dictionary of thread ID to a dictionary with the seconds spent on each startup step
         """
+        self._warmup = warmup
+        timings = {}
         for i in range(self._num_threads):
-            # Create COM object
-            pw = win32com.client.Dispatch('pwrworld.SimulatorAuto')
-            # Create stream that will hold COM object
-            pw_stream = pythoncom.CreateStreamOnHGlobal()
-            # Convert COM object into stream to allow re-usage
-            pythoncom.CoMarshalInterface(pw_stream,
-                                         pythoncom.IID_IDispatch,
-                                         pw._oleobj_,
-                                         pythoncom.MSHCTX_LOCAL,
-                                         pythoncom.MSHLFLAGS_TABLESTRONG)
-            # No need for the COM reference anymore now that it's a stream
-            pw = None
-            # Store the stream in a list
-            self._pw_objects.append(pw_stream)
+            if self._backend.parallel_create:
+                # The thread creates it, so all simulators start at the same time
+                self._pw_objects.append(None)
+            else:
+                # Store the simulator handle (a COM stream for the default backend) in a list
+                started = time.perf_counter()
+                self._pw_objects.append(self._backend.create(i))
+                timings[i] = {'create': time.perf_counter() - started}
 
         for i in range(self._num_threads):
-            self._threads.append(_PowerThread(i, self._tasks, self._results, self._pw_objects, self._lock))
+            self._threads.append(self._create_thread(i))
+
+        # Report simulators as they become ready
+        ready = queue.Queue()
+        for thread in self._threads:
+            thread.ready.add_done_callback(ready.put)
+        error = None
+        for _ in range(self._num_threads):
+            future = _get(ready)
+            if future.exception() is not None:
+                log.error('Simulator %s failed to start: %r', future.thread_id, future.exception())
+                error = error or future.exception()
+                continue
+            timings.setdefault(future.thread_id, {}).update(future.result())
+            log.info('Simulator %s ready in %.2fs', future.thread_id, sum(timings[future.thread_id].values()))
+            if progress is not None:
+                progress(future.thread_id, timings[future.thread_id])
+        if error is not None:
+            raise error
+        if self._supervisor is not None:
+            self._supervisor.start(self)
+        if self._autoscaler is not None:
+            self._autoscaler.start(self)
+        return timings
+
+    def add_hook(self, hook: TaskHook):
+        """
+        Call a hook before and after every task from now on, in all threads. Tasks that are running call its after()
+        method without before().
+
+        :param hook: TaskHook
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: TaskHook):
+        """
+        Stop calling a hook, tasks that are running may have called its before() method without after()
+
+        :param hook: TaskHook that was added
+        """
+        self._hooks.remove(hook)
+
+    @property
+    def num_threads(self) -> int:
+        """Current number of threads, changes when the pool grows or shrinks"""
+        return self._num_threads
+
+    def grow(self, n: int=1) -> List[int]:
+        """
+        Add threads with their own simulator, without touching the existing ones. Blocks until the new simulators are
+        ready.
+
+        :param n: Number of threads to add
+        :return: IDs of the new threads
+        """
+        retired = None
+        with self._resize_lock:
+            ids = list(range(self._num_threads, self._num_threads + n))
+            threads = []
+            # May be called from any thread, not only the autoscaler
+            self._backend.enter_thread()
+            try:
+                for i in ids:
+                    self._tasks.add_thread(i)
+                    self._pw_objects.append(None if self._backend.parallel_create else self._backend.create(i))
+                    threads.append(self._create_thread(i))
+            finally:
+                self._backend.exit_thread()
+            self._threads.extend(threads)
+            self._num_threads += n
+            error = None
+            for thread in threads:
+                try:
+                    thread.ready.result()
+                except Exception as e:
+                    log.error('Simulator %s failed to start: %r', thread.thread_id, e)
+                    error = error or e
+            if error is not None:
+                retired = self._detach(n)
+        if retired is not None:
+            self._retire(retired)
+            raise error
+        self.metrics.count('grown', n)
+        log.info('Added threads %s', ids)
+        return ids
+
+    def shrink(self, n: int=1, idle_only: bool=False) -> List[int]:
+        """
+        Retire the threads with the highest IDs and release their simulators, leaving at least one thread. Blocks
+        until they have finished the task they're running, but the pool can be used, grown and supervised in the
+        meantime. Tasks that were for these threads only fail with ThreadRetired.
+
+        :param n: Number of threads to retire
+        :param idle_only: Stop at the first thread that is running a task, instead of waiting for it
+        :return: IDs of the retired threads
+        """
+        with self._resize_lock:
+            retired = self._detach(min(n, self._num_threads - 1), idle_only)
+        ids = self._retire(retired)
+        self.metrics.count('shrunk', len(ids))
+        log.info('Retired threads %s', ids)
+        return ids
+
+    def _detach(self, n: int, idle_only: bool=False) -> list:
+        """
+        Take the last n threads out of the pool and dismiss them, must be called with the resize lock held. Tasks that
+        were for these threads only fail with ThreadRetired.
+
+        :param n: Number of threads
+        :param idle_only: Stop at the first thread that is running a task
+        :return: List of (thread, simulator handle) tuples to pass to _retire()
+        """
+        retired = []
+        for _ in range(max(n, 0)):
+            if idle_only and self._threads[-1].current_task is not None:
+                break
+            thread = self._threads.pop()
+            retired.append((thread, self._pw_objects.pop()))
+            self._num_threads -= 1
+            thread.dismiss()
+            # Now, so a thread that takes its ID when the pool grows again gets a clean queue
+            for task in self._tasks.remove_thread(thread.thread_id):
+                if not task.future.done():
+                    task.fail((ThreadRetired, ThreadRetired('Thread %s was retired' % thread.thread_id), None))
+        return retired
+
+    def _retire(self, retired: list) -> List[int]:
+        """
+        Wait for detached threads to exit and release their simulators. Called without the resize lock, so a thread
+        that is still running its task only holds up the caller.
+
+        :param retired: List returned by _detach()
+        :return: IDs of the retired threads
+        """
+        for thread, handle in retired:
+            thread.join()
+        for thread, handle in retired:
+            if handle is not None:
+                self._backend.release(handle)
+        return sorted(thread.thread_id for thread, handle in retired)
 
     def add_task(self, f: Callable, threads: str=None, *args, **kwargs):
         """
@@ -116,58 +364,197 @@ class Power:
         :return: List of result tuples. The first element is the task you created, containing the thread_id and
             exception flag. The second element is the return value of your method
         """
-        # Yield control back to PowerSocketServer to handle any new incoming messages
-        # Has to be bigger than 0 since that's not enough time for context switching
-        gevent.sleep(0.1)
         # Block when application is paused
-        with PowerSocketServer.sem:
-            # If not provided, default to all threads
+        with _unpaused():
+            tasks = self._put_pinned(f, threads, args, kwargs)
+
+        # Waiting for the results lets PowerSocketServer handle any new incoming messages in the meantime
+        _wait([task.future for task in tasks])
+        return [(task, task.exc_info if task.exception else task.future.result()) for task in tasks]
+
+    def _put_pinned(self, f: Callable, threads: str, args: tuple, kwargs: dict) -> list:
+        """
+        Put a task in the queue of every thread of a list. The pool doesn't grow or shrink in the meantime, so every
+        thread in the list exists when its task is queued.
+
+        :param threads: String of threads like for add_task(), all threads if not provided
+        :return: List of tasks
+        """
+        # The resize lock may be held while a simulator starts, don't wait for it in the hub
+        if not self._resize_lock.acquire(blocking=not _in_hub_thread()):
+            return _blocking(self._put_pinned, f, threads, args, kwargs)
+        try:
             if not threads:
                 threads = self._all_threads()
+            return [self._put_task(f, i, args, kwargs) for i in self._parse_thread_list(threads)]
+        finally:
+            self._resize_lock.release()
+
+    def submit(self, f: Callable, *args, **kwargs) -> Future:
+        """
+        Non-blocking call to run a method once, in whichever thread is free first.
+        Only blocks while the application is paused.
+
+        :param f: The method you want to call in a thread, same as for add_task()
+        args -- Any additional parameters you want to pass along
+        kwargs -- Any additional named parameters you want to pass along
 
-            # Keeps track of the amount of tasks/requests currently running, so we know when all results have come in
-            requests = set()
-            for i in self._parse_thread_list(threads):
-                self._tasks[i].put(_PowerTask(f, i, *args, **kwargs))
-                requests.add(i)
+        :rtype: Future
+        :return: Future with the return value of your method. The task is available as its task property.
+        """
+        # Block when application is paused
+        with _unpaused():
+            return self._put_task(f, None, args, kwargs).future
+
+    def map(self, f: Callable, *iterables: Iterable, timeout: float=None, chunksize: int=1) -> Iterator:
+        """
+        Run a method for every set of items from the iterables, like the built-in map() but spread over all threads.
+        All calls are submitted right away, results are yielded in order.
+
+        :param f: The method you want to call in a thread, same as for add_task()
+        :param iterables: Iterables of positional arguments for the method
+        :param timeout: Optional maximum number of seconds to wait for all results, measured from the original call
+        :param chunksize: Not used, only here for Executor compatibility
+        :return: Iterator over the return values of your method. Raises the exception of a failed call when reached.
+        """
+        end_time = time.monotonic() + timeout if timeout is not None else None
+        fs = [self.submit(f, *args) for args in zip(*iterables)]
 
-            results = []
+        def result_iterator():
+            try:
+                # Reverse so we can pop from the end, dropping the reference to each future as we go
+                fs.reverse()
+                while fs:
+                    future = fs.pop()
+                    _wait([future], end_time - time.monotonic() if end_time is not None else None)
+                    yield future.result(0)
+            finally:
+                for future in fs:
+                    future.cancel()
+        return result_iterator()
+
+    def batch(self, f: Callable, arg_sets: Iterable, max_in_flight: int=None) -> Iterator:
+        """
+        Run a method for every argument set of a (possibly lazy and very long) iterable, yielding results as they
+        complete. Only max_in_flight tasks are queued or running at any time, the next argument set is taken from the
+        iterable whenever a task finishes. Stopping the iteration early cancels the remaining queued tasks.
+
+        With a journal, argument sets whose task succeeded before (in this or an earlier run) are skipped, and every
+        task that finishes is recorded. Arguments then have to be picklable.
+
+        :param f: The method you want to call in a thread, same as for add_task()
+        :param arg_sets: Iterable of argument sets. A tuple is passed as positional arguments, a dictionary as named
+            arguments and anything else as the only positional argument.
+        :param max_in_flight: Optional maximum number of tasks queued or running at once, defaults to twice the number
+            of threads
+        :rtype: Iterator[(_PowerTask, T)]
+        :return: Iterator over result tuples in order of completion, the same as the elements of the add_task() list
+        """
+        if max_in_flight is None:
+            max_in_flight = 2 * self._num_threads
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight should be at least 1')
+        arg_sets = iter(arg_sets)
+        # Finished tasks are put here by the worker threads, through the future callbacks
+        done = queue.Queue()
+        in_flight = set()
+        try:
             while True:
-                # Stop trying to get results if all tasks are handled
-                if not requests:
+                # Top up with new tasks
+                for arg_set in arg_sets:
+                    key = self._journal_key(f, arg_set)
+                    if key is not None and key in self.journal:
+                        self.metrics.count('skipped')
+                        continue
+                    future = self.submit(f, *_args(arg_set), **_kwargs(arg_set))
+                    if key is not None:
+                        future.add_done_callback(partial(self._journal_result, key))
+                    in_flight.add(future)
+                    future.add_done_callback(done.put)
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
                     break
-                # Task is returned to get to thread_id
-                # Block queue while waiting for results
-                task, result = self._results.get(True)
-                results.append((task, result))
-                # Remove thread id from requests to keep track of running tasks
-                requests.remove(task.thread_id)
+                future = _get(done)
+                in_flight.discard(future)
+                task = future.task
+                yield task, task.exc_info if task.exception else future.result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if self.journal is not None:
+                self.journal.flush()
 
-            return results
+    def cancel(self, *fs: Future, group=None) -> int:
+        """
+        Cancel tasks that haven't started yet and take them out of the queue. Tasks that are already running can't be
+        stopped, they run to completion.
+
+        :param fs: Futures of the tasks to cancel
+        :param group: Optional group, cancel all tasks of this group (see Task). A batch() of the group raises
+            CancelledError when it reaches a cancelled task.
+        :return: Number of tasks cancelled
+        """
+        fs = set(fs)
+        removed = self._tasks.remove(lambda task: task.future in fs or (group is not None and task.group == group))
+        for task in removed:
+            task.cancel()
+        self.metrics.count('cancelled', len(removed))
+        return len(removed)
+
+    def shutdown(self, wait: bool=True, *, cancel_futures: bool=False):
+        """
+        Executor interface for reset(), called when leaving a with block. Always waits for the threads to exit.
+        """
+        self.reset()
 
     def reset(self):
         """
         Cleanup all data: kills threads, clears tasks and releases COM references
         """
+        from pydispatch import dispatcher
+        dispatcher.disconnect(self._handle_command, signal=Signal.PW_COMMAND_SIGNAL, sender=dispatcher.Any)
+        if self.journal is not None:
+            self.journal.flush()
+        if self._autoscaler is not None:
+            self._autoscaler.stop()
+        if self._supervisor is not None:
+            self._supervisor.stop()
         # If not provided, default to all threads
         for i in range(self._num_threads):
             self._threads[i].dismiss()
             self._dismissed_threads.append(self._threads[i])
-        # Threads are not daemons so we get a chance to release COM apartment, needs join for this reason
+        # Join so threads get a chance to release their COM apartment
         for thread in self._dismissed_threads:
             thread.join()
         self._dismissed_threads = []
+        # Tasks that no thread got to anymore won't run
+        for task in self._tasks.clear():
+            task.cancel()
         self._tasks = None
         self._threads = None
 
         # Delete COM object references
         for i in range(self._num_threads):
-            # Clean COM objects
-            pw = self._pw_objects[i]
-            pythoncom.CoReleaseMarshalData(pw)
-            pw = None
+            # Clean COM objects, unless the thread failed to create it
+            if self._pw_objects[i] is not None:
+                self._backend.release(self._pw_objects[i])
         self._pw_objects = None
 
+    def _handle_command(self, message):
+        """
+        Handle commands sent by clients of PowerSocketServer that concern the tasks
+
+        :param message: Client message, a dictionary
+        """
+        if not isinstance(message, dict):
+            return
+        if message.get('command') == 'cancel' and message.get('group') is not None:
+            log.info('Cancelled %s tasks of group %s', self.cancel(group=message['group']), message['group'])
+        elif message.get('command') == 'pause' and self.journal is not None:
+            # A good moment for a checkpoint, nothing new starts until resuming
+            self.journal.flush()
+
     def _all_threads(self):
         """
         Get string notation for range of threads in the form of '0-self._num_threads'
@@ -175,7 +562,7 @@ class Power:
         :rtype: str
         :return: String representing all threads that can be parsed by _parse_thread_list()
         """
-        return '0' if self._num_threads is 1 else '0-' + str(self._num_threads - 1)
+        return '0' if self._num_threads == 1 else '0-' + str(self._num_threads - 1)
 
     @staticmethod
     def _parse_thread_list(threads: str) -> List:
@@ -191,101 +578,547 @@ class Power:
         ranges = (x.split("-") for x in threads.split(","))
         return set([i for r in ranges for i in range(int(r[0]), int(r[-1]) + 1)])
 
+    def _put_task(self, f: Callable, thread_id: int, args: tuple, kwargs: dict):
+        """
+        Create a task and put it in the task queue
+
+        :param f: The method to call, or a Task wrapping it
+        :param thread_id: ID of the thread to run the method in, or None to run it in any thread
+        :param args: Tuple of positional arguments
+        :param kwargs: Dictionary of named arguments
+        :rtype: _PowerTask
+        :return: The task that was queued
+        """
+        task = _PowerTask(f, thread_id, *args, **kwargs)
+        if task.store and self.store is None:
+            raise ValueError('Task has store set, but Power has no store')
+        self.metrics.count('submitted')
+        # The result of a stored task is its row number, which isn't worth caching
+        if thread_id is None and self.cache is not None and task.cache and not task.store:
+            # Hashes the case file and queries SQLite, in gevent's thread pool if in the hub
+            key, hit, result = _blocking(self._lookup, task, args, kwargs)
+            if key is not None:
+                if hit:
+                    self.metrics.count('cached')
+                    task.cached = True
+                    task.future.set_running_or_notify_cancel()
+                    task.future.set_result(result)
+                    return task
+                task.future.add_done_callback(partial(self._cache_result, key))
+        self._tasks.put(task, thread_id)
+        return task
+
+    def _lookup(self, task, args: tuple, kwargs: dict) -> tuple:
+        """
+        Look up the result of a task in the cache
+
+        :param task: _PowerTask to look up
+        :param args: Positional arguments of the task
+        :param kwargs: Named arguments of the task
+        :return: Tuple of the cache key, or None if the task can't be cached, a hit flag and the result
+        """
+        key = self.cache.key(task.f, task.case_key, args, kwargs)
+        if key is None:
+            return None, False, None
+        return (key,) + self.cache.get(key)
+
+    def _cache_result(self, key: str, future: Future):
+        """
+        Store the result of a finished task in the cache, unless it failed
+
+        :param key: Cache key of the task
+        :param future: Future of the task
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+        task = future.task
+        self.cache.put(key, task.f, task.case_key, future.result())
+
+    def _journal_key(self, f: Callable, arg_set) -> str:
+        """
+        Key of a task of batch() in the journal
+
+        :param f: Method or Task passed to batch()
+        :param arg_set: Argument set
+        :return: Key, or None without a journal
+        """
+        if self.journal is None:
+            return None
+        return task_key(f.f if isinstance(f, Task) else f, f.case_key if isinstance(f, Task) else None,
+                        _args(arg_set), _kwargs(arg_set))
+
+    def _journal_result(self, key: str, future: Future):
+        """
+        Record a finished task in the journal, unless it was cancelled
+
+        :param key: Task key
+        :param future: Future of the task
+        """
+        if not future.cancelled():
+            self.journal.record(key, future.exception() is None)
+
+    def _create_thread(self, i: int):
+        """
+        Create and start the thread with ID i
+
+        :param i: Thread ID
+        :rtype: _PowerThread
+        :return: The new thread
+        """
+        return _PowerThread(i, self._tasks, self._pw_objects, self._lock, self._backend, self._warmup,
+                            self._supervisor, self.metrics, self.store, self._hooks)
+
+    def _respawn(self, i: int, handle=None):
+        """
+        Replace the thread with ID i by a new one, used by the supervisor after abandoning the old thread
+
+        :param i: Thread ID
+        :param handle: Simulator handle for the new thread, or None to let the thread create one
+        """
+        self._pw_objects[i] = handle
+        self._threads[i] = self._create_thread(i)
+
+
+def _args(arg_set) -> tuple:
+    """Positional arguments of an argument set passed to Power.batch()"""
+    if isinstance(arg_set, tuple):
+        return arg_set
+    if isinstance(arg_set, dict):
+        return ()
+    return arg_set,
+
+
+def _kwargs(arg_set) -> dict:
+    """Named arguments of an argument set passed to Power.batch()"""
+    return arg_set if isinstance(arg_set, dict) else {}
+
+
+def _in_hub_thread() -> bool:
+    """
+    Check if we're running in the thread of the gevent hub (the main thread), where a blocking call would block every
+    greenlet, including PowerSocketServer. Other threads can simply block, and so can the main thread if nothing
+    imported gevent, as there are no greenlets then.
+
+    :return: True if in the hub thread
+    """
+    return 'gevent' in sys.modules and threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def _unpaused():
+    """
+    Block while the application is paused, for greenlets and threads alike
+    """
+    server = sys.modules.get('power.com.powersocketserver')
+    if server is None:
+        # Nothing can have paused without the socket server
+        yield
+    elif _in_hub_thread():
+        with server.PowerSocketServer.sem:
+            yield
+    else:
+        server.PowerSocketServer.resumed.wait()
+        yield
+
+
+def _get(q: queue.Queue):
+    """
+    Get an item from a queue filled by worker threads, without blocking other greenlets while waiting for it.
+
+    :param q: Queue to get from
+    :return: Next item
+    """
+    try:
+        return q.get_nowait()
+    except queue.Empty:
+        if not _in_hub_thread():
+            return q.get()
+        return sys.modules['gevent'].get_hub().threadpool.apply(q.get)
+
+
+def _wait(fs: Sequence[Future], timeout: float=None):
+    """
+    Wait for futures to finish without blocking other greenlets, like PowerSocketServer handling incoming messages.
+    The wait happens in gevent's thread pool, and only if there is anything left to wait for.
+
+    :param fs: Futures to wait for
+    :param timeout: Optional maximum number of seconds to wait
+    """
+    not_done = [future for future in fs if not future.done()]
+    if not not_done:
+        return
+    if not _in_hub_thread():
+        futures.wait(not_done, timeout)
+    else:
+        sys.modules['gevent'].get_hub().threadpool.apply(futures.wait, (not_done, timeout))
+
+
+def _blocking(f: Callable, *args):
+    """
+    Make a call that may block, in gevent's thread pool if in the hub thread so other greenlets keep running.
+
+    :param f: Function to call
+    args -- Its positional arguments
+    :return: What it returns
+    """
+    if not _in_hub_thread():
+        return f(*args)
+    return sys.modules['gevent'].get_hub().threadpool.apply(f, args)
+
+
+class Task:
+    """
+    Wraps a method with options for how Power runs it. Can be passed to add_task(), submit(), map() and batch()
+    wherever a method is expected.
+
+    Usage:
+
+    Run in a thread that has case.pwb open, after running a script command on it
+    >>> results = pw.add_task(Task(threaded_func, case='case.pwb', modifications=['SolvePowerFlow;']))
+
+    Threads keep track of the case they have open, so tasks that declare one won't open it again. Tasks that open cases
+    themselves should declare them instead, otherwise Power can't know what a thread has open.
+
+    :param f: The method to call, same as for add_task()
+    :param case: Optional path of the case the method needs opened
+    :param modifications: Optional script commands run once after opening the case. Threads with the same case but
+        different modifications open the case again.
+    :param cache: Set to False to never use the ResultCache of Power for this method
+    :param priority: Tasks with a higher priority run before those with a lower one, e.g. interactive requests before
+        background sweeps. Doesn't apply to tasks for specific threads.
+    :param deadline: Optional number of seconds after queuing. Tasks that haven't started by then are dropped, their
+        future raises concurrent.futures.TimeoutError.
+    :param group: Optional name to cancel tasks by, see Power.cancel()
+    :param store: Write the result to the ColumnStore of Power, the future gets the row number. Arguments have to be
+        picklable, they're part of the key of the row. The ResultCache isn't used for these tasks.
+    """
+    def __init__(self, f: Callable, case: str=None, modifications: Sequence[str]=(), cache: bool=True,
+                 priority: int=0, deadline: float=None, group=None, store: bool=False):
+        if modifications and case is None:
+            raise ValueError('Modifications need a case')
+        self.f = f
+        self.case = case
+        self.modifications = tuple(modifications)
+        self.cache = cache
+        self.priority = priority
+        self.deadline = deadline
+        self.group = group
+        self.store = store
+
+    @property
+    def case_key(self):
+        """
+        Identifies the state of the simulator this task needs
+
+        :return: Tuple of case and modifications, or None if any state will do
+        """
+        return (self.case, self.modifications) if self.case is not None else None
+
+    def __call__(self, *args, **kwargs):
+        return self.f(*args, **kwargs)
+
+
+def _open_case(case: str, modifications: tuple, thread_id: int, auto_sim):
+    """
+    Open a case and apply modifications, run by a thread before a task that needs them
+
+    :param case: Path of the case
+    :param modifications: Script commands to run after opening the case
+    """
+    error = auto_sim.OpenCase(case)[0]
+    if error:
+        raise RuntimeError('Could not open %s: %s' % (case, error))
+    for statement in modifications:
+        error = auto_sim.RunScriptCommand(statement)[0]
+        if error:
+            raise RuntimeError('Could not run %s on %s: %s' % (statement, case, error))
+
 
 class _PowerThread(Thread):
     """
     A thread that runs indefinitely and uses a queue to obtain more tasks.
 
     :type _thread_id: int
-    :type _results: Queue
     :type _pw_objects: list
     :type _lock: Lock
-    :type _tasks_list: list[Queue]
-    :type _tasks: Queue
+    :type _backend: Backend
+    :type _tasks: TaskQueue
+    :type _warmup: Callable
+    :type _supervisor: Supervisor
+    :type _metrics: Metrics
+    :type _store: ColumnStore
+    :type _hooks: list[TaskHook]
     :type _pw: CDispatch
     :type _pw_stream: PyIStream
     :type _dismissed: bool
+    :type _exited: bool
+    :type _orphan: object
+    :type ready: Future
+    :type crashed: bool
+    :type current_task: _PowerTask
+    :type task_started: float
+    :type loaded: tuple
+    :type case_loads: int
     """
-    def __init__(self, i: int, task_list: Sequence[Queue], results: Queue, pw_objects: list, lock: Lock, **kwargs):
+    def __init__(self, i: int, tasks: TaskQueue, pw_objects: list, lock: Lock, backend: Backend,
+                 warmup: Callable=None, supervisor: Supervisor=None, metrics: Metrics=None, store: ColumnStore=None,
+                 hooks: list=None, **kwargs):
         Thread.__init__(self, **kwargs)
-        self.daemon = False
+        # A daemon, so a thread the supervisor abandoned in a hung simulator call doesn't keep the interpreter from
+        # exiting. reset() still joins the threads, which gives them the chance to release their COM apartment.
+        self.daemon = True
         self._thread_id = i
-        self._results = results
         self._pw_objects = pw_objects
         self._lock = lock
-        self._tasks = task_list[i]
+        self._backend = backend
+        self._tasks = tasks
+        self._warmup = warmup
+        self._supervisor = supervisor
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._store = store
+        # Shared with Power, so hooks added later apply to running threads too
+        self._hooks = hooks if hooks is not None else []
         self._pw, self._pw_stream = None, None
         self._dismissed = False
+        self._exited = False
+        # Simulator handle the thread releases when it exits, see release_on_exit()
+        self._orphan = None
+        # Resolved with the startup timings once the simulator is ready to take tasks
+        self.ready = Future()
+        self.ready.thread_id = i
+        # Watched by the supervisor
+        self.crashed = False
+        self.current_task = None
+        self.task_started = None
+        # Case key of the case the simulator has open, if known
+        self.loaded = None
+        self.case_loads = 0
         self.start()
 
+    @property
+    def thread_id(self) -> int:
+        return self._thread_id
+
+    @property
+    def dismissed(self) -> bool:
+        return self._dismissed
+
     def marshal_com(self):
         """
         Marshal the PowerWorld COM object to be used in this thread.
         :return: Tuple with the COM object itself and the stream referencing the COM object.
         """
-        # Enable COM object access in this thread, but not others
-        pythoncom.CoInitialize()
         # Get stream reference from list of com objects
         pw_stream = self._pw_objects[self._thread_id]
-        # Make sure we're at the start of the stream, reset the pointer
-        pw_stream.Seek(0, 0)
-        # Unmarshal the stream, going back to the original interface
-        pw_interface = pythoncom.CoUnmarshalInterface(pw_stream, pythoncom.IID_IDispatch)
-        # And finally return the COM object that was created earlier
-        pw = win32com.client.Dispatch(pw_interface)
+        # Let the backend turn it into an object we can use in this thread
+        pw = self._backend.attach(pw_stream)
 
         return pw, pw_stream
 
     def unmarshal_com(self):
         """Unmarshal the PowerWorld COM object and return it to the queue for later usage."""
-        # Revert stream back to start position
-        self._pw_stream.Seek(0, 0)
         # Clean up COM reference
         self._pw = None
-        # Indicate that no more COM objects will be called in this thread
-        pythoncom.CoUninitialize()
+        self._backend.detach(self._pw_stream)
 
-    def run(self):
-        """Continuously run thread, consuming new tasks as we go."""
+    def start_simulator(self) -> dict:
+        """
+        Get the simulator of this thread ready: create it if the backend lets threads do so, marshal it and warm it up.
+
+        :return: Dictionary with the seconds spent on each step
+        """
+        timings = {}
+        started = time.perf_counter()
+        if self._pw_objects[self._thread_id] is None:
+            self._pw_objects[self._thread_id] = self._backend.create(self._thread_id)
+            timings['create'] = time.perf_counter() - started
+            started = time.perf_counter()
         # Can't do this before the thread starts running, otherwise marshalling is not successful
         self._pw, self._pw_stream = self.marshal_com()
+        timings['attach'] = time.perf_counter() - started
+        if self._warmup is not None:
+            started = time.perf_counter()
+            self._backend.execute(_PowerTask(self._warmup, self._thread_id), self._thread_id, self._pw)
+            timings['warmup'] = time.perf_counter() - started
+        return timings
+
+    def load_case(self, task):
+        """
+        Open the case a task needs, unless it's open already
+
+        :param task: _PowerTask with a case key
+        """
+        if task.case_key == self.loaded:
+            return
+        self.loaded = None
+        self._tasks.set_loaded(self._thread_id, None)
+        self._backend.execute(_PowerTask(_open_case, self._thread_id, *task.case_key), self._thread_id, self._pw)
+        self.case_loads += 1
+        self.loaded = task.case_key
+        self._tasks.set_loaded(self._thread_id, self.loaded)
+
+    def run(self):
+        """Continuously run thread, consuming new tasks as we go."""
+        try:
+            self._backend.enter_thread()
+        except BaseException as e:
+            self.ready.set_exception(e)
+            self._exit()
+            return
+        try:
+            self._work()
+        finally:
+            try:
+                self._exit()
+            finally:
+                self._backend.exit_thread()
+
+    def release_on_exit(self, handle) -> bool:
+        """
+        Leave a simulator to the thread to release once it exits, because it may still be in a call on it
+
+        :param handle: Simulator handle
+        :return: False if the thread has exited already, the caller should release the handle itself
+        """
+        with self._lock:
+            if self._exited:
+                return False
+            self._orphan = handle
+            return True
+
+    def _work(self):
+        """Main loop of the thread"""
+        # A thread replacing another one shouldn't be mistaken for having its case open
+        self._tasks.set_loaded(self._thread_id, None)
+        try:
+            self.ready.set_result(self.start_simulator())
+            self._metrics.worker_started(self._thread_id)
+        except BaseException as e:
+            if self._pw_stream is not None:
+                self.unmarshal_com()
+            self.ready.set_exception(e)
+            return
         while True:
             # Check if we're not trying to kill the thread
-            if self._dismissed:
+            if self._dismissed or self.crashed:
                 # If not using a lock here, the main thread will throw an exception when calling reset()
                 self._lock.acquire()
                 try:
                     self.unmarshal_com()
-                    # If there were any tasks left, get rid of them
-                    self._tasks.queue.clear()
-                    self._tasks.all_tasks_done.notify_all()
-                    self._tasks.unfinished_tasks = 0
                 finally:
                     self._lock.release()
                     break
-            try:
-                # Get task with blocking queue call
-                # This is much cheaper than running the while loop constantly. The timeout is meant for dismissing
-                # the thread, otherwise that check would never happen.
-                task = self._tasks.get(True, 1)
-            except queue.Empty:
+            # Get task with blocking queue call, dismiss() wakes us up with None
+            task = self._tasks.get(self._thread_id, worker=self)
+            if task is None:
                 continue
+            # Skip tasks that were cancelled while waiting in the queue, retried tasks are already running
+            if not task.future.running() and not task.future.set_running_or_notify_cancel():
+                self._metrics.count('cancelled')
+                continue
+            if task.deadline is not None and time.monotonic() > task.deadline:
+                self._metrics.count('expired')
+                error = futures.TimeoutError('Deadline passed before the task started')
+                task.fail((type(error), error, None))
+                continue
+            # Shared tasks only get a thread now
+            task.thread_id = self._thread_id
+            task.worker = self
+            task.attempts += 1
+            self.task_started = time.monotonic()
+            self.current_task = task
+            self._metrics.task_started(self._thread_id, self.task_started - task.queued_at)
+            auto_sim = self._pw
+            if self._hooks:
+                auto_sim = self._before(task, auto_sim)
+            try:
+                if task.case_key is not None:
+                    self.load_case(task)
+                # Call task function and store results
+                result = self._backend.execute(task, self._thread_id, auto_sim)
+                if task.store:
+                    result = self._store.append(task_key(task.f, task.case_key, task.args, task.kwargs), result)
+            except BaseException:
+                exc_info = sys.exc_info()
+                if self._hooks:
+                    self._after(task, None, exc_info)
+                if self._supervisor is not None and self._backend.crashed(exc_info[1]):
+                    # Leave the task to the supervisor, it retries it in a new thread with a fresh simulator
+                    with self._lock:
+                        if task.worker is self:
+                            self._metrics.task_finished(self._thread_id, time.monotonic() - self.task_started, True)
+                    self.crashed = True
+                    self._supervisor.wake()
+                    continue
+                # Or store exception message if something went wrong
+                log.exception('Task %s failed in thread %s', qualified_name(task.f), self._thread_id)
+                self._finish(task, exc_info=exc_info)
             else:
-                try:
-                    # Call task function and store results
-                    result = task.f(*task.args, thread_id=self._thread_id, auto_sim=self._pw, **task.kwargs)
-                    self._tasks.task_done()
-                    self._results.put((task, result))
-                except:
-                    # Or store exception message if something went wrong
-                    print(sys.exc_info())
-                    print(traceback.print_exc())
-                    task.exception = True
-                    self._results.put((task, sys.exc_info()))
+                if self._hooks:
+                    self._after(task, result, None)
+                self._finish(task, result)
+            self.current_task = None
+
+    def _exit(self):
+        """Clean up after the main loop, however it ended"""
+        # dismiss() leaves a mark for get(), which a thread dismissed while running a task never calls again
+        self._tasks.forget(self)
+        with self._lock:
+            self._exited = True
+            handle, self._orphan = self._orphan, None
+        if handle is not None:
+            self._backend.release(handle)
+
+    def _before(self, task, auto_sim):
+        """
+        Call the before() method of every hook
+
+        :param task: _PowerTask about to run
+        :param auto_sim: Object the task function would get
+        :return: Object the task function gets, possibly replaced by a hook
+        """
+        for hook in self._hooks:
+            try:
+                replaced = hook.before(task, self._thread_id, auto_sim)
+            except Exception:
+                log.exception('Hook %r failed before a task', hook)
+                continue
+            # Task functions of other backends don't get auto_sim in this thread, a stand-in would only get in the way
+            if replaced is not None and self._backend.in_thread:
+                auto_sim = replaced
+        return auto_sim
+
+    def _after(self, task, result, exc_info: tuple):
+        """Call the after() method of every hook, in reverse order"""
+        for hook in reversed(self._hooks):
+            try:
+                hook.after(task, self._thread_id, result, exc_info)
+            except Exception:
+                log.exception('Hook %r failed after a task', hook)
+
+    def _finish(self, task, result=None, exc_info: tuple=None):
+        """
+        Record and report the outcome of a task, unless the supervisor has taken it away from this thread in the
+        meantime, then it has recorded the attempt already
+
+        :param task: _PowerTask that was run
+        :param result: Return value of the task function
+        :param exc_info: sys.exc_info() tuple if the task function raised an exception
+        """
+        with self._lock:
+            if task.worker is not self:
+                return
+            task.worker = None
+        self._metrics.task_finished(self._thread_id, time.monotonic() - self.task_started, exc_info is not None)
+        if exc_info is not None:
+            task.fail(exc_info)
+        else:
+            task.future.set_result(result)
 
     def dismiss(self):
-        """Stop executing tasks and let the thread exit."""
+        """Stop executing tasks and let the thread exit. Doesn't wait for the running task, if any."""
         self._dismissed = True
+        self._tasks.dismiss(self)
 
 
 class _PowerTask:
@@ -296,18 +1129,66 @@ class _PowerTask:
 
     Properties:
     f -- The method to execute in a thread
-    thread_id -- The ID of the thread that will execute this task
+    case_key -- Tuple of the case and modifications the method needs, or None
+    cache -- Whether the result may come from or go into the ResultCache
+    cached -- Whether the result came from the ResultCache, without running f
+    priority -- Tasks with a higher priority are taken first
+    deadline -- time.monotonic() after which the task is dropped if it hasn't started, or None
+    group -- Name to cancel the task by, or None
+    store -- Whether the result goes to the ColumnStore of Power
+    thread_id -- The ID of the thread that will execute this task, None for tasks that can run in any thread until a
+        thread picks them up
     exception -- Flag to indicate whether or not an exception happened when executing f
+    exc_info -- The sys.exc_info() tuple if an exception happened
+    future -- Future that receives the result of f
+    pinned -- Whether the task has to run in the thread it was created for
+    attempts -- Number of times a thread started running the task, more than 1 if the supervisor retried it
+    queued_at -- time.monotonic() of the moment the task was (last) queued
+    worker -- The thread currently running the task, if any
     args -- Any additional parameters that have been passed along
     kwargs -- Any additional named parameters that have been passed along
 
     :type f: Callable
     :type thread_id: int
     :type exception: bool
+    :type future: Future
     """
     def __init__(self, f: Callable, thread_id: int, *args, **kwargs):
-        self.f = f
+        # Unwrap the options of a Task
+        self.case_key = f.case_key if isinstance(f, Task) else None
+        self.cache = f.cache if isinstance(f, Task) else True
+        self.cached = False
+        self.priority = f.priority if isinstance(f, Task) else 0
+        self.group = f.group if isinstance(f, Task) else None
+        self.store = f.store if isinstance(f, Task) else False
+        self.f = f.f if isinstance(f, Task) else f
         self.thread_id = thread_id
         self.exception = False
+        self.exc_info = None
+        self.future = Future()
+        self.future.task = self
+        self.pinned = thread_id is not None
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.deadline = self.queued_at + f.deadline if isinstance(f, Task) and f.deadline is not None else None
+        self.worker = None
         self.args = args
         self.kwargs = kwargs
+
+    def fail(self, exc_info: tuple):
+        """
+        Mark the task as failed
+
+        :param exc_info: sys.exc_info() tuple, or a tuple of the same form
+        """
+        self.exception = True
+        self.exc_info = exc_info
+        self.future.set_exception(exc_info[1])
+
+    def cancel(self):
+        """
+        Cancel a task that was taken out of the queue. The future of a task the Supervisor queued again is already
+        running and can't be cancelled, so it fails with CancelledError instead.
+        """
+        if not self.future.cancel() and not self.future.done():
+            self.fail((CancelledError, CancelledError(), None))
@@ -0,0 +1,244 @@
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident
+
+from power.store import qualified_name
+
+
+class TaskHook:
+    """
+    Called by the worker threads of Power around every task, see Power.add_hook(). Subclasses override whichever of
+    these they need. Exceptions raised by hooks are logged and otherwise ignored.
+
+    Without hooks, threads only check that there are none, so hooks cost nothing unless they're used.
+    """
+    def before(self, task, thread_id: int, auto_sim):
+        """
+        Called in the worker thread right before a task runs, before its case is opened
+
+        :param task: _PowerTask about to run
+        :param thread_id: ID of the worker thread
+        :param auto_sim: Object the task function will get
+        :return: Optional replacement for auto_sim, e.g. a proxy, None to keep it. Only used with backends that run
+            task functions in the worker thread, see Backend.in_thread.
+        """
+        return None
+
+    def after(self, task, thread_id: int, result, exc_info: tuple):
+        """
+        Called in the worker thread right after a task ran
+
+        :param task: _PowerTask that ran
+        :param thread_id: ID of the worker thread
+        :param result: Return value of the task function, None if it failed
+        :param exc_info: sys.exc_info() tuple if the task function raised an exception, None otherwise
+        """
+        pass
+
+
+class Tracer(TaskHook):
+    """
+    Records how long every task takes and, with calls set, every call it makes to the simulator, in the Chrome trace
+    event format. Load it in chrome://tracing or https://ui.perfetto.dev to see where the time of a sweep goes.
+
+    Optionally a fraction of the tasks of every thread is profiled too: their stacks are sampled at an interval, and
+    written in the collapsed stack format of flamegraph.pl and speedscope.
+
+    Simulator calls are timed through a proxy around auto_sim, so they are only seen for backends that run task
+    functions in the worker thread (ComBackend and FakeBackend).
+
+    Usage:
+
+    >>> tracer = Tracer(profile=0.1)
+    >>> pw.add_hook(tracer)
+    >>> pw.map(threaded_func, range(1000))
+    >>> tracer.write_trace('trace.json')
+    >>> tracer.write_stacks('stacks.txt')
+    >>> pw.remove_hook(tracer)
+
+    :param calls: Record a span for every simulator call
+    :param profile: Fraction of the tasks of every thread to profile, 0 to not profile at all
+    :param interval: Seconds between stack samples of profiled tasks
+    :param seed: Seed of the random choice of tasks to profile, thread i uses seed + i
+    :param limit: Maximum number of trace events to keep, later ones are counted in dropped
+    :type events: list[dict]
+    :type stacks: Counter
+    :type dropped: int
+    """
+    def __init__(self, calls: bool=True, profile: float=0.0, interval: float=0.005, seed: int=0,
+                 limit: int=1000000):
+        self.calls = calls
+        self.profile = profile
+        self.interval = interval
+        self.seed = seed
+        self.limit = limit
+        self.events = []
+        self.stacks = Counter()
+        self.dropped = 0
+        self._pid = os.getpid()
+        self._started = time.perf_counter()
+        self._lock = Lock()
+        self._random = {}
+        # Thread ID of the worker to the start of its task, and whether it's profiled
+        self._running = {}
+        # Identifiers of the threads whose stacks are sampled
+        self._profiled = set()
+        self._sampler = None
+        self._stopping = Event()
+
+    def before(self, task, thread_id: int, auto_sim):
+        profiled = self.profile > 0 and self._choose(thread_id)
+        if profiled:
+            self._start_sampler()
+            with self._lock:
+                self._profiled.add(get_ident())
+        self._running[thread_id] = (time.perf_counter(), profiled)
+        if self.calls:
+            return _SimulatorProxy(auto_sim, self, thread_id)
+
+    def after(self, task, thread_id: int, result, exc_info: tuple):
+        started, profiled = self._running.pop(thread_id, (None, False))
+        if profiled:
+            with self._lock:
+                self._profiled.discard(get_ident())
+        if started is None:
+            return
+        args = {'attempt': task.attempts}
+        if task.case_key is not None:
+            args['case'] = task.case_key[0]
+        if exc_info is not None:
+            args['exception'] = repr(exc_info[1])
+        self.span(qualified_name(task.f), 'task', thread_id, started, time.perf_counter(), args)
+
+    def span(self, name: str, category: str, thread_id: int, started: float, finished: float, args: dict=None):
+        """
+        Record a complete event
+
+        :param name: Name of the span
+        :param category: Category, 'task' or 'simulator' for spans recorded by the tracer itself
+        :param thread_id: ID of the worker thread, shown as the thread of the event
+        :param started: time.perf_counter() at the start
+        :param finished: time.perf_counter() at the end
+        :param args: Optional dictionary shown with the event
+        """
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self._pid, 'tid': thread_id,
+                 'ts': (started - self._started) * 1e6, 'dur': (finished - started) * 1e6}
+        if args:
+            event['args'] = args
+        with self._lock:
+            if len(self.events) < self.limit:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def trace(self) -> dict:
+        """
+        :return: Dictionary in the Chrome trace event format
+        """
+        with self._lock:
+            events = list(self.events)
+        names = sorted({event['tid'] for event in events})
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid,
+                     'args': {'name': 'PowerThread-%s' % tid}} for tid in names]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def collapsed(self) -> str:
+        """
+        :return: Sampled stacks of the profiled tasks in the collapsed stack format, a line per stack with the frames
+            from the outermost one, separated by semicolons, and the number of samples
+        """
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return ''.join('%s %s\n' % (stack, count) for stack, count in stacks)
+
+    def write_trace(self, path: str):
+        """
+        :param path: Path of the JSON file to write the trace to
+        """
+        with open(path, 'w') as file:
+            json.dump(self.trace(), file)
+
+    def write_stacks(self, path: str):
+        """
+        :param path: Path of the file to write the collapsed stacks to
+        """
+        with open(path, 'w') as file:
+            file.write(self.collapsed())
+
+    def close(self):
+        """Stop the sampler thread, if it was started"""
+        self._stopping.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def _choose(self, thread_id: int) -> bool:
+        """Decide whether to profile the next task of a thread"""
+        generator = self._random.get(thread_id)
+        if generator is None:
+            generator = self._random[thread_id] = random.Random(self.seed + thread_id)
+        return generator.random() < self.profile
+
+    def _start_sampler(self):
+        with self._lock:
+            if self._sampler is not None:
+                return
+            self._stopping.clear()
+            self._sampler = Thread(target=self._sample, name='PowerProfiler', daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        """Main loop of the sampler thread"""
+        while not self._stopping.wait(self.interval):
+            with self._lock:
+                profiled = set(self._profiled)
+            if not profiled:
+                continue
+            frames = sys._current_frames()
+            samples = [_stack(frames[ident]) for ident in profiled if ident in frames]
+            with self._lock:
+                self.stacks.update(samples)
+
+
+class _SimulatorProxy:
+    """
+    Stands in for auto_sim in a traced task, recording a span for every method call
+
+    :type _tracer: Tracer
+    """
+    def __init__(self, auto_sim, tracer, thread_id: int):
+        object.__setattr__(self, '_auto_sim', auto_sim)
+        object.__setattr__(self, '_tracer', tracer)
+        object.__setattr__(self, '_thread_id', thread_id)
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._auto_sim, name)
+        if not callable(attribute):
+            return attribute
+        tracer, thread_id = self._tracer, self._thread_id
+
+        def traced(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                tracer.span(name, 'simulator', thread_id, started, time.perf_counter())
+        return traced
+
+    def __setattr__(self, name: str, value):
+        setattr(self._auto_sim, name, value)
+
+
+def _stack(frame) -> str:
+    """Collapsed stack of a frame, outermost frame first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%s)' % (getattr(code, 'co_qualname', code.co_name), os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
@@ -0,0 +1,667 @@
+import argparse
+import importlib
+import itertools
+import logging as log
+import os
+import socket
+import time
+import traceback
+from concurrent import futures
+from concurrent.futures import Future
+from functools import lru_cache
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
+from queue import Queue
+from threading import Condition, Event, Lock, Thread
+from typing import Callable
+
+from power.backends import Backend, FakeBackend, ComBackend, _RemoteTraceback
+from power.supervisor import WorkerCrashed, WorkerTimeout
+
+DEFAULT_PORT = 7100
+
+
+class AgentLost(ConnectionError):
+    """The agent running a task disconnected or stopped sending heartbeats."""
+    pass
+
+
+class Coordinator:
+    """
+    Accepts connections of agents on other hosts and places simulators on them, for use with RemoteBackend.
+
+    Every agent offers a number of slots, one simulator each. A slot goes to the agent with the lowest share of its
+    slots in use, ties are broken by the load it reported in its last heartbeat. An agent that disconnects or misses
+    heartbeats for heartbeat_timeout seconds is dropped, and the tasks it was running fail with AgentLost. So does an
+    agent that reconnects, on its old connection, and all agents when the coordinator is closed.
+
+    Messages are pickled, like those of ProcessBackend, and agents run whatever function the coordinator names, so
+    both sides have to prove they know the same authkey. It listens on this host only unless told otherwise, only
+    listen on other interfaces of a network you trust.
+
+    An agent withdraws the slots whose simulator fails to start, calls already on their way to them fail with
+    WorkerCrashed.
+
+    Usage:
+
+    >>> coordinator = Coordinator(('0.0.0.0', 7100), authkey=b'secret')
+    >>> pw = Power(8, backend=RemoteBackend(coordinator), supervisor=Supervisor(policy=RetryPolicy(retries=2)))
+    >>> pw.create_pw_collection()
+
+    :param address: Tuple of host and port to listen on, port 0 picks a free one
+    :param authkey: Key agents have to prove they know before they can connect, required
+    :param heartbeat_timeout: Seconds without a message after which an agent is considered gone
+    :type agents: list[_AgentConnection]
+    """
+    def __init__(self, address: tuple=('127.0.0.1', DEFAULT_PORT), authkey: bytes=None,
+                 heartbeat_timeout: float=5.0):
+        if not authkey:
+            raise ValueError('An authkey is required, agents run the functions the coordinator sends them')
+        self.authkey = authkey
+        self.heartbeat_timeout = heartbeat_timeout
+        self.agents = []
+        self._cond = Condition()
+        self._calls = itertools.count()
+        self._closed = False
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen()
+        # Wake up regularly to notice close()
+        self._server.settimeout(0.2)
+        self.address = self._server.getsockname()
+        Thread(target=self._accept, name='PowerCoordinator', daemon=True).start()
+        Thread(target=self._monitor, name='PowerCoordinatorMonitor', daemon=True).start()
+
+    def stats(self) -> list:
+        """
+        :return: List with a dictionary per connected agent: its name, number of working slots, slots in use, busy
+            workers and load as of the last heartbeat
+        """
+        with self._cond:
+            return [{'name': agent.name, 'slots': agent.capacity, 'used': agent.capacity - len(agent.free),
+                     'busy': agent.busy, 'load': agent.load} for agent in self.agents]
+
+    def wait_for_agents(self, slots: int, timeout: float=None) -> bool:
+        """
+        Wait until the connected agents offer a number of slots in total
+
+        :param slots: Number of slots
+        :param timeout: Optional number of seconds to wait
+        :return: False if the timeout passed first
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: sum(agent.capacity for agent in self.agents) >= slots, timeout)
+
+    def acquire(self, timeout: float=None):
+        """
+        Reserve a slot on the least loaded agent, waiting for one to become available
+
+        :param timeout: Optional number of seconds to wait
+        :rtype: _RemoteSlot
+        :raises RuntimeError: If no agent had a free slot in time
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or any(agent.free for agent in self.agents), timeout):
+                raise RuntimeError('No agent with a free slot after %ss' % timeout)
+            if self._closed:
+                raise RuntimeError('Coordinator is closed')
+            agent = min((agent for agent in self.agents if agent.free),
+                        key=lambda agent: ((agent.capacity - len(agent.free)) / max(agent.capacity, 1), agent.load))
+            index = min(agent.free)
+            del agent.free[index]
+            return _RemoteSlot(agent, index)
+
+    def release(self, slot):
+        """
+        Give a slot back to its agent
+
+        :type slot: _RemoteSlot
+        """
+        with self._cond:
+            if slot.agent.alive and slot.index not in slot.agent.withdrawn:
+                slot.agent.free[slot.index] = True
+                self._cond.notify_all()
+
+    def call(self, slot, f: Callable, args: tuple, kwargs: dict, thread_id: int, timeout: float=None):
+        """
+        Run a function in the simulator of a slot and wait for the result. Exceptions raised by the function are raised
+        again here, with the remote traceback as cause.
+
+        :type slot: _RemoteSlot
+        :param f: Importable function
+        :param args: Picklable positional arguments
+        :param kwargs: Picklable named arguments
+        :param thread_id: ID of the worker thread, passed on to the function
+        :param timeout: Optional number of seconds to wait for the result
+        :return: Return value of the function
+        :raises AgentLost: If the agent went away before it returned
+        :raises WorkerTimeout: If the timeout passed first, a result that arrives later is ignored
+        """
+        name = function_name(f)
+        future = Future()
+        with self._cond:
+            if not slot.agent.alive:
+                raise AgentLost('Agent %s is gone' % slot.agent.name)
+            call_id = next(self._calls)
+            slot.agent.pending[call_id] = future
+        slot.agent.send(('call', call_id, slot.index, thread_id, name, args, kwargs))
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            with self._cond:
+                slot.agent.pending.pop(call_id, None)
+            raise WorkerTimeout('No result from %r after %ss' % (slot, timeout)) from None
+
+    def close(self):
+        """Stop accepting agents and disconnect the connected ones"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for agent in list(self.agents):
+            agent.drop('coordinator closed')
+        self._server.close()
+
+    def _accept(self):
+        """Main loop of the thread accepting agents"""
+        while not self._closed:
+            try:
+                sock, address = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            Thread(target=self._handshake, args=(sock, address), name='PowerAgent-%s:%s' % address,
+                   daemon=True).start()
+
+    def _handshake(self, sock: socket.socket, address: tuple):
+        """Authenticate a new agent and serve it until it goes away"""
+        sock.setblocking(True)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # The connection gets its own descriptor, so shutting the socket down wakes up a blocked recv()
+        conn = Connection(os.dup(sock.fileno()))
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            kind, hello = conn.recv()
+            if kind != 'hello':
+                raise ValueError('Expected hello, got %s' % kind)
+        except Exception as e:
+            log.warning('Rejected agent at %s:%s: %r', *address, e)
+            conn.close()
+            sock.close()
+            return
+        agent = _AgentConnection(self, sock, conn, hello.get('name') or '%s:%s' % address, hello['slots'],
+                                 hello.get('session'))
+        with self._cond:
+            # An agent that reconnects before its old connection was noticed to be gone won't answer calls made there
+            replaced = [old for old in self.agents if agent.session is not None and old.session == agent.session]
+            self.agents.append(agent)
+            self._cond.notify_all()
+        for old in replaced:
+            old.drop('agent reconnected')
+        log.info('Agent %s connected with %s slots', agent.name, agent.slots)
+        agent.serve()
+
+    def _monitor(self):
+        """Main loop of the thread dropping agents that missed their heartbeats"""
+        while not self._closed:
+            time.sleep(self.heartbeat_timeout / 4)
+            now = time.monotonic()
+            for agent in list(self.agents):
+                if now - agent.last_seen > self.heartbeat_timeout:
+                    agent.drop('no heartbeat for %.1fs' % (now - agent.last_seen))
+
+
+class _AgentConnection:
+    """
+    Coordinator side of a connected agent
+
+    :type coordinator: Coordinator
+    :type free: dict[int, bool]
+    :type withdrawn: set[int]
+    :type pending: dict[int, Future]
+    :type session: str
+    """
+    def __init__(self, coordinator, sock: socket.socket, conn: Connection, name: str, slots: int,
+                 session: str=None):
+        self.coordinator = coordinator
+        self.sock = sock
+        self.conn = conn
+        self.name = name
+        self.slots = slots
+        # Same for every connection of an agent, to tell when it reconnected
+        self.session = session
+        # Used as an ordered set of free slot indexes
+        self.free = dict.fromkeys(range(slots), True)
+        # Slots whose simulator failed, they aren't given out anymore
+        self.withdrawn = set()
+        self.busy = 0
+        self.load = 0.0
+        self.last_seen = time.monotonic()
+        self.alive = True
+        self.pending = {}
+        self._send_lock = Lock()
+
+    @property
+    def capacity(self) -> int:
+        """Number of slots that have a working simulator"""
+        return self.slots - len(self.withdrawn)
+
+    def send(self, message):
+        try:
+            with self._send_lock:
+                self.conn.send(message)
+        except (OSError, ValueError) as e:
+            self.drop('send failed: %r' % e)
+            raise AgentLost('Agent %s is gone' % self.name) from e
+
+    def serve(self):
+        """Handle messages of the agent until it goes away, runs in the thread of the connection"""
+        try:
+            while True:
+                message = self.conn.recv()
+                self.last_seen = time.monotonic()
+                if message[0] == 'heartbeat':
+                    self.busy, self.load = message[1]['busy'], message[1]['load']
+                elif message[0] == 'result':
+                    _, call_id, status, value = message
+                    with self.coordinator._cond:
+                        future = self.pending.pop(call_id, None)
+                    if future is not None:
+                        _resolve_future(future, status, value)
+                elif message[0] == 'withdraw':
+                    _, index, reason = message
+                    log.warning('Agent %s withdrew slot %s: %s', self.name, index, reason)
+                    with self.coordinator._cond:
+                        self.withdrawn.add(index)
+                        self.free.pop(index, None)
+        except (EOFError, OSError) as e:
+            self.drop('connection lost: %r' % e)
+        except Exception:
+            log.exception('Invalid message from agent %s', self.name)
+            self.drop('invalid message')
+
+    def drop(self, reason: str):
+        """Forget the agent and fail the tasks it was running"""
+        with self.coordinator._cond:
+            if not self.alive:
+                return
+            self.alive = False
+            if self in self.coordinator.agents:
+                self.coordinator.agents.remove(self)
+            pending, self.pending = self.pending, {}
+            self.free = {}
+            self.coordinator._cond.notify_all()
+        log.warning('Dropped agent %s: %s', self.name, reason)
+        for future in pending.values():
+            future.set_exception(AgentLost('Agent %s was dropped: %s' % (self.name, reason)))
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.conn.close()
+
+
+class _RemoteSlot:
+    """
+    Simulator handle of RemoteBackend: a slot of an agent
+
+    :type agent: _AgentConnection
+    :type index: int
+    """
+    def __init__(self, agent, index: int):
+        self.agent = agent
+        self.index = index
+
+    def __repr__(self):
+        return '<slot %s of agent %s>' % (self.index, self.agent.name)
+
+
+def _resolve_future(future: Future, status: str, value):
+    """Set the result of a call from the reply of an agent"""
+    if status == 'ok':
+        future.set_result(value)
+        return
+    exception, tb = value
+    if status == 'crashed':
+        exception = WorkerCrashed('Simulator crashed on the agent: %r' % exception)
+    exception.__cause__ = _RemoteTraceback(tb)
+    future.set_exception(exception)
+
+
+class RemoteBackend(Backend):
+    """
+    Remote backend: every worker thread drives a simulator in a slot of an agent on another host, see Coordinator and
+    Agent. Threads claim their slot when they start, so simulators on all hosts start at the same time.
+
+    Task functions are sent by their importable name, so they need to be defined at module level in a module the
+    agents can import. Arguments and return values have to be picklable. The thread_id passed to task functions is
+    the ID of the worker thread here.
+
+    Tasks of an agent that goes away fail with AgentLost, and with WorkerCrashed if the simulator crashed on the agent.
+    Use a Supervisor to run them again in a slot of another agent.
+
+    :param coordinator: Coordinator the agents connect to
+    :param timeout: Optional number of seconds a thread waits for a free slot
+    :param call_timeout: Optional number of seconds a task waits for its result, after which it fails with
+        WorkerTimeout and the simulator is replaced like a crashed one
+    """
+    parallel_create = True
+
+    def __init__(self, coordinator: Coordinator, timeout: float=None, call_timeout: float=None):
+        self.coordinator = coordinator
+        self.timeout = timeout
+        self.call_timeout = call_timeout
+
+    def create(self, i: int):
+        return self.coordinator.acquire(self.timeout)
+
+    def execute(self, task, thread_id: int, auto_sim):
+        return self.coordinator.call(auto_sim, task.f, task.args, task.kwargs, thread_id, self.call_timeout)
+
+    def alive(self, slot) -> bool:
+        return slot.agent.alive
+
+    def crashed(self, exception: BaseException) -> bool:
+        return isinstance(exception, (AgentLost, WorkerCrashed, WorkerTimeout))
+
+    def release(self, slot):
+        self.coordinator.release(slot)
+
+
+class Agent:
+    """
+    Runs simulators on this host for a Coordinator on another one. Every slot has a worker thread with its own
+    simulator, created with the local backend. The agent reconnects if it loses the coordinator, the simulators keep
+    running in the meantime. Slots whose simulator can't be started, or replaced after a crash, are withdrawn.
+
+    Usage:
+
+    From the command line
+    $ python -m power.remote coordinator-host:7100 --slots 4 --authkey secret
+
+    Or from Python, e.g. to test with fake simulators
+    >>> agent = Agent(('localhost', 7100), backend=FakeBackend(), slots=4, authkey=b'secret')
+    >>> agent.start()
+
+    :param address: Tuple of host and port of the coordinator
+    :param backend: Backend creating the local simulators, defaults to ComBackend
+    :param slots: Number of simulators
+    :param name: Name the coordinator knows the agent by, defaults to the host name
+    :param authkey: Key shared with the coordinator, required
+    :param heartbeat: Seconds between heartbeats
+    :param retry: Seconds between attempts to connect to the coordinator
+    """
+    def __init__(self, address: tuple, backend: Backend=None, slots: int=1, name: str=None, authkey: bytes=None,
+                 heartbeat: float=1.0, retry: float=1.0):
+        if not authkey:
+            raise ValueError('An authkey is required, agents run the functions the coordinator sends them')
+        self.address = tuple(address)
+        self.backend = backend if backend is not None else ComBackend()
+        self.slots = slots
+        self.name = name or socket.gethostname()
+        self.authkey = authkey
+        self.heartbeat = heartbeat
+        self.retry = retry
+        self.connected = Event()
+        self._session = os.urandom(8).hex()
+        self._workers = []
+        self._sock = None
+        self._conn = None
+        self._send_lock = Lock()
+        self._stopping = Event()
+        self._thread = None
+
+    def start(self):
+        """Run the agent in a background thread"""
+        self._thread = Thread(target=self.run, name='PowerAgent', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """Create the simulators and serve the coordinator until stop() is called"""
+        self._workers = [_AgentWorker(self, i) for i in range(self.slots)]
+        for worker in self._workers:
+            worker.start()
+        for worker in self._workers:
+            worker.ready.wait()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self._serve()
+                except (OSError, EOFError) as e:
+                    if not self._stopping.is_set():
+                        log.warning('Lost coordinator at %s:%s: %r', *self.address, e)
+                self.connected.clear()
+                self._stopping.wait(self.retry)
+        finally:
+            for worker in self._workers:
+                worker.calls.put(None)
+            for worker in self._workers:
+                worker.join()
+
+    def stop(self):
+        """Disconnect and release the simulators"""
+        self._stopping.set()
+        self._disconnect()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def send(self, message):
+        """Send a message to the coordinator, if connected"""
+        try:
+            with self._send_lock:
+                if self._conn is not None:
+                    self._conn.send(message)
+        except (OSError, ValueError):
+            # The connection loop notices, and the coordinator fails the call
+            pass
+
+    def _serve(self):
+        """Connect to the coordinator and run the calls it sends until the connection ends"""
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = Connection(os.dup(sock.fileno()))
+        self._sock, self._conn = sock, conn
+        try:
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+            self.send(('hello', {'name': self.name, 'slots': self.slots, 'session': self._session}))
+            for worker in self._workers:
+                if worker.failed is not None:
+                    self.send(('withdraw', worker.i, repr(worker.failed)))
+            self.connected.set()
+            log.info('Connected to coordinator at %s:%s', *self.address)
+            heartbeat = Thread(target=self._heartbeat, args=(conn,), name='PowerAgentHeartbeat', daemon=True)
+            heartbeat.start()
+            while True:
+                message = conn.recv()
+                if message[0] == 'call':
+                    _, call_id, slot, thread_id, name, args, kwargs = message
+                    self._workers[slot].calls.put((call_id, thread_id, name, args, kwargs))
+        finally:
+            self._disconnect()
+
+    def _disconnect(self):
+        with self._send_lock:
+            sock, conn, self._sock, self._conn = self._sock, self._conn, None, None
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        conn.close()
+
+    def _heartbeat(self, conn: Connection):
+        """Main loop of the heartbeat thread of a connection"""
+        while self._conn is conn:
+            self.send(('heartbeat', {'busy': sum(worker.busy for worker in self._workers), 'load': _load()}))
+            self._stopping.wait(self.heartbeat)
+
+
+class _AgentWorker(Thread):
+    """
+    Runs the calls for one slot of an agent in its own simulator, replacing the simulator when it crashes. If the
+    simulator can't be started the slot is withdrawn, calls that still reach it fail as crashed.
+
+    :type agent: Agent
+    :type failed: BaseException
+    """
+    def __init__(self, agent, i: int):
+        super().__init__(name='PowerAgentWorker-%s' % i, daemon=True)
+        self.agent = agent
+        self.i = i
+        self.calls = Queue()
+        self.ready = Event()
+        self.busy = False
+        self.failed = None
+        self._handle = None
+        self._auto_sim = None
+
+    def run(self):
+        backend = self.agent.backend
+        entered = False
+        try:
+            backend.enter_thread()
+            entered = True
+            self._start_simulator()
+        except Exception as e:
+            self._withdraw(e)
+        finally:
+            self.ready.set()
+        try:
+            while True:
+                call = self.calls.get()
+                if call is None:
+                    break
+                call_id, thread_id, name, args, kwargs = call
+                if self.failed is not None:
+                    self._reply(call_id, 'crashed', (self.failed, 'Slot %s was withdrawn\n' % self.i))
+                    continue
+                self.busy = True
+                try:
+                    task = _Call(resolve_function(name), args, kwargs)
+                    reply = ('ok', backend.execute(task, thread_id, self._auto_sim))
+                except BaseException as e:
+                    reply = ('crashed' if backend.crashed(e) else 'error', (e, traceback.format_exc()))
+                    if reply[0] == 'crashed':
+                        self._replace_simulator()
+                self.busy = False
+                self._reply(call_id, *reply)
+        finally:
+            try:
+                self._stop_simulator()
+            finally:
+                if entered:
+                    backend.exit_thread()
+
+    def _reply(self, call_id: int, status: str, value):
+        try:
+            self.agent.send(('result', call_id, status, value))
+        except Exception as e:
+            # Result or exception can't be pickled, report that instead
+            self.agent.send(('result', call_id, 'error', (RuntimeError('Could not send result: %r' % e),
+                                                          traceback.format_exc())))
+
+    def _withdraw(self, e: Exception):
+        """Stop offering the slot, its simulator couldn't be started"""
+        log.exception('Simulator %s could not be started, withdrawing the slot', self.i)
+        self.failed = e
+        self.agent.send(('withdraw', self.i, repr(e)))
+
+    def _start_simulator(self):
+        handle = self.agent.backend.create(self.i)
+        try:
+            self._auto_sim = self.agent.backend.attach(handle)
+        except BaseException:
+            self.agent.backend.release(handle)
+            raise
+        self._handle = handle
+
+    def _stop_simulator(self):
+        if self._handle is None:
+            return
+        self._auto_sim = None
+        self.agent.backend.detach(self._handle)
+        self.agent.backend.release(self._handle)
+        self._handle = None
+
+    def _replace_simulator(self):
+        log.warning('Simulator %s crashed, replacing it', self.i)
+        self.agent.backend.terminate(self._handle)
+        self._stop_simulator()
+        try:
+            self._start_simulator()
+        except Exception as e:
+            self._withdraw(e)
+
+
+class _Call:
+    """What Backend.execute() needs of a task, for a call received from the coordinator"""
+    def __init__(self, f: Callable, args: tuple, kwargs: dict):
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+
+
+def function_name(f: Callable) -> str:
+    """
+    :param f: Function defined at module level
+    :return: Name an agent can import the function by, as 'module:qualified.name'
+    :raises ValueError: If the function can't be imported by name
+    """
+    module, qualname = getattr(f, '__module__', None), getattr(f, '__qualname__', None)
+    if module is None or qualname is None or '<' in qualname or module == '__main__':
+        raise ValueError('%r can not be run by an agent, task functions have to be defined at module level of an '
+                         'importable module' % f)
+    return '%s:%s' % (module, qualname)
+
+
+@lru_cache(maxsize=256)
+def resolve_function(name: str) -> Callable:
+    """
+    :param name: Name returned by function_name()
+    :return: The function
+    """
+    module, _, qualname = name.partition(':')
+    f = importlib.import_module(module)
+    for part in qualname.split('.'):
+        f = getattr(f, part)
+    return f
+
+
+def _load() -> float:
+    """Load average of this host per CPU, 0 where it's unknown"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run simulators for a Power coordinator on another host')
+    parser.add_argument('coordinator', help='Host and port of the coordinator, as host:port')
+    parser.add_argument('--slots', type=int, default=os.cpu_count() or 1, help='Number of simulators')
+    parser.add_argument('--name', help='Name of this agent, defaults to the host name')
+    parser.add_argument('--authkey', required=True, help='Key shared with the coordinator')
+    parser.add_argument('--heartbeat', type=float, default=1.0, help='Seconds between heartbeats')
+    parser.add_argument('--fake', action='store_true', help='Use fake simulators instead of PowerWorld')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per call of the fake simulators')
+    args = parser.parse_args(argv)
+
+    log.basicConfig(level=log.INFO)
+    host, _, port = args.coordinator.partition(':')
+    agent = Agent((host or 'localhost', int(port or DEFAULT_PORT)),
+                  backend=FakeBackend(latency=args.latency) if args.fake else None, slots=args.slots, name=args.name,
+                  authkey=args.authkey.encode(), heartbeat=args.heartbeat)
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+import itertools
+import queue
+import time
+from collections import deque
+from threading import Condition
+
+
+class TaskQueue:
+    """
+    Task queue shared by all threads of Power.
+
+    Tasks are either pinned to a specific thread, for broadcast-style calls like opening a case on every simulator, or
+    shared, in which case whichever thread asks for work first gets them. A thread always empties its own pinned tasks
+    before taking shared ones. This way a slow task only holds up the thread running it, instead of everything that
+    happened to be queued behind it.
+
+    Shared tasks can require a case (see Task). Opening a case is expensive, so a thread first takes tasks for the case
+    it has loaded, then tasks that don't need a case. Only when neither are left does it open another case, and only if
+    no other idle thread has that case loaded already. When several idle threads could open it, the one whose case was
+    used least recently does, so the pool of simulators behaves like an LRU cache of cases.
+
+    Shared tasks with a higher priority go before all tasks with a lower one, case affinity only decides between tasks
+    of the same priority.
+
+    :param num_threads: Number of threads taking tasks from this queue
+    :type _pinned: dict[int, deque]
+    :type _shared: dict[tuple, deque]
+    :type _loaded: dict[int, object]
+    :type _last_used: dict[int, float]
+    :type _waiting: dict[int, object]
+    :type _dismissed: set
+    """
+    def __init__(self, num_threads: int):
+        self._cond = Condition()
+        self._pinned = {i: deque() for i in range(num_threads)}
+        # Shared tasks by priority and case key, a case key of None for tasks that don't need a case. Elements are
+        # (sequence, task) tuples, so the oldest task can be found across cases.
+        self._shared = {}
+        self._sequence = itertools.count(1)
+        self._loaded = {i: None for i in range(num_threads)}
+        self._last_used = {i: 0.0 for i in range(num_threads)}
+        # Thread ID of the threads waiting in get() to a token of the call
+        self._waiting = {}
+        self._dismissed = set()
+
+    def put(self, task, thread_id: int=None, front: bool=False):
+        """
+        Add a task to the queue
+
+        :param task: _PowerTask to add
+        :param thread_id: Optional ID of the thread that has to run the task, any thread can run it if not provided
+        :param front: Put the task in front of the others, e.g. when retrying it
+        """
+        with self._cond:
+            if thread_id is not None:
+                if front:
+                    self._pinned[thread_id].appendleft(task)
+                else:
+                    self._pinned[thread_id].append(task)
+                # We can't wake up a specific thread, so wake up all of them
+                self._cond.notify_all()
+                return
+            key = getattr(task, 'case_key', None)
+            lane = self._shared.setdefault((getattr(task, 'priority', 0), key), deque())
+            if front:
+                lane.appendleft((-next(self._sequence), task))
+            else:
+                lane.append((next(self._sequence), task))
+            if key is None:
+                # Any single waiting thread can take it
+                self._cond.notify()
+            else:
+                # Only some threads will take it, let them all decide
+                self._cond.notify_all()
+
+    def get(self, thread_id: int, timeout: float=None, worker=None):
+        """
+        Get the next task for a thread, blocking until one is available
+
+        :param thread_id: ID of the thread asking for work
+        :param timeout: Optional maximum number of seconds to wait
+        :param worker: Optional object identifying the thread, so it can be dismissed. A thread ID can be reused by a
+            new thread after the old one has been dismissed.
+        :return: Next task, pinned tasks first, or None if the thread has been dismissed
+        :raises queue.Empty: If no task became available within the timeout
+        """
+        end_time = time.monotonic() + timeout if timeout is not None else None
+        token = object()
+        with self._cond:
+            self._waiting[thread_id] = token
+            try:
+                while True:
+                    if worker is not None and worker in self._dismissed:
+                        self._dismissed.discard(worker)
+                        return None
+                    task = self._pick(thread_id)
+                    if task is not None:
+                        return task
+                    remaining = end_time - time.monotonic() if end_time is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    self._cond.wait(remaining)
+            finally:
+                # A retired thread's ID may belong to a new thread by now
+                if self._waiting.get(thread_id) is token:
+                    del self._waiting[thread_id]
+
+    def add_thread(self, thread_id: int):
+        """
+        Make room for a new thread, when Power grows
+
+        :param thread_id: ID of the new thread
+        """
+        with self._cond:
+            self._pinned[thread_id] = deque()
+            self._loaded[thread_id] = None
+            self._last_used[thread_id] = 0.0
+
+    def remove_thread(self, thread_id: int) -> list:
+        """
+        Forget a thread that was dismissed, when Power shrinks. It may not have exited yet.
+
+        :param thread_id: ID of the thread
+        :return: List of tasks that were pinned to the thread and won't run
+        """
+        with self._cond:
+            tasks = list(self._pinned.pop(thread_id))
+            del self._loaded[thread_id]
+            del self._last_used[thread_id]
+            self._waiting.pop(thread_id, None)
+            return tasks
+
+    def set_loaded(self, thread_id: int, key):
+        """
+        Tell the queue which case a thread has loaded
+
+        :param thread_id: Thread ID
+        :param key: Case key of the loaded case, None if unknown or nothing is loaded
+        """
+        with self._cond:
+            # Unless the thread was retired in the meantime
+            if thread_id in self._loaded:
+                self._loaded[thread_id] = key
+
+    def dismiss(self, worker):
+        """
+        Wake up a thread waiting in get() and make it return None, so it can exit right away
+
+        :param worker: Object the thread passes to get()
+        """
+        with self._cond:
+            self._dismissed.add(worker)
+            self._cond.notify_all()
+
+    def forget(self, worker):
+        """
+        Drop the dismissal of a thread that has exited, in case it never came back to get()
+
+        :param worker: Object the thread passes to get()
+        """
+        with self._cond:
+            self._dismissed.discard(worker)
+
+    def clear(self, thread_id: int=None) -> list:
+        """
+        Remove tasks that haven't started yet
+
+        :param thread_id: Optional thread ID, only remove the tasks pinned to this thread. Removes all tasks if not
+            provided.
+        :return: List of removed tasks
+        """
+        with self._cond:
+            if thread_id is not None:
+                tasks = list(self._pinned[thread_id])
+                self._pinned[thread_id].clear()
+                return tasks
+            tasks = [task for lane in self._shared.values() for _, task in lane]
+            self._shared.clear()
+            for pinned in self._pinned.values():
+                tasks.extend(pinned)
+                pinned.clear()
+            return tasks
+
+    def remove(self, predicate) -> list:
+        """
+        Remove the tasks that haven't started yet and match a condition
+
+        :param predicate: Method taking a task and returning True if it should be removed
+        :return: List of removed tasks
+        """
+        removed = []
+        with self._cond:
+            for pinned in self._pinned.values():
+                removed.extend(task for task in pinned if predicate(task))
+                kept = [task for task in pinned if not predicate(task)]
+                pinned.clear()
+                pinned.extend(kept)
+            for key, lane in list(self._shared.items()):
+                removed.extend(task for _, task in lane if predicate(task))
+                kept = [(sequence, task) for sequence, task in lane if not predicate(task)]
+                if kept:
+                    self._shared[key] = deque(kept)
+                else:
+                    del self._shared[key]
+        return removed
+
+    def qsize(self, thread_id: int=None) -> int:
+        """
+        Number of tasks waiting to be run
+
+        :param thread_id: Optional thread ID, only count the tasks pinned to this thread
+        :return: Number of tasks
+        """
+        with self._cond:
+            if thread_id is not None:
+                return len(self._pinned[thread_id])
+            return sum(len(lane) for lane in self._shared.values()) + \
+                sum(len(pinned) for pinned in self._pinned.values())
+
+    def oldest_wait(self) -> float:
+        """
+        :return: Seconds the task that has been queued longest has been waiting, 0 if the queue is empty
+        """
+        now = time.monotonic()
+        with self._cond:
+            # Lanes are in queue order, except for retried tasks in front, so the heads are enough
+            heads = [lane[0][1] for lane in self._shared.values() if lane]
+            heads.extend(pinned[0] for pinned in self._pinned.values() if pinned)
+            return max((now - getattr(task, 'queued_at', now) for task in heads), default=0.0)
+
+    def _pick(self, thread_id: int):
+        """
+        Take the next task for a thread, must be called with the condition held
+
+        :param thread_id: ID of the thread asking for work
+        :return: Task, or None if the thread should wait
+        """
+        pinned = self._pinned[thread_id]
+        if pinned:
+            return pinned.popleft()
+        loaded = self._loaded[thread_id]
+        idle_cases = {self._loaded[i] for i in self._waiting if i != thread_id}
+        for priority in sorted({priority for priority, _ in self._shared}, reverse=True):
+            # Tasks for the case we have loaded, then tasks that don't need one
+            for key in ((priority, loaded), (priority, None)):
+                if self._shared.get(key):
+                    return self._take(thread_id, key)
+            # Tasks for another case, as long as no other idle thread has it loaded
+            candidates = [(lane[0][0], key) for key, lane in self._shared.items()
+                          if key[0] == priority and lane and key[1] not in idle_cases]
+            if not candidates:
+                continue
+            # Leave it to the idle thread whose case was used least recently, we may still take less urgent work
+            lru = min(self._waiting, key=lambda i: self._last_used[i])
+            if self._last_used[lru] < self._last_used[thread_id]:
+                self._cond.notify_all()
+                continue
+            _, key = min(candidates, key=lambda candidate: candidate[0])
+            # Assume the thread will load it, so others don't open it at the same time
+            self._loaded[thread_id] = key[1]
+            return self._take(thread_id, key)
+        return None
+
+    def _take(self, thread_id: int, key: tuple):
+        """
+        Remove the oldest task from a lane of shared tasks
+
+        :param thread_id: ID of the thread taking the task
+        :param key: Tuple of priority and case key of the lane
+        :return: Task
+        """
+        lane = self._shared[key]
+        _, task = lane.popleft()
+        if not lane:
+            del self._shared[key]
+        self._last_used[thread_id] = time.monotonic()
+        return task
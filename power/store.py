@@ -0,0 +1,243 @@
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+from threading import Lock
+from typing import Callable
+
+from power.lazy import optional
+
+# Item sizes of the supported struct type codes
+_SIZES = {'b': 1, 'B': 1, 'h': 2, 'H': 2, 'i': 4, 'I': 4, 'q': 8, 'Q': 8, 'f': 4, 'd': 8}
+# Internal columns: hash of the task key, and the commit flag written last
+_KEY = '_key'
+_COMMITTED = '_committed'
+
+
+def qualified_name(f: Callable) -> str:
+    """Module and qualified name of a function, how tasks are told apart in keys, the cache and traces"""
+    return '%s.%s' % (getattr(f, '__module__', None), getattr(f, '__qualname__', repr(f)))
+
+
+def task_key(f: Callable, case_key: tuple, args: tuple, kwargs: dict) -> str:
+    """
+    Key of a task that stays the same between runs: its function name, case and arguments
+
+    :param f: Task function
+    :param case_key: Tuple of case and modifications, or None
+    :param args: Positional arguments, have to be picklable
+    :param kwargs: Named arguments, have to be picklable
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(qualified_name(f).encode())
+    digest.update(repr(case_key).encode())
+    digest.update(pickle.dumps((args, sorted(kwargs.items())), protocol=4))
+    return digest.hexdigest()
+
+
+class ColumnStore:
+    """
+    Append-only store of numeric task results, one memory-mapped file per column, so results of big sweeps don't
+    have to fit in memory. Every row has the key of the task that produced it.
+
+    Rows are written column by column and committed by a flag written last, so a process that dies while appending
+    leaves at most one uncommitted row, which is ignored when the store is opened again. Appends from several threads
+    are serialized.
+
+    Usage:
+
+    Task results are dictionaries (or sequences in schema order) of numbers. Power writes them to the store from the
+    worker threads, their futures only get the row number.
+    >>> store = ColumnStore('sweep', {'bus': 'q', 'voltage': 'd', 'angle': 'd'})
+    >>> pw = Power(4, store=store)
+    >>> rows = list(pw.batch(Task(read_bus, store=True), range(1000000)))
+
+    Read it back later without copying
+    >>> store = ColumnStore('sweep', readonly=True)
+    >>> voltages = store.column('voltage')[store.committed()]
+    >>> store.get(task_key(read_bus, None, (42,), {}))
+
+    :param path: Directory of the store, created if it doesn't exist
+    :param schema: Dictionary of column name to struct type code ('d' for float, 'q' for int, etc.). Required for a
+        new store, must match for an existing one.
+    :param chunk_rows: Number of rows the files grow by at a time
+    :param readonly: Open an existing store for analysis only
+    """
+    def __init__(self, path: str, schema: dict=None, chunk_rows: int=65536, readonly: bool=False):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.readonly = readonly
+        self._lock = Lock()
+        meta = os.path.join(path, 'schema.json')
+        if os.path.exists(meta):
+            with open(meta) as file:
+                stored = dict(json.load(file)['columns'])
+            if schema is not None and dict(schema) != stored:
+                raise ValueError('Schema %s does not match the stored schema %s' % (schema, stored))
+            schema = stored
+        elif schema is None or readonly:
+            raise ValueError('%s is not a column store, a schema is needed to create one' % path)
+        else:
+            os.makedirs(path, exist_ok=True)
+            with open(meta, 'w') as file:
+                json.dump({'columns': list(schema.items())}, file)
+        for name, code in schema.items():
+            if code not in _SIZES or name.startswith('_'):
+                raise ValueError('Invalid column %s of type %s' % (name, code))
+        self.schema = dict(schema)
+        self._codes = dict(self.schema, **{_KEY: 'q', _COMMITTED: 'B'})
+        self._files = {}
+        self._maps = {}
+        # Maps replaced after growing, views of them may still be in use
+        self._retired = []
+        self._capacity = 0
+        for name in self._codes:
+            self._files[name] = open(os.path.join(path, name + '.col'), 'rb' if readonly else 'a+b')
+        # Files may differ in length after a crash while growing them
+        self._remap(min(os.fstat(file.fileno()).st_size // _SIZES[self._codes[name]]
+                        for name, file in self._files.items()))
+        # The first row after the last committed one is where appending continues
+        self.rows = 0
+        self.index = {}
+        # Without NumPy, columns are memoryviews instead
+        np = optional('numpy')
+        if np is not None:
+            committed = np.flatnonzero(np.frombuffer(self._maps[_COMMITTED], dtype=np.uint8, count=self._capacity))
+            keys = np.frombuffer(self._maps[_KEY], dtype=np.int64, count=self._capacity)[committed]
+            self.index = dict(zip(keys.tolist(), committed.tolist()))
+            self.rows = int(committed[-1]) + 1 if len(committed) else 0
+        else:
+            for row in range(self._capacity):
+                if self._read(_COMMITTED, row):
+                    self.index[self._read(_KEY, row)] = row
+                    self.rows = row + 1
+
+    def append(self, key: str, values) -> int:
+        """
+        Append a row
+
+        :param key: Task key, see task_key()
+        :param values: Dictionary of column name to value, or a sequence in schema order. Missing values are 0.
+        :return: Row number
+        """
+        if self.readonly:
+            raise IOError('Store is read-only')
+        if not isinstance(values, dict):
+            values = dict(zip(self.schema, values))
+        with self._lock:
+            row = self.rows
+            if row >= self._capacity:
+                self._remap(self._capacity + self.chunk_rows)
+            for name, code in self.schema.items():
+                self._write(name, row, values.get(name, 0))
+            self._write(_KEY, row, _hash(key))
+            self._write(_COMMITTED, row, 1)
+            self.rows = row + 1
+            self.index[_hash(key)] = row
+        return row
+
+    def row(self, key: str) -> int:
+        """
+        :param key: Task key
+        :return: Row number of the last result of the task, or None
+        """
+        return self.index.get(_hash(key))
+
+    def __contains__(self, key: str):
+        return self.row(key) is not None
+
+    def __len__(self):
+        return self.rows
+
+    def get(self, key: str) -> dict:
+        """
+        :param key: Task key
+        :return: Dictionary of column name to value, or None if the task has no result
+        """
+        row = self.row(key)
+        if row is None:
+            return None
+        return {name: self._read(name, row) for name in self.schema}
+
+    def column(self, name: str):
+        """
+        All values of a column, without copying. Includes the uncommitted row a crash may have left, see committed().
+        Views stay valid until the store is closed.
+
+        :param name: Column name
+        :return: NumPy array, or a memoryview without NumPy
+        """
+        code = self._codes[name]
+        np = optional('numpy')
+        if np is not None:
+            return np.frombuffer(self._maps[name], dtype=np.dtype(code), count=self.rows)
+        return memoryview(self._maps[name]).cast(code)[:self.rows]
+
+    def committed(self):
+        """
+        :return: Boolean NumPy array, or a list without NumPy, of the rows that were completely written
+        """
+        if optional('numpy') is not None:
+            return self.column(_COMMITTED).astype(bool)
+        return [bool(flag) for flag in self.column(_COMMITTED)]
+
+    def flush(self):
+        """Write changes to disk, they survive a crash of this process already but not of the machine"""
+        with self._lock:
+            for mapped in self._maps.values():
+                if isinstance(mapped, mmap.mmap):
+                    mapped.flush()
+
+    def close(self):
+        with self._lock:
+            if not self.readonly:
+                for mapped in self._maps.values():
+                    if isinstance(mapped, mmap.mmap):
+                        mapped.flush()
+            for mapped in list(self._maps.values()) + self._retired:
+                if not isinstance(mapped, mmap.mmap):
+                    continue
+                try:
+                    mapped.close()
+                except BufferError:
+                    # Someone still has a view of it, it's closed when that's gone
+                    pass
+            for file in self._files.values():
+                file.close()
+            self._maps, self._retired = {}, []
+
+    def _remap(self, capacity: int):
+        """
+        Grow the files to a number of rows and map them again, must be called with the lock held
+
+        :param capacity: Number of rows
+        """
+        self._retired.extend(mapped for mapped in self._maps.values() if isinstance(mapped, mmap.mmap))
+        for name, file in self._files.items():
+            size = capacity * _SIZES[self._codes[name]]
+            if not self.readonly and os.fstat(file.fileno()).st_size < size:
+                file.truncate(size)
+            if size == 0:
+                # Can't map an empty file
+                self._maps[name] = bytearray()
+                continue
+            access = mmap.ACCESS_READ if self.readonly else mmap.ACCESS_WRITE
+            self._maps[name] = mmap.mmap(file.fileno(), size, access=access)
+        self._capacity = capacity
+
+    def _write(self, name: str, row: int, value):
+        code = self._codes[name]
+        value = float(value) if code in 'fd' else int(value)
+        struct.pack_into(code, self._maps[name], row * _SIZES[code], value)
+
+    def _read(self, name: str, row: int):
+        code = self._codes[name]
+        return struct.unpack_from(code, self._maps[name], row * _SIZES[code])[0]
+
+
+def _hash(key: str) -> int:
+    """Signed 64 bit integer of a hex task key"""
+    return int.from_bytes(bytes.fromhex(key[:16]), 'little', signed=True)
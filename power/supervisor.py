@@ -0,0 +1,196 @@
+import logging as log
+import time
+from threading import Event, Thread
+
+
+class WorkerError(Exception):
+    """Base class for failures of a worker rather than of the task it was running."""
+    pass
+
+
+class WorkerTimeout(WorkerError):
+    """The task took longer than the task timeout of the supervisor."""
+    pass
+
+
+class WorkerCrashed(WorkerError):
+    """The simulator of the worker died while running the task."""
+    pass
+
+
+class RetryPolicy:
+    """
+    Decides whether a task is run again after its worker hung or crashed.
+    Exceptions raised by the task function itself are never retried, only worker failures.
+
+    :param retries: Maximum number of times a task is run again
+    :param on_timeout: Retry tasks that timed out. Set this to False if a slow task is likely to be slow again.
+    :param on_crash: Retry tasks whose simulator crashed
+    """
+    def __init__(self, retries: int=1, on_timeout: bool=True, on_crash: bool=True):
+        self.retries = retries
+        self.on_timeout = on_timeout
+        self.on_crash = on_crash
+
+    def should_retry(self, task, error: WorkerError) -> bool:
+        """
+        :param task: _PowerTask that failed, its attempts property holds the number of runs so far
+        :param error: WorkerTimeout or WorkerCrashed
+        :return: True if the task should be queued again
+        """
+        if task.attempts > self.retries:
+            return False
+        if isinstance(error, WorkerTimeout):
+            return self.on_timeout
+        return self.on_crash
+
+
+class Supervisor:
+    """
+    Watches the threads of Power and replaces the ones whose simulator hung or crashed.
+
+    A thread is considered hung when its current task runs longer than task_timeout, and crashed when the thread has
+    stopped, or when its backend reports the simulator as dead. Such a thread is abandoned and its simulator terminated
+    where the backend is able to (COM objects can't be, a hung COM thread is simply left behind). A new thread with a
+    fresh simulator takes its place, and the task it was running is retried or failed according to the retry policy.
+
+    Usage:
+
+    >>> pw = Power(4, supervisor=Supervisor(task_timeout=60, policy=RetryPolicy(retries=2), spares=1))
+
+    :param task_timeout: Optional number of seconds after which a running task is considered hung
+    :param policy: Optional RetryPolicy, defaults to retrying once
+    :param spares: Number of simulators to keep created and ready to replace a failed one
+    :param interval: Seconds between checks of all threads
+    :type restarts: int
+    """
+    def __init__(self, task_timeout: float=None, policy: RetryPolicy=None, spares: int=0, interval: float=1.0):
+        self.task_timeout = task_timeout
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.spares = spares
+        self.interval = interval
+        self.restarts = 0
+        self._power = None
+        self._spares = []
+        self._thread = None
+        self._wake = Event()
+        self._stopping = False
+
+    def start(self, power):
+        """
+        Start watching the threads of a Power object, called by Power once its collection has been created
+
+        :param power: Power object
+        """
+        self._power = power
+        self._stopping = False
+        self._thread = Thread(target=self._run, name='PowerSupervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and release the spare simulators, called by Power when it's reset"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        for handle in self._spares:
+            self._power._backend.release(handle)
+        self._spares = []
+
+    def wake(self):
+        """Check the threads right away instead of waiting for the interval, e.g. when a thread noticed a crash"""
+        self._wake.set()
+
+    def check(self):
+        """Check all threads once and replace the ones that hung or crashed"""
+        now = time.monotonic()
+        backend = self._power._backend
+        # The pool can't grow or shrink while threads are replaced
+        with self._power._resize_lock:
+            for thread in list(self._power._threads):
+                if thread.dismissed:
+                    continue
+                task = thread.current_task
+                handle = self._power._pw_objects[thread.thread_id]
+                if thread.crashed or not thread.is_alive():
+                    error = WorkerCrashed('Simulator %s crashed' % thread.thread_id)
+                elif task is not None and self.task_timeout is not None and \
+                        now - thread.task_started > self.task_timeout:
+                    error = WorkerTimeout('Task timed out after %ss in thread %s' % (self.task_timeout,
+                                                                                     thread.thread_id))
+                elif handle is not None and not backend.alive(handle):
+                    error = WorkerCrashed('Simulator %s died' % thread.thread_id)
+                else:
+                    continue
+                self._recover(thread, task, error)
+        self._fill_spares()
+
+    def _run(self):
+        """Main loop of the supervisor thread"""
+        self._power._backend.enter_thread()
+        try:
+            while True:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                if self._stopping:
+                    break
+                try:
+                    self.check()
+                except Exception:
+                    log.exception('Supervisor check failed')
+        finally:
+            self._power._backend.exit_thread()
+
+    def _recover(self, thread, task, error: WorkerError):
+        """
+        Replace a thread with a new one and retry or fail its task
+
+        :param thread: _PowerThread that hung or crashed
+        :param task: _PowerTask it was running, if any
+        :param error: Reason for the replacement
+        """
+        power = self._power
+        i = thread.thread_id
+        log.warning('Replacing thread %s: %s', i, error)
+        # Take the task away, so the thread won't report on it if it ever returns
+        with power._lock:
+            if task is not None and task.worker is thread:
+                task.worker = None
+            else:
+                task = None
+        thread.dismiss()
+        # A thread that crashed recorded the failed attempt itself, one that hung or died never will
+        if task is not None and not thread.crashed:
+            power.metrics.task_finished(i, time.monotonic() - thread.task_started, True)
+        handle = power._pw_objects[i]
+        if handle is not None:
+            power._backend.terminate(handle)
+            power._pw_objects[i] = None
+            # A hung thread may still be in a call on it, it releases the handle if it ever returns
+            if not thread.release_on_exit(handle):
+                power._backend.release(handle)
+        # Without a spare, threads create their own simulator if the backend allows, otherwise we do it here
+        handle = self._spares.pop() if self._spares else None
+        if handle is None and not power._backend.parallel_create:
+            handle = power._backend.create(i)
+        power._respawn(i, handle)
+        self.restarts += 1
+        power.metrics.count('restarts')
+
+        if task is None:
+            return
+        if self.policy.should_retry(task, error):
+            log.info('Retrying task in thread %s, attempt %s', i, task.attempts + 1)
+            power.metrics.count('retried')
+            task.queued_at = time.monotonic()
+            power._tasks.put(task, i if task.pinned else None, front=True)
+        else:
+            task.fail((type(error), error, None))
+
+    def _fill_spares(self):
+        """Create simulators until there are enough spares"""
+        while len(self._spares) < self.spares and not self._stopping:
+            # Spares are never used by a thread with this ID, but the backend needs one
+            self._spares.append(self._power._backend.create(-1 - len(self._spares)))
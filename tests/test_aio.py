@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_aio
+----------------------------------
+
+Tests for `power.aio`.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from threading import Event, current_thread
+
+from power.aio import AsyncPower
+from power.backends import FakeBackend
+from power.cache import ResultCache
+from power.power import Power
+
+
+def add(a, b, thread_id, auto_sim):
+    return a + b
+
+
+def sleep(seconds, thread_id, auto_sim):
+    time.sleep(seconds)
+    return thread_id
+
+
+def wait_for(event, thread_id, auto_sim):
+    event.wait(5)
+    return thread_id
+
+
+def fail(thread_id, auto_sim):
+    raise ValueError('failure')
+
+
+class ThreadRecordingCache(ResultCache):
+    """Remembers the threads it was looked up in"""
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(current_thread())
+        return super().get(key)
+
+
+class FakeServer:
+
+    def __init__(self):
+        self.resumed = asyncio.Event()
+
+
+class TestAsyncPower(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.pw = AsyncPower(Power(2, backend=FakeBackend()))
+        await self.pw.__aenter__()
+
+    async def asyncTearDown(self):
+        await self.pw.__aexit__(None, None, None)
+
+    async def test_submit_and_map(self):
+        self.assertEqual(await self.pw.submit(add, 1, 2), 3)
+        self.assertEqual(await self.pw.map(add, range(10), range(10)), [2 * i for i in range(10)])
+        with self.assertRaises(ValueError):
+            await self.pw.submit(fail)
+
+    async def test_loop_stays_free(self):
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        # Both threads are busy, yet the loop goes on
+        self.assertEqual(sorted(await asyncio.gather(self.pw.submit(sleep, 0.2), self.pw.submit(sleep, 0.2))), [0, 1])
+        ticker.cancel()
+        self.assertGreater(ticks, 5)
+
+    async def test_add_task(self):
+        results = await self.pw.add_task(sleep, None, 0)
+        self.assertEqual(sorted(result for task, result in results), [0, 1])
+        task, exc_info = (await self.pw.add_task(fail, '1'))[0]
+        self.assertTrue(task.exception)
+        self.assertIsInstance(exc_info[1], ValueError)
+
+    async def test_batch(self):
+        results = [result async for task, result in self.pw.batch(add, ((i, i) for i in range(20)), max_in_flight=3)]
+        self.assertEqual(sorted(results), [2 * i for i in range(20)])
+
+    async def test_cancel(self):
+        event = Event()
+        running = [self.pw.submit(wait_for, event) for _ in range(2)]
+        queued = self.pw.submit(wait_for, event)
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        event.set()
+        self.assertEqual(sorted(await asyncio.gather(*running)), [0, 1])
+        self.assertTrue(queued.cancelled())
+        self.assertEqual(await self.pw.submit(add, 1, 1), 2)
+
+    async def test_pause(self):
+        self.pw.server = FakeServer()
+        future = self.pw.submit(add, 1, 2)
+        await asyncio.sleep(0.05)
+        self.assertFalse(future.done())
+        self.pw.server.resumed.set()
+        self.assertEqual(await future, 3)
+
+
+class TestAsyncPowerLifecycle(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reset_power(self):
+        pw = AsyncPower(Power(1, backend=FakeBackend()))
+        async with pw:
+            self.assertEqual(await pw.submit(add, 1, 2), 3)
+        with self.assertRaises(RuntimeError):
+            async with pw:
+                pass
+
+    async def test_cache_off_the_loop(self):
+        cache = ThreadRecordingCache(os.path.join(tempfile.mkdtemp(), 'results.db'))
+        async with AsyncPower(Power(2, backend=FakeBackend(), cache=cache)) as pw:
+            self.assertEqual(await pw.submit(add, 1, 2), 3)
+            self.assertEqual(await pw.map(add, [1, 2], [2, 3]), [3, 5])
+            self.assertEqual(pw.power.metrics.counters['cached'], 1)
+        self.assertTrue(cache.threads)
+        self.assertNotIn(current_thread(), cache.threads)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_aioserver
+----------------------------------
+
+Tests for `power.com.aioserver`.
+"""
+
+import asyncio
+import json
+import unittest
+
+from pydispatch import dispatcher
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+from power.aio import AsyncPower
+from power.backends import FakeBackend
+from power.com import Signal, Topic
+from power.com.aioserver import AsyncSocketServer
+from power.com.messages import build_message
+from power.metrics import Metrics
+from power.power import Power
+
+
+def add(a, b, thread_id, auto_sim):
+    return a + b
+
+
+class Client:
+    """A WebSocket client that sends and receives JSON"""
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    @classmethod
+    async def connect(cls, port: int, query: str=''):
+        return cls(await connect('ws://127.0.0.1:%s/socket%s' % (port, query)))
+
+    async def send(self, message: dict):
+        await self.ws.send(json.dumps(message))
+
+    async def receive(self, timeout: float=2.0):
+        return await asyncio.wait_for(self.ws.recv(), timeout)
+
+    async def receive_json(self):
+        return json.loads(await self.receive())
+
+    async def close(self):
+        await self.ws.close()
+
+
+class TestAsyncSocketServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.metrics = Metrics()
+        self.server = AsyncSocketServer(port=0, metrics=self.metrics)
+        await self.server.start()
+        self.clients = []
+        self.received = []
+
+    async def connect(self, query: str='') -> Client:
+        client = await Client.connect(self.server.port, query)
+        self.clients.append(client)
+        return client
+
+    async def test_state(self):
+        client = await self.connect()
+        first = await client.receive_json()
+        self.assertIn('revision', first)
+        self.server.state.update({'aio_test': 1})
+        delta = (await client.receive_json())['delta']
+        self.assertEqual(delta['patch'], [{'op': 'add', 'path': '/aio_test', 'value': 1}])
+        await client.send({'command': 'resync', 'revision': first['revision']})
+        self.assertEqual((await client.receive_json())['delta'], delta)
+
+    async def test_commands(self):
+        async def handle(message):
+            await asyncio.sleep(0.01)
+            self.received.append(message)
+
+        dispatcher.connect(handle, signal=Signal.PW_COMMAND_SIGNAL, sender=dispatcher.Any)
+        try:
+            client = await self.connect()
+            await client.receive_json()
+            for i in range(5):
+                await client.send({'command': 'set', 'key': 'load', 'value': i, 'id': i})
+            statuses = [(await client.receive_json())['message'] for _ in range(9)]
+            self.assertEqual(len([status for status in statuses if status['status'] == 'superseded']), 4)
+            await asyncio.sleep(self.server.commands.rules['set'].debounce + 0.1)
+            self.assertEqual(self.received, [{'command': 'set', 'key': 'load', 'value': 4, 'id': 4}])
+        finally:
+            dispatcher.disconnect(handle, signal=Signal.PW_COMMAND_SIGNAL, sender=dispatcher.Any)
+
+    async def test_topics_and_signal(self):
+        subscribed, other = await self.connect(), await self.connect()
+        await subscribed.receive_json()
+        await other.receive_json()
+        await subscribed.send({'command': 'subscribe', 'topics': [Topic.BUS_VOLTAGES]})
+        self.assertEqual((await subscribed.receive_json())['message'], {'topics': [Topic.BUS_VOLTAGES]})
+        self.assertEqual(self.server.publish(Topic.BUS_VOLTAGES, state={'1': 1.01}), 1)
+        self.assertEqual((await subscribed.receive_json())['topic'], Topic.BUS_VOLTAGES)
+        # From another thread, like a task would
+        await asyncio.get_running_loop().run_in_executor(None, lambda: dispatcher.send(
+            signal=Signal.UPDATE_UI_SIGNAL, message=build_message(200, 'Solved')))
+        self.assertEqual((await other.receive_json())['message'], 'Solved')
+
+    async def test_pause(self):
+        pw = AsyncPower(Power(1, backend=FakeBackend()), self.server)
+        async with pw:
+            client = await self.connect()
+            await client.receive_json()
+            await client.send({'command': 'pause'})
+            await asyncio.sleep(0.05)
+            self.assertTrue(self.server.paused)
+            future = pw.submit(add, 1, 2)
+            await asyncio.sleep(0.05)
+            self.assertFalse(future.done())
+            await client.send({'command': 'resume'})
+            self.assertEqual(await asyncio.wait_for(future, 2), 3)
+
+    async def test_encoding_and_fragments(self):
+        client = await self.connect('?compress=10')
+        self.assertIsInstance(await client.receive(), bytes)
+        # A text message in two fragments
+        payload = json.dumps({'command': 'encoding', 'encoding': 'json', 'compress': 0})
+        await client.ws.send([payload[:5], payload[5:]])
+        self.assertEqual((await client.receive_json())['message'], {'encoding': 'json', 'compress': 0})
+
+    async def test_message_too_big_closes(self):
+        client = await self.connect()
+        await client.receive_json()
+        await client.ws.send('x' * (self.server.max_size + 1))
+        with self.assertRaises(ConnectionClosed) as closed:
+            await client.receive()
+        self.assertEqual(closed.exception.rcvd.code, 1009)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.server.connections, set())
+
+    async def test_metrics(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'text/plain; version=0.0.4', response)
+        self.assertIn(b'socket_clients', response)
+
+    async def test_not_found(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+        writer.write(b'GET /other HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        self.assertTrue(response.startswith(b'HTTP/1.1 404'))
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.close()
+        await self.server.close()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_autoscaler
+----------------------------------
+
+Tests for `power.autoscaler`.
+"""
+
+import time
+import unittest
+from threading import Event, Thread
+
+from power.autoscaler import Autoscaler, available_memory
+from power.backends import FakeBackend
+from power.power import Power, ThreadRetired
+
+
+def wait_for(event, thread_id, auto_sim):
+    event.wait(5)
+    return thread_id
+
+
+def sleep(seconds, thread_id, auto_sim):
+    time.sleep(seconds)
+    return thread_id
+
+
+def poll(condition, timeout: float=5.0) -> bool:
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestResize(unittest.TestCase):
+
+    def setUp(self):
+        self.pw = Power(1, backend=FakeBackend())
+        self.pw.create_pw_collection()
+
+    def test_grow_and_shrink(self):
+        simulator = self.pw._pw_objects[0]
+        self.assertEqual(self.pw.grow(2), [1, 2])
+        self.assertEqual(self.pw.num_threads, 3)
+        self.assertEqual(sorted(result for task, result in self.pw.add_task(sleep, None, 0)), [0, 1, 2])
+        self.assertEqual(self.pw.shrink(2), [1, 2])
+        self.assertEqual(self.pw.num_threads, 1)
+        # The first simulator was left alone
+        self.assertIs(self.pw._pw_objects[0], simulator)
+        self.assertEqual(self.pw.add_task(sleep, None, 0)[0][1], 0)
+        # Always one thread left
+        self.assertEqual(self.pw.shrink(), [])
+
+    def test_shrink_fails_pinned_tasks(self):
+        self.pw.grow()
+        event = Event()
+        running = self.pw._put_task(wait_for, 1, (event,), {})
+        queued = self.pw._put_task(wait_for, 1, (event,), {})
+        self.assertTrue(poll(running.future.running))
+        shrink = Thread(target=self.pw.shrink)
+        shrink.start()
+        event.set()
+        shrink.join()
+        # The running task finished, the one waiting for the retired thread won't run
+        self.assertEqual(running.future.result(), 1)
+        self.assertIsInstance(queued.future.exception(), ThreadRetired)
+        self.assertTrue(queued.exception)
+
+    def test_shrink_does_not_block_while_joining(self):
+        self.pw.grow()
+        event = Event()
+        running = self.pw._put_task(wait_for, 1, (event,), {})
+        self.assertTrue(poll(running.future.running))
+        shrink = Thread(target=self.pw.shrink)
+        shrink.start()
+        try:
+            self.assertTrue(poll(lambda: self.pw.num_threads == 1))
+            # The retired thread is still busy, the pool can be used and grown meanwhile
+            self.assertEqual(self.pw.add_task(sleep, None, 0)[0][1], 0)
+            self.assertEqual(self.pw.grow(), [1])
+        finally:
+            event.set()
+            shrink.join()
+        self.assertEqual(running.future.result(), 1)
+
+    def test_shrink_idle_only(self):
+        self.pw.grow(2)
+        event = Event()
+        running = self.pw._put_task(wait_for, 1, (event,), {})
+        self.assertTrue(poll(running.future.running))
+        # Thread 2 is idle, thread 1 is busy so it stays
+        self.assertEqual(self.pw.shrink(2, idle_only=True), [2])
+        self.assertEqual(self.pw.num_threads, 2)
+        self.assertFalse(running.future.done())
+        event.set()
+        self.assertEqual(running.future.result(5), 1)
+
+    def test_add_task_while_resizing(self):
+        resizing = Event()
+
+        def resize():
+            while not resizing.is_set():
+                self.pw.grow()
+                self.pw.shrink()
+
+        thread = Thread(target=resize)
+        thread.start()
+        try:
+            # Every thread that existed when the tasks were queued runs one, unless it was retired first
+            for _ in range(50):
+                for task, result in self.pw.add_task(sleep, None, 0):
+                    if task.exception:
+                        self.assertIsInstance(result[1], ThreadRetired)
+                    else:
+                        self.assertEqual(result, task.thread_id)
+        finally:
+            resizing.set()
+            thread.join()
+
+    def tearDown(self):
+        self.pw.reset()
+
+
+class TestAutoscaler(unittest.TestCase):
+
+    def test_grow_with_queue_and_shrink_when_idle(self):
+        autoscaler = Autoscaler(min_threads=1, max_threads=3, target_wait=0.05, cooldown=0.3, interval=0.02)
+        pw = Power(1, backend=FakeBackend(), autoscaler=autoscaler)
+        pw.create_pw_collection()
+        try:
+            futures = [pw.submit(sleep, 0.05) for _ in range(40)]
+            self.assertTrue(poll(lambda: pw.num_threads == 3))
+            self.assertEqual(len({future.result(5) for future in futures}), 3)
+            self.assertTrue(poll(lambda: pw.metrics.snapshot()['tasks'].get('shrunk') == 2))
+            self.assertEqual(pw.num_threads, 1)
+        finally:
+            pw.reset()
+
+    @unittest.skipIf(available_memory() is None, 'Available memory is unknown')
+    def test_memory_ceiling(self):
+        autoscaler = Autoscaler(min_threads=1, max_threads=4, target_wait=0, min_available=2 ** 62)
+        pw = Power(2, backend=FakeBackend())
+        pw.create_pw_collection()
+        autoscaler._power = pw
+        try:
+            event = Event()
+            pw.submit(wait_for, event)
+            pw.submit(wait_for, event)
+            future = pw.submit(wait_for, event)
+            self.assertTrue(poll(lambda: pw._tasks.qsize() == 1))
+            # Shrinks instead of growing while memory is short
+            shrink = Thread(target=autoscaler.check)
+            shrink.start()
+            event.set()
+            shrink.join()
+            self.assertEqual(pw.num_threads, 1)
+            self.assertIn(future.result(5), [0, 1])
+            autoscaler.check()
+            self.assertEqual(pw.num_threads, 1)
+        finally:
+            pw.reset()
+
+    def test_limits(self):
+        with self.assertRaises(ValueError):
+            Autoscaler(min_threads=4, max_threads=2)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_backends
+----------------------------------
+
+Tests for `power.backends` and `power.fakesimauto`.
+"""
+
+import os
+import threading
+import unittest
+from collections import Counter
+
+from power.backends import FakeBackend, ProcessBackend
+from power.fakesimauto import FakeSimAuto
+from power.power import Power
+from power.supervisor import Supervisor
+
+
+def read_voltages(case, thread_id, auto_sim):
+    auto_sim.OpenCase(case)
+    error, (numbers, voltages) = auto_sim.GetParametersMultipleElement('Bus', ['BusNum', 'BusPUVolt'], '')
+    return thread_id, os.getpid(), numbers, voltages
+
+
+def fail(thread_id, auto_sim):
+    raise KeyError('failed in %s' % thread_id)
+
+
+class ThreadBackend(FakeBackend):
+    """Counts the threads that entered and exited, like COM initialization"""
+    def __init__(self):
+        super().__init__()
+        self.entered = Counter()
+        self.exited = Counter()
+
+    def enter_thread(self):
+        self.entered[threading.current_thread().name] += 1
+
+    def exit_thread(self):
+        self.exited[threading.current_thread().name] += 1
+
+
+class TestFakeSimAuto(unittest.TestCase):
+
+    def test_deterministic_values(self):
+        a, b = FakeSimAuto(), FakeSimAuto(elements={'Bus': 3})
+        a.OpenCase('case.pwb')
+        b.OpenCase('case.pwb')
+        self.assertEqual(a.GetParametersMultipleElement('Bus', ['BusPUVolt'])[1][0][:3],
+                         b.GetParametersMultipleElement('Bus', ['BusPUVolt'])[1][0])
+        self.assertEqual(b.GetParametersMultipleElement('Bus', ['BusNum'])[1][0], (1, 2, 3))
+        self.assertEqual(b.calls['GetParametersMultipleElement'], 2)
+
+    def test_error_without_case(self):
+        self.assertNotEqual(FakeSimAuto().RunScriptCommand('SolvePowerFlow;')[0], '')
+
+    def test_changes(self):
+        sim = FakeSimAuto()
+        sim.OpenCase('case.pwb')
+        sim.ChangeParametersSingleElement('Bus', ['BusNum', 'BusPUVolt'], [2, 0.5])
+        self.assertEqual(sim.GetParametersSingleElement('Bus', ['BusNum', 'BusPUVolt'], [2, '']), ('', (2, 0.5)))
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_fake_backend(self):
+        pw = Power(2, backend=FakeBackend())
+        pw.create_pw_collection()
+        try:
+            results = pw.add_task(read_voltages, None, 'case.pwb')
+            self.assertEqual(sorted(result[0] for task, result in results), [0, 1])
+            self.assertEqual(results[0][1][3], results[1][1][3])
+        finally:
+            pw.reset()
+
+    def test_process_backend(self):
+        pw = Power(2, backend=ProcessBackend(FakeBackend()))
+        pw.create_pw_collection()
+        try:
+            results = pw.add_task(read_voltages, None, 'case.pwb')
+            self.assertFalse(any(task.exception for task, result in results))
+            pids = {result[1] for task, result in results}
+            self.assertEqual(len(pids), 2)
+            self.assertNotIn(os.getpid(), pids)
+
+            results = pw.add_task(fail, '0')
+            task, result = results[0]
+            self.assertTrue(task.exception)
+            self.assertIs(result[0], KeyError)
+        finally:
+            pw.reset()
+
+    def test_enter_and_exit_threads(self):
+        backend = ThreadBackend()
+        pw = Power(2, backend=backend, supervisor=Supervisor(interval=0.01, spares=1))
+        pw.create_pw_collection()
+        try:
+            pw.grow()
+            pw.shrink()
+        finally:
+            pw.reset()
+        # Once in each worker, the supervisor and the thread calling grow(), however many simulators they created
+        self.assertEqual(backend.entered, backend.exited)
+        self.assertEqual(set(backend.entered.values()), {1})
+        self.assertEqual(len(backend.entered), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_benchmark
+----------------------------------
+
+Tests for `power.benchmark`.
+"""
+
+import unittest
+
+from power import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_task_sizes(self):
+        for distribution in benchmark.DISTRIBUTIONS:
+            sizes = benchmark.task_sizes(distribution, 4, 100, seed=1)
+            self.assertEqual(sizes, benchmark.task_sizes(distribution, 4, 100, seed=1))
+            self.assertTrue(all(size >= 1 for size in sizes))
+
+    def test_run_and_compare(self):
+        results = benchmark.run(threads=(2,), distributions=('uniform',), tasks=10, latency=0.0005, clients=(3,),
+                                messages=5, imports=('power.config',))
+        dispatch = [result for result in results['results'] if result['benchmark'] == 'dispatch']
+        self.assertEqual([result['mode'] for result in dispatch], ['submit', 'add_task'])
+        self.assertTrue(all(result['tasks_per_second'] > 0 for result in dispatch))
+        broadcast, = [result for result in results['results'] if result['benchmark'] == 'broadcast']
+        self.assertEqual(broadcast['clients'], 3)
+        imported, = [result for result in results['results'] if result['benchmark'] == 'import']
+        self.assertGreater(imported['import_time'], 0)
+        changes = benchmark.compare(results, results)
+        self.assertTrue(changes)
+        self.assertTrue(all(change == 0 for *_, change in changes))
+
+    def test_imports_stay_light(self):
+        # Slow dependencies are only loaded when they're used
+        for module in benchmark.IMPORTS:
+            self.assertEqual(benchmark.bench_import(module, repeat=1)['heavy'], [], module)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
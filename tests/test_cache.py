@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `power.cache`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from threading import current_thread, main_thread
+
+import gevent  # noqa: F401, submitting from the main thread is submitting from the hub once gevent is imported
+
+from power.backends import FakeBackend
+from power.cache import ResultCache
+from power.power import Power, Task
+
+
+def voltages(bus, thread_id, auto_sim):
+    return auto_sim.GetParametersSingleElement('Bus', ['BusNum', 'BusPUVolt'], [bus, ''])[1]
+
+
+def count(thread_id, auto_sim):
+    return sum(auto_sim.calls.values())
+
+
+class ThreadRecordingCache(ResultCache):
+    """Remembers the threads it hashed keys and was looked up in"""
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+
+    def key(self, f, case_key, args, kwargs):
+        self.threads.add(current_thread())
+        return super().key(f, case_key, args, kwargs)
+
+    def get(self, key):
+        self.threads.add(current_thread())
+        return super().get(key)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'results.db')
+
+    def run_sweep(self, cache):
+        pw = Power(2, backend=FakeBackend(), cache=cache)
+        pw.create_pw_collection()
+        try:
+            task = Task(voltages, case='case.pwb')
+            results = [(task, result) for task, result in pw.batch(task, range(1, 6))]
+            return results, sum(result for task, result in pw.add_task(count))
+        finally:
+            pw.reset()
+
+    def test_hits_skip_simulator(self):
+        cache = ResultCache(self.path)
+        first, calls = self.run_sweep(cache)
+        self.assertGreater(calls, 0)
+        self.assertEqual(len(cache), 5)
+        cache.close()
+
+        # A new run with the same database doesn't call the simulator at all
+        cache = ResultCache(self.path)
+        second, calls = self.run_sweep(cache)
+        self.assertEqual(calls, 0)
+        self.assertTrue(all(task.cached for task, result in second))
+        self.assertEqual(sorted(result for task, result in first), sorted(result for task, result in second))
+        self.assertEqual(cache.hits, 5)
+        cache.close()
+
+    def test_keys(self):
+        cache = ResultCache(self.path)
+        key = cache.key(voltages, ('case.pwb', ()), (1,), {})
+        self.assertEqual(key, cache.key(voltages, ('case.pwb', ()), (1,), {}))
+        self.assertNotEqual(key, cache.key(voltages, ('case.pwb', ()), (2,), {}))
+        self.assertNotEqual(key, cache.key(voltages, ('other.pwb', ()), (1,), {}))
+        self.assertNotEqual(key, cache.key(count, ('case.pwb', ()), (1,), {}))
+        self.assertIsNone(cache.key(voltages, None, (lambda: None,), {}))
+        cache.close()
+
+    def test_lookup_outside_hub(self):
+        cache = ThreadRecordingCache(self.path)
+        pw = Power(1, backend=FakeBackend(), cache=cache)
+        pw.create_pw_collection()
+        try:
+            results = [pw.submit(Task(voltages, case='case.pwb'), 1).result(5) for _ in range(2)]
+        finally:
+            pw.reset()
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(cache.hits, 1)
+        # The main thread runs the gevent hub, it shouldn't hash cases or query SQLite
+        self.assertTrue(cache.threads)
+        self.assertNotIn(main_thread(), cache.threads)
+        cache.close()
+
+    def test_eviction_and_invalidation(self):
+        cache = ResultCache(self.path, max_bytes=2000)
+        for i in range(10):
+            cache.put(str(i), voltages, None, b'x' * 500)
+        self.assertLessEqual(len(cache), 4)
+        self.assertTrue(cache.get('9')[0])
+        self.assertFalse(cache.get('0')[0])
+        cache.put('case', count, ('case.pwb', ()), 1)
+        self.assertEqual(cache.invalidate(case='case.pwb'), 1)
+        self.assertGreater(cache.invalidate(f=voltages), 0)
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
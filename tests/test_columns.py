@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_columns
+----------------------------------
+
+Tests for `power.columns`.
+"""
+
+import math
+import unittest
+
+from power import columns as cols
+from power.fakesimauto import FakeSimAuto
+from power.lazy import optional
+
+# As SimAuto returns it over COM: strings, padded, with a blank for a missing value
+PAYLOAD = (('    1', '    2', '    3'), ('1.0200', ' 0.9800', ''), ('Bus one', 'Bus two ', 'Bus three'))
+FIELDS = ['BusNum', 'BusPUVolt', 'BusName']
+DTYPES = {'BusName': 'str'}
+
+
+class TestColumns(unittest.TestCase):
+
+    def check(self, result):
+        self.assertEqual(list(result['BusNum']), [1, 2, 3])
+        self.assertEqual(list(result['BusPUVolt'])[:2], [1.02, 0.98])
+        self.assertTrue(math.isnan(result['BusPUVolt'][2]))
+        self.assertEqual(list(result['BusName']), ['Bus one', 'Bus two', 'Bus three'])
+
+    def test_python(self):
+        result = cols.to_columns(PAYLOAD, FIELDS, DTYPES, use_numpy=False)
+        self.assertEqual(result['BusNum'].typecode, 'q')
+        self.check(result)
+
+    @unittest.skipIf(optional('numpy') is None, 'NumPy is not installed')
+    def test_numpy(self):
+        result = cols.to_columns(PAYLOAD, FIELDS, DTYPES)
+        self.assertEqual(result['BusNum'].dtype, optional('numpy').int64)
+        self.assertEqual(result['BusPUVolt'].dtype, optional('numpy').float64)
+        self.check(result)
+
+    def test_blank_int(self):
+        for use_numpy in (False, None) if optional('numpy') is not None else (False,):
+            result = cols.to_columns([(' 1', ''), (' 2', ' 3')], ['BusNum', 'BusNum:1'], use_numpy=use_numpy)
+            self.assertEqual(list(result['BusNum'])[0], 1.0)
+            self.assertTrue(math.isnan(result['BusNum'][1]))
+            # Still an int column with its location suffix
+            self.assertEqual(list(result['BusNum:1']), [2, 3])
+            self.assertNotIsInstance(result['BusNum:1'][0], float)
+
+    def test_simulator(self):
+        sim = FakeSimAuto(elements={'Bus': 5})
+        self.assertRaises(RuntimeError, cols.columns, sim, 'Bus', ['BusNum'])
+        sim.OpenCase('case.pwb')
+        expected = sim.GetParametersMultipleElement('Bus', ['BusNum', 'BusPUVolt'])[1]
+        for use_numpy in (False, None) if optional('numpy') is not None else (False,):
+            result = cols.columns(sim, 'Bus', ['BusNum', 'BusPUVolt'], use_numpy=use_numpy)
+            self.assertEqual((tuple(result['BusNum']), tuple(result['BusPUVolt'])), expected)
+            rows = cols.records(sim, 'Bus', ['BusNum', 'BusPUVolt'], use_numpy=use_numpy)
+            self.assertEqual([tuple(row) for row in rows], list(zip(*expected)))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_commands
+----------------------------------
+
+Tests for `power.com.commands`.
+"""
+
+import json
+import unittest
+
+import gevent
+
+from pydispatch import dispatcher
+
+from power.com import Signal
+from power.com.commands import CommandQueue
+from power.com.powersocketserver import PowerSocketServer
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def close(self):
+        pass
+
+
+class TestCommandQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatched = []
+        self.acks = []
+        self.queue = CommandQueue(self.dispatched.append, ack=lambda sender, message, status: self.acks.append(
+            (sender, message.get('value'), status)))
+        self.queue.rule('set', debounce=0.05, coalesce=True, key=('key',))
+
+    def test_order(self):
+        for i in range(5):
+            self.assertEqual(self.queue.submit({'command': 'run', 'value': i}, 'client'), 'queued')
+        gevent.sleep(0.01)
+        self.assertEqual([message['value'] for message in self.dispatched], list(range(5)))
+        self.assertEqual(self.acks, [('client', i, 'queued') for i in range(5)])
+
+    def test_coalesce(self):
+        for i in range(10):
+            self.queue.submit({'command': 'set', 'key': 'load', 'value': i}, 'client')
+            self.queue.submit({'command': 'set', 'key': 'gen', 'value': -i}, 'client')
+            gevent.sleep(0.005)
+        self.assertEqual(self.dispatched, [])
+        gevent.sleep(0.1)
+        # Only the latest value of every key
+        self.assertEqual(self.dispatched, [{'command': 'set', 'key': 'load', 'value': 9},
+                                           {'command': 'set', 'key': 'gen', 'value': -9}])
+        self.assertEqual(len([ack for ack in self.acks if ack[2] == 'superseded']), 18)
+        self.assertEqual(self.queue.stats()['superseded'], 18)
+
+    def test_unruled_commands_pass_debounced_ones(self):
+        self.queue.submit({'command': 'set', 'key': 'load', 'value': 1})
+        self.queue.submit({'command': 'cancel', 'value': 2})
+        gevent.sleep(0.01)
+        self.assertEqual([message['value'] for message in self.dispatched], [2])
+        self.queue.flush()
+        self.assertEqual([message['value'] for message in self.dispatched], [2, 1])
+        self.assertEqual(self.queue.pending(), 0)
+
+    def test_max_delay(self):
+        self.queue.rule('set', debounce=0.05, coalesce=True, key=('key',), max_delay=0.1)
+        for i in range(30):
+            self.queue.submit({'command': 'set', 'key': 'load', 'value': i})
+            gevent.sleep(0.01)
+        # A steady stream still gets through now and then
+        self.assertGreaterEqual(len(self.dispatched), 2)
+        gevent.sleep(0.1)
+        self.assertEqual(self.dispatched[-1]['value'], 29)
+
+    def test_rate_limit(self):
+        queue = CommandQueue(self.dispatched.append, rate=1, burst=2)
+        client, other = FakeWebSocket(), FakeWebSocket()
+        self.assertEqual([queue.submit({'command': 'run'}, client) for _ in range(3)],
+                         ['queued', 'queued', 'rate_limited'])
+        # Other clients have buckets of their own
+        self.assertEqual(queue.submit({'command': 'run'}, other), 'queued')
+        gevent.sleep(0.01)
+        self.assertEqual(len(self.dispatched), 3)
+        self.assertEqual(queue.stats()['rate_limited'], 1)
+
+
+class TestSocketServer(unittest.TestCase):
+
+    def setUp(self):
+        self.received = []
+        dispatcher.connect(self.handle, signal=Signal.PW_COMMAND_SIGNAL, sender=dispatcher.Any)
+        self.ws = FakeWebSocket()
+        self.connection = PowerSocketServer(self.ws)
+        self.connection.on_open()
+
+    def handle(self, message):
+        self.received.append(message)
+
+    def test_ack_and_dispatch(self):
+        self.connection.on_message(json.dumps({'command': 'run', 'id': 7}))
+        gevent.sleep(0.01)
+        ack = json.loads(self.ws.sent[-1])
+        self.assertEqual(ack['status'], 202)
+        self.assertEqual(ack['message'], {'command': 'run', 'status': 'queued', 'id': 7})
+        self.assertEqual(self.received, [{'command': 'run', 'id': 7}])
+
+    def test_set_is_coalesced(self):
+        for i in range(5):
+            self.connection.on_message(json.dumps({'command': 'set', 'key': 'load', 'value': i}))
+        gevent.sleep(PowerSocketServer.commands.rules['set'].debounce + 0.05)
+        self.assertEqual(self.received, [{'command': 'set', 'key': 'load', 'value': 4}])
+        statuses = [json.loads(message)['message']['status'] for message in self.ws.sent[1:]]
+        self.assertEqual(statuses.count('superseded'), 4)
+
+    def test_pause_when_rate_limited(self):
+        commands = PowerSocketServer.commands
+        rate, burst = commands.rate, commands.burst
+        commands.rate, commands.burst = 0.01, 1
+        try:
+            self.connection.on_message(json.dumps({'command': 'run'}))
+            self.connection.on_message(json.dumps({'command': 'pause'}))
+            gevent.sleep(0.01)
+            self.assertEqual(json.loads(self.ws.sent[-1])['status'], 429)
+            self.assertTrue(self.connection.paused)
+            self.connection.on_message(json.dumps({'command': 'resume'}))
+            self.assertFalse(self.connection.paused)
+        finally:
+            commands.rate, commands.burst = rate, burst
+            self.connection.resume()
+
+    def tearDown(self):
+        self.connection.on_close('Test done')
+        dispatcher.disconnect(self.handle, signal=Signal.PW_COMMAND_SIGNAL, sender=dispatcher.Any)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_config
+----------------------------------
+
+Tests for `power.config`.
+"""
+
+import os
+import tempfile
+import unittest
+
+from power import config
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path, self.interval = config.path, config.check_interval
+        config.path = os.path.join(self.directory.name, 'config.ini')
+        config.check_interval = 0
+        self.write('[Server]\nPort = 7000\nPaused = off\nName = grid\n')
+        config.reload()
+
+    def write(self, text: str):
+        with open(config.path, 'w') as file:
+            file.write(text)
+
+    def test_parse(self):
+        self.assertEqual(config.get('Port'), 7000)
+        self.assertIs(config.get('paused'), False)
+        self.assertEqual(config.get('Name'), 'grid')
+        self.assertEqual(config.get('Missing', 1), 1)
+
+    def test_change_detection(self):
+        data = config.data()
+        self.write('[Server]\nPort = 7001\n')
+        self.assertEqual(config.get('Port'), 7001)
+        self.assertIsNone(config.get('Name'))
+        # Earlier dictionaries see the change too
+        self.assertEqual(data['port'], 7001)
+
+    def test_check_interval(self):
+        config.check_interval = 60
+        config.get('Port')
+        self.write('[Server]\nPort = 7001\n')
+        self.assertEqual(config.get('Port'), 7000)
+        config.reload()
+        self.assertEqual(config.get('Port'), 7001)
+
+    def test_put_survives_reload(self):
+        config.put('Paused', True)
+        self.write('[Server]\nPort = 7001\nPaused = off\n')
+        self.assertIs(config.get('paused'), True)
+        self.assertEqual(config.get('Port'), 7001)
+
+    def tearDown(self):
+        config._overrides.clear()
+        config.path, config.check_interval = self.path, self.interval
+        config.reload()
+        self.directory.cleanup()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_journal
+----------------------------------
+
+Tests for `power.journal`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pydispatch import dispatcher
+
+from power.backends import FakeBackend
+from power.com import Signal
+from power.journal import Journal
+from power.power import Power
+
+
+def fail_odd(x, thread_id, auto_sim):
+    if x % 2:
+        raise ValueError('Odd')
+    return x
+
+
+def identity(x, thread_id, auto_sim):
+    return x
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'sweep.journal')
+
+    def run_batch(self, f, journal):
+        pw = Power(2, backend=FakeBackend(), journal=journal)
+        pw.create_pw_collection()
+        try:
+            return sorted(result for task, result in pw.batch(f, range(10)) if not task.exception)
+        finally:
+            pw.reset()
+
+    def test_resume(self):
+        journal = Journal(self.path, batch_size=1000, interval=60)
+        self.assertEqual(self.run_batch(fail_odd, journal), [0, 2, 4, 6, 8])
+        journal.close()
+        journal = Journal(self.path)
+        self.assertEqual((len(journal.done), len(journal.failed)), (5, 5))
+        # Only the failed ones run again, under the same key
+        self.assertEqual(self.run_batch(fail_odd, journal), [])
+        journal.close()
+
+    def test_partial_line(self):
+        journal = Journal(self.path, batch_size=1)
+        journal.record('a')
+        journal.record('b', ok=False)
+        journal.close()
+        with open(self.path, 'a') as file:
+            file.write('c do')
+        journal = Journal(self.path)
+        self.assertEqual((journal.done, journal.failed), ({'a'}, {'b'}))
+        journal.record('b')
+        journal.close()
+        self.assertEqual(Journal(self.path).done, {'a', 'b'})
+
+    def test_pause_flushes(self):
+        journal = Journal(self.path, batch_size=1000, interval=60)
+        pw = Power(1, backend=FakeBackend(), journal=journal)
+        pw.create_pw_collection()
+        try:
+            list(pw.batch(identity, range(3)))
+            journal.record('manual')
+            self.assertEqual(len(Journal(self.path).done), 3)
+            dispatcher.send(signal=Signal.PW_COMMAND_SIGNAL, message={'command': 'pause'})
+            self.assertEqual(len(Journal(self.path).done), 4)
+        finally:
+            pw.reset()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `power.metrics`.
+"""
+
+import unittest
+
+from power.backends import FakeBackend
+from power.com.powersocketserver import metrics_app
+from power.metrics import Histogram, Metrics
+from power.power import Power
+
+
+def field_count(thread_id, auto_sim):
+    return len(auto_sim.GetFieldList('Bus')[1])
+
+
+def fail(thread_id, auto_sim):
+    raise ValueError('Task failed')
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_quantiles(self):
+        histogram = Histogram(buckets=(1, 2, 5, 10))
+        for value in [0.5] * 90 + [4] * 9 + [20]:
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        self.assertEqual(snapshot['max'], 20)
+        self.assertEqual(snapshot['p50'], 1)
+        self.assertEqual(snapshot['p90'], 1)
+        self.assertEqual(snapshot['p99'], 5)
+        self.assertEqual(histogram.quantile(1), 20)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_pool(self):
+        pw = Power(2, backend=FakeBackend(latency=0.001))
+        pw.create_pw_collection()
+        try:
+            for future in [pw.submit(field_count) for _ in range(10)] + [pw.submit(fail)]:
+                future.exception()
+            snapshot = pw.metrics.snapshot()
+        finally:
+            pw.reset()
+        self.assertEqual(snapshot['tasks']['submitted'], 11)
+        self.assertEqual(snapshot['tasks']['completed'], 10)
+        self.assertEqual(snapshot['tasks']['failed'], 1)
+        self.assertEqual(snapshot['run_time']['count'], 11)
+        self.assertEqual(snapshot['queue_wait']['count'], 11)
+        self.assertEqual(sum(worker['tasks'] for worker in snapshot['workers'].values()), 11)
+        self.assertEqual(snapshot['gauges']['queue_depth'], 0)
+        for worker in snapshot['workers'].values():
+            self.assertTrue(0 <= worker['utilization'] <= 1)
+
+    def test_scrape_endpoint(self):
+        metrics = Metrics()
+        metrics.count('submitted', 3)
+        metrics.task_finished(0, 0.003, False)
+        metrics.gauge('queue_depth', lambda: 7)
+        statuses = []
+        body = b''.join(metrics_app(metrics)({}, lambda status, headers: statuses.append(status))).decode()
+        self.assertEqual(statuses, ['200 OK'])
+        self.assertIn('power_tasks_total{event="submitted"} 3', body)
+        self.assertIn('power_run_time_seconds_bucket{le="0.005"} 1', body)
+        self.assertIn('power_run_time_seconds_count 1', body)
+        self.assertIn('power_worker_tasks{thread="0"} 1', body)
+        self.assertIn('power_queue_depth 7', body)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -8,7 +8,50 @@ test_powergrid
 Tests for `power` module.
 """
 
+import queue
+import threading
+import time
 import unittest
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+
+import gevent
+from pydispatch import dispatcher
+
+from power.backends import FakeBackend
+from power.com import Signal
+from power.power import Power, Task, _PowerTask
+from power.scheduler import TaskQueue
+
+
+def square(x, thread_id, auto_sim):
+    return x * x
+
+
+def sleep_and_return(seconds, thread_id, auto_sim):
+    time.sleep(seconds)
+    return thread_id
+
+
+def echo(tag, thread_id, auto_sim):
+    time.sleep(0.01)
+    return tag
+
+
+def open_case(thread_id, auto_sim):
+    auto_sim.OpenCase('case%s.pwb' % thread_id)
+
+
+def solve_and_get_case(thread_id, auto_sim):
+    auto_sim.RunScriptCommand('SolvePowerFlow;')
+    return auto_sim.case
+
+
+def current_case(thread_id, auto_sim):
+    return auto_sim.case
+
+
+def divide(x, thread_id, auto_sim):
+    return 1 / x
 
 
 class TestPowerGrid(unittest.TestCase):
@@ -22,5 +65,230 @@ class TestPowerGrid(unittest.TestCase):
     def tearDown(self):
         pass
 
+
+class TestPowerExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.pw = Power(2, backend=FakeBackend())
+        self.pw.create_pw_collection()
+
+    def test_submit(self):
+        future = self.pw.submit(square, 3)
+        self.assertEqual(future.result(5), 9)
+        self.assertFalse(future.task.exception)
+
+    def test_submit_exception(self):
+        future = self.pw.submit(divide, 0)
+        self.assertIsInstance(future.exception(5), ZeroDivisionError)
+        self.assertTrue(future.task.exception)
+
+    def test_map(self):
+        self.assertEqual(list(self.pw.map(square, range(10))), [x * x for x in range(10)])
+
+    def test_submit_spreads_over_threads(self):
+        fs = [self.pw.submit(sleep_and_return, 0.05) for _ in range(4)]
+        self.assertEqual(sorted(future.result(5) for future in fs), [0, 0, 1, 1])
+
+    def test_idle_thread_takes_shared_tasks(self):
+        slow = self.pw.submit(sleep_and_return, 0.5)
+        time.sleep(0.05)
+        fast = [self.pw.submit(sleep_and_return, 0.01) for _ in range(5)]
+        busy = slow.task.thread_id
+        self.assertEqual({future.result(5) for future in fast}, {1 - busy})
+        self.assertFalse(slow.done())
+
+    def test_batch(self):
+        consumed = []
+
+        def arg_sets():
+            for x in range(20):
+                consumed.append(x)
+                yield x
+
+        results = self.pw.batch(square, arg_sets(), max_in_flight=3)
+        task, result = next(results)
+        self.assertLessEqual(len(consumed), 4)
+        self.assertEqual(result, task.args[0] ** 2)
+        self.assertEqual(sorted([result] + [result for task, result in results]), [x * x for x in range(20)])
+
+    def test_batch_argument_sets(self):
+        results = self.pw.batch(divide, [(1,), {'x': 2}, 0])
+        results = {task.args or tuple(task.kwargs.values()): (task.exception, result) for task, result in results}
+        self.assertEqual(results[(1,)], (False, 1))
+        self.assertEqual(results[(2,)], (False, 0.5))
+        self.assertTrue(results[(0,)][0])
+
+    def test_add_task(self):
+        results = self.pw.add_task(divide, None, 0)
+        self.assertEqual(len(results), 2)
+        for task, result in results:
+            self.assertTrue(task.exception)
+            self.assertIs(result[0], ZeroDivisionError)
+
+    def test_concurrent_threads(self):
+        with ThreadPoolExecutor(8) as callers:
+            calls = {tag: callers.submit(self.pw.add_task, echo, None, tag) for tag in range(8)}
+            for tag, call in calls.items():
+                self.assertEqual(sorted(result for task, result in call.result(5)), [tag, tag])
+
+    def test_concurrent_greenlets(self):
+        greenlets = {tag: gevent.spawn(self.pw.add_task, echo, '1', tag) for tag in range(8)}
+        gevent.joinall(list(greenlets.values()), timeout=5)
+        for tag, greenlet in greenlets.items():
+            self.assertEqual([result for task, result in greenlet.value], [tag])
+
+    def test_greenlets_run_while_resizing(self):
+        self.pw._resize_lock.acquire()
+        threading.Timer(0.1, self.pw._resize_lock.release).start()
+        ticks = []
+        ticker = gevent.spawn(lambda: [ticks.append(gevent.sleep(0.01)) for _ in range(5)])
+        # Waits for the resize lock without blocking the other greenlet
+        self.assertEqual(len(self.pw.add_task(square, None, 2)), 2)
+        self.assertTrue(ticks)
+        ticker.join(5)
+
+    def tearDown(self):
+        self.pw.reset()
+
+
+class TestCaseAffinity(unittest.TestCase):
+
+    def setUp(self):
+        self.pw = Power(2, backend=FakeBackend(latency={'OpenCase': 0.05, 'default': 0.005}))
+        self.pw.create_pw_collection()
+
+    def test_few_case_loads(self):
+        fs = []
+        for i in range(20):
+            case = 'a.pwb' if i % 2 else 'b.pwb'
+            fs.append((case, self.pw.submit(Task(solve_and_get_case, case=case))))
+        for case, future in fs:
+            self.assertEqual(future.result(5), case)
+        self.assertLessEqual(sum(thread.case_loads for thread in self.pw._threads), 4)
+
+    def test_modifications(self):
+        task = Task(solve_and_get_case, case='a.pwb', modifications=['SolvePowerFlow;'])
+        self.pw.add_task(task)
+        self.pw.add_task(task)
+        self.assertEqual([thread.case_loads for thread in self.pw._threads], [1, 1])
+        self.pw.add_task(Task(solve_and_get_case, case='a.pwb'))
+        self.assertEqual([thread.case_loads for thread in self.pw._threads], [2, 2])
+
+    def tearDown(self):
+        self.pw.reset()
+
+
+class TestPowerStartup(unittest.TestCase):
+
+    def test_warmup_and_progress(self):
+        pw = Power(3, backend=FakeBackend(latency={'OpenCase': 0.2}))
+        reported = []
+        started = time.monotonic()
+        timings = pw.create_pw_collection(warmup=open_case, progress=lambda i, t: reported.append(i))
+        try:
+            # Warm-up runs in parallel
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertEqual(sorted(reported), [0, 1, 2])
+            self.assertEqual(sorted(timings), [0, 1, 2])
+            self.assertGreaterEqual(timings[0]['warmup'], 0.2)
+            results = pw.add_task(current_case)
+            self.assertEqual(sorted(result for task, result in results), ['case0.pwb', 'case1.pwb', 'case2.pwb'])
+        finally:
+            started = time.monotonic()
+            pw.reset()
+            self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_failed_warmup(self):
+        pw = Power(2, backend=FakeBackend())
+        self.assertRaises(ZeroDivisionError, pw.create_pw_collection, warmup=lambda thread_id, auto_sim: 1 / 0)
+        pw.reset()
+
+
+class TestTaskQueue(unittest.TestCase):
+
+    def test_pinned_first(self):
+        tasks = TaskQueue(2)
+        tasks.put('shared')
+        tasks.put('pinned', 1)
+        self.assertEqual(tasks.get(0, 0), 'shared')
+        self.assertEqual(tasks.qsize(), 1)
+        self.assertEqual(tasks.get(1, 0), 'pinned')
+        self.assertRaises(queue.Empty, tasks.get, 1, 0)
+
+    def test_dismiss(self):
+        tasks = TaskQueue(1)
+        tasks.put('pinned', 0)
+        tasks.dismiss(self)
+        self.assertIsNone(tasks.get(0, worker=self))
+        self.assertEqual(tasks.get(0, worker=self), 'pinned')
+
+    def test_priority(self):
+        tasks = TaskQueue(1)
+        background = Task(square, case='a.pwb', priority=-1)
+        tasks.set_loaded(0, background.case_key)
+        for name, priority in (('background', -1), ('normal', 0), ('interactive', 10)):
+            task = _PowerTask(Task(square, case='a.pwb' if priority < 0 else None, priority=priority, group=name), None)
+            tasks.put(task)
+        # Priority before case affinity
+        self.assertEqual([tasks.get(0, 0).group for _ in range(3)], ['interactive', 'normal', 'background'])
+
+    def test_remove(self):
+        tasks = TaskQueue(2)
+        for i in range(4):
+            tasks.put(i, 1 if i == 3 else None)
+        self.assertEqual(sorted(tasks.remove(lambda task: task % 2)), [1, 3])
+        self.assertEqual(tasks.qsize(), 2)
+
+
+class TestCancellation(unittest.TestCase):
+
+    def setUp(self):
+        self.pw = Power(1, backend=FakeBackend())
+        self.pw.create_pw_collection()
+        # Keep the only thread busy
+        self.blocker = self.pw.submit(sleep_and_return, 0.2)
+        while not self.blocker.running():
+            time.sleep(0.001)
+
+    def tearDown(self):
+        self.pw.reset()
+
+    def test_cancel(self):
+        sweep = [self.pw.submit(Task(square, group='sweep'), i) for i in range(5)]
+        other = self.pw.submit(square, 3)
+        self.assertEqual(self.pw.cancel(sweep[0]), 1)
+        self.assertEqual(self.pw.cancel(group='sweep'), 4)
+        self.assertEqual(self.pw._tasks.qsize(), 1)
+        self.assertTrue(all(future.cancelled() for future in sweep))
+        self.assertEqual(other.result(), 9)
+        # Running tasks can't be cancelled
+        self.assertEqual(self.pw.cancel(self.blocker), 0)
+
+    def test_cancel_command(self):
+        futures = [self.pw.submit(Task(square, group='sweep'), i) for i in range(3)]
+        dispatcher.send(signal=Signal.PW_COMMAND_SIGNAL, message={'command': 'cancel', 'group': 'sweep'})
+        self.assertTrue(all(future.cancelled() for future in futures))
+        # Cancel while the first tasks of the batch are still queued behind the blocker
+        threading.Timer(0.05, self.pw.cancel, kwargs={'group': 'batch'}).start()
+        batch = self.pw.batch(Task(square, group='batch'), range(10), max_in_flight=2)
+        self.assertRaises(CancelledError, list, batch)
+
+    def test_deadline(self):
+        late = self.pw.submit(Task(square, deadline=0.05), 2)
+        in_time = self.pw.submit(Task(square, deadline=10), 3)
+        self.assertRaises(TimeoutError, late.result)
+        self.assertEqual(in_time.result(), 9)
+        self.assertEqual(self.pw.metrics.snapshot()['tasks']['expired'], 1)
+
+    def test_priority(self):
+        order = [self.pw.submit(Task(echo, priority=priority), priority) for priority in (0, -5, 10, 5)]
+        finished = []
+        for future in order:
+            future.add_done_callback(lambda f: finished.append(f.result()))
+        for future in order:
+            future.result()
+        self.assertEqual(finished, [10, 5, 0, -5])
+
+
 if __name__ == '__main__':
     unittest.main()
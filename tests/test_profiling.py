@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_profiling
+----------------------------------
+
+Tests for `power.profiling`.
+"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from power.backends import FakeBackend
+from power.power import Power, Task
+from power.profiling import TaskHook, Tracer
+
+
+def read_buses(i, thread_id, auto_sim):
+    auto_sim.OpenCase('case.pwb')
+    return auto_sim.GetParametersMultipleElement('Bus', ['BusNum'], '')
+
+
+def busy(seconds, thread_id, auto_sim):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def fail(thread_id, auto_sim):
+    raise ValueError('failed')
+
+
+def simulator_type(thread_id, auto_sim):
+    auto_sim.OpenCase('case.pwb')
+    return type(auto_sim).__name__
+
+
+class ForwardingBackend(FakeBackend):
+    """Says task functions don't get auto_sim in the worker thread, like ProcessBackend"""
+    in_thread = False
+
+
+class Recorder(TaskHook):
+
+    def __init__(self):
+        self.calls = []
+
+    def before(self, task, thread_id, auto_sim):
+        self.calls.append(('before', task.f.__name__))
+
+    def after(self, task, thread_id, result, exc_info):
+        self.calls.append(('after', task.f.__name__, result, exc_info is not None))
+
+
+class BrokenHook(TaskHook):
+
+    def before(self, task, thread_id, auto_sim):
+        raise RuntimeError('broken')
+
+
+class TestHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.pw = Power(1, backend=FakeBackend())
+        self.pw.create_pw_collection()
+
+    def test_before_and_after(self):
+        recorder = Recorder()
+        self.pw.add_hook(recorder)
+        self.pw.submit(busy, 0).result(5)
+        self.pw.submit(fail).exception(5)
+        self.assertEqual(recorder.calls, [('before', 'busy'), ('after', 'busy', None, False),
+                                          ('before', 'fail'), ('after', 'fail', None, True)])
+        self.pw.remove_hook(recorder)
+        self.pw.submit(busy, 0).result(5)
+        self.assertEqual(len(recorder.calls), 4)
+
+    def test_broken_hook(self):
+        self.pw.add_hook(BrokenHook())
+        self.assertIsNone(self.pw.submit(busy, 0).result(5))
+
+    def tearDown(self):
+        self.pw.reset()
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.pw = Power(2, backend=FakeBackend(latency=0.001))
+        self.pw.create_pw_collection()
+
+    def test_trace(self):
+        tracer = Tracer()
+        self.pw.add_hook(tracer)
+        list(self.pw.map(read_buses, range(4)))
+        self.pw.submit(Task(fail, case='case.pwb')).exception(5)
+        events = tracer.trace()['traceEvents']
+        tasks = [event for event in events if event.get('cat') == 'task']
+        calls = [event for event in events if event.get('cat') == 'simulator']
+        self.assertEqual(len(tasks), 5)
+        self.assertEqual({event['name'] for event in calls}, {'OpenCase', 'GetParametersMultipleElement'})
+        self.assertEqual(len(calls), 8)
+        self.assertEqual(tasks[-1]['args']['case'], 'case.pwb')
+        self.assertIn('ValueError', tasks[-1]['args']['exception'])
+        # Calls fall within their task
+        first = tasks[0]
+        inside = [event for event in calls if event['tid'] == first['tid']
+                  and first['ts'] <= event['ts'] <= first['ts'] + first['dur']]
+        self.assertEqual(len(inside), 2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            tracer.write_trace(path)
+            with open(path) as file:
+                self.assertEqual(len(json.load(file)['traceEvents']), len(events))
+
+    def test_backend_not_in_thread(self):
+        pw = Power(1, backend=ForwardingBackend())
+        pw.create_pw_collection()
+        try:
+            tracer = Tracer()
+            pw.add_hook(tracer)
+            self.assertEqual(pw.submit(simulator_type).result(5), 'FakeSimAuto')
+            self.assertEqual([event['cat'] for event in tracer.trace()['traceEvents'] if 'cat' in event], ['task'])
+        finally:
+            pw.reset()
+
+    def test_profile(self):
+        tracer = Tracer(calls=False, profile=0.5, interval=0.001)
+        self.pw.add_hook(tracer)
+        list(self.pw.map(busy, [0.02] * 20))
+        tracer.close()
+        stacks = tracer.collapsed().splitlines()
+        self.assertTrue(stacks)
+        # Only the stacks of the worker threads running profiled tasks
+        self.assertTrue(all('_PowerThread.run (power.py' in line for line in stacks))
+        self.assertTrue(any('busy (test_profiling.py' in line for line in stacks))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in stacks))
+        samples = sum(int(line.rsplit(' ', 1)[1]) for line in stacks)
+        # Half of the tasks took 0.2s in total, sampled every millisecond
+        self.assertLess(samples, 300)
+
+    def test_limit(self):
+        tracer = Tracer(calls=False, limit=2)
+        self.pw.add_hook(tracer)
+        list(self.pw.map(busy, [0] * 5))
+        self.assertEqual((len(tracer.events), tracer.dropped), (2, 3))
+
+    def tearDown(self):
+        self.pw.reset()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
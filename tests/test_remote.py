@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_remote
+----------------------------------
+
+Tests for `power.remote`.
+"""
+
+import time
+import unittest
+from threading import Event
+
+from power.backends import FakeBackend, _RemoteTraceback
+from power.power import Power, Task
+from power.remote import Agent, AgentLost, Coordinator, RemoteBackend, function_name, resolve_function
+from power.supervisor import Supervisor, WorkerTimeout
+
+started = Event()
+# Agents run in this process in these tests, so tasks can leave notes here
+crashes = []
+
+
+def remote_sum(a, b, thread_id, auto_sim):
+    return a + b, thread_id
+
+
+def remote_fail(thread_id, auto_sim):
+    raise ValueError('remote failure')
+
+
+def remote_case(thread_id, auto_sim):
+    return auto_sim.case
+
+
+def remote_slow(seconds, thread_id, auto_sim):
+    started.set()
+    time.sleep(seconds)
+    return thread_id
+
+
+def remote_crash_once(thread_id, auto_sim):
+    if not crashes:
+        crashes.append(thread_id)
+        auto_sim.crash()
+        auto_sim.OpenCase('case.pwb')
+    return 'done'
+
+
+class BrokenBackend(FakeBackend):
+    """The second simulator never starts"""
+
+    def create(self, i: int):
+        if i == 1:
+            raise OSError('No license')
+        return super().create(i)
+
+
+class TestRemote(unittest.TestCase):
+
+    def setUp(self):
+        started.clear()
+        self.coordinator = Coordinator(('127.0.0.1', 0), authkey=b'test', heartbeat_timeout=1.0)
+        self.agents = []
+        self.pw = None
+
+    def start_agents(self, count: int, slots: int, **kwargs):
+        for i in range(count):
+            agent = Agent(self.coordinator.address, backend=FakeBackend(), slots=slots, name='agent-%s' % i,
+                          authkey=b'test', heartbeat=0.1, **kwargs)
+            agent.start()
+            self.agents.append(agent)
+        self.assertTrue(self.coordinator.wait_for_agents(count * slots, timeout=5))
+
+    def start_power(self, threads: int, supervisor: Supervisor=None):
+        self.pw = Power(threads, backend=RemoteBackend(self.coordinator, timeout=5), supervisor=supervisor)
+        self.pw.create_pw_collection()
+
+    def test_run_tasks(self):
+        self.start_agents(2, 2)
+        self.start_power(4)
+        results = self.pw.add_task(remote_sum, None, 1, 2)
+        self.assertEqual(sorted(result for task, result in results), [(3, 0), (3, 1), (3, 2), (3, 3)])
+        self.assertEqual([total for total, thread_id in self.pw.map(remote_sum, range(10), range(10))],
+                         [2 * i for i in range(10)])
+
+    def test_placement(self):
+        self.start_agents(2, 2)
+        # Each agent gets one simulator, rather than one agent both
+        self.start_power(2)
+        self.assertEqual([stats['used'] for stats in self.coordinator.stats()], [1, 1])
+        self.pw.reset()
+        self.pw = None
+        self.assertEqual([stats['used'] for stats in self.coordinator.stats()], [0, 0])
+
+    def test_exception(self):
+        self.start_agents(1, 1)
+        self.start_power(1)
+        future = self.pw.submit(remote_fail)
+        self.assertIsInstance(future.exception(5), ValueError)
+        self.assertIsInstance(future.exception().__cause__, _RemoteTraceback)
+
+    def test_case(self):
+        self.start_agents(1, 1)
+        self.start_power(1)
+        self.assertEqual(self.pw.submit(Task(remote_case, case='case.pwb')).result(5), 'case.pwb')
+
+    def test_not_importable(self):
+        with self.assertRaises(ValueError):
+            function_name(lambda thread_id, auto_sim: None)
+        self.assertIs(resolve_function(function_name(remote_sum)), remote_sum)
+
+    def test_reassign_when_agent_drops(self):
+        self.start_agents(2, 1)
+        self.start_power(1, Supervisor(interval=0.05))
+        future = self.pw.submit(remote_slow, 0.5)
+        self.assertTrue(started.wait(5))
+        # Stop the agent running the task, it's retried on the other one
+        name, = [stats['name'] for stats in self.coordinator.stats() if stats['used']]
+        [agent for agent in self.agents if agent.name == name][0].stop()
+        self.assertEqual(future.result(5), 0)
+        self.assertEqual(future.task.attempts, 2)
+        self.assertEqual([stats['used'] for stats in self.coordinator.stats()], [1])
+
+    def test_simulator_crash(self):
+        self.start_agents(1, 1)
+        self.start_power(1, Supervisor(interval=0.05))
+        crashes.clear()
+        future = self.pw.submit(remote_crash_once)
+        self.assertEqual(future.result(5), 'done')
+        self.assertEqual(future.task.attempts, 2)
+
+    def test_authkey_required(self):
+        with self.assertRaises(ValueError):
+            Coordinator(('127.0.0.1', 0))
+        with self.assertRaises(ValueError):
+            Agent(self.coordinator.address, backend=FakeBackend())
+
+    def test_failed_slot_is_withdrawn(self):
+        agent = Agent(self.coordinator.address, backend=BrokenBackend(), slots=3, authkey=b'test', heartbeat=0.1)
+        agent.start()
+        self.agents.append(agent)
+        end = time.monotonic() + 5
+        while [stats['slots'] for stats in self.coordinator.stats()] != [2] and time.monotonic() < end:
+            time.sleep(0.01)
+        self.assertEqual(self.coordinator.stats()[0]['slots'], 2)
+        self.start_power(2)
+        self.assertEqual(sorted(result for task, result in self.pw.add_task(remote_sum, None, 1, 2)),
+                         [(3, 0), (3, 1)])
+        self.assertEqual(self.coordinator.stats()[0]['used'], 2)
+
+    def test_heartbeat_timeout(self):
+        self.start_agents(1, 1, retry=10)
+        # The heartbeat thread sleeps for the new interval after its next heartbeat
+        self.agents[0].heartbeat = 10
+        time.sleep(0.2)
+        self.assertEqual(len(self.coordinator.stats()), 1)
+        time.sleep(1.5)
+        self.assertEqual(len(self.coordinator.stats()), 0)
+
+    def test_agent_lost_without_supervisor(self):
+        self.start_agents(1, 1)
+        self.start_power(1)
+        future = self.pw.submit(remote_slow, 0.5)
+        self.assertTrue(started.wait(5))
+        self.agents[0].stop()
+        self.assertIsInstance(future.exception(5), AgentLost)
+
+    def test_call_timeout(self):
+        self.start_agents(1, 1)
+        self.pw = Power(1, backend=RemoteBackend(self.coordinator, timeout=5, call_timeout=0.1))
+        self.pw.create_pw_collection()
+        future = self.pw.submit(remote_slow, 0.5)
+        self.assertIsInstance(future.exception(5), WorkerTimeout)
+        # The late result is ignored
+        time.sleep(0.5)
+        self.assertEqual(self.coordinator.agents[0].pending, {})
+
+    def test_close_fails_calls(self):
+        self.start_agents(1, 1)
+        self.start_power(1)
+        future = self.pw.submit(remote_slow, 0.5)
+        self.assertTrue(started.wait(5))
+        self.coordinator.close()
+        self.assertIsInstance(future.exception(5), AgentLost)
+
+    def tearDown(self):
+        if self.pw is not None:
+            self.pw.reset()
+        for agent in self.agents:
+            agent.stop()
+        self.coordinator.close()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
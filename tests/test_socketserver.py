@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_socketserver
+----------------------------------
+
+Tests for `power.com.powersocketserver`.
+"""
+
+import json
+import unittest
+
+import gevent
+from gevent.event import Event
+
+from pydispatch import dispatcher
+
+from power import config
+from power.com import Signal, Topic
+from power.com.powersocketserver import PowerSocketServer, _Outbox, build_message
+
+
+class FakeWebSocket:
+    """Records sent messages, blocks sending while stalled"""
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.flowing = Event()
+        self.flowing.set()
+
+    def send(self, message):
+        self.flowing.wait()
+        self.sent.append(message)
+
+    def close(self):
+        self.closed = True
+
+
+class TestOutbox(unittest.TestCase):
+
+    def stalled_outbox(self, policy):
+        ws = FakeWebSocket()
+        ws.flowing.clear()
+        outbox = _Outbox(ws, 3, policy)
+        # The first message is taken by the writer, which then blocks
+        outbox.put(build_message(200, state={'step': 0}))
+        gevent.sleep(0)
+        return ws, outbox
+
+    def test_drop_oldest(self):
+        ws, outbox = self.stalled_outbox('drop_oldest')
+        for step in range(1, 6):
+            outbox.put(build_message(200, state={'step': step}))
+        self.assertEqual(outbox.stats()['dropped'], 2)
+        ws.flowing.set()
+        gevent.sleep(0.01)
+        self.assertEqual([json.loads(m)['state']['step'] for m in ws.sent], [0, 3, 4, 5])
+        self.assertEqual(outbox.stats()['sent'], 4)
+
+    def test_coalesce(self):
+        ws, outbox = self.stalled_outbox('coalesce')
+        outbox.put(build_message(200, state={'a': 1}))
+        outbox.put(build_message(400, 'Invalid JSON'))
+        outbox.put(build_message(200, state={'b': 2}))
+        outbox.put(build_message(200, state={'a': 3}))
+        ws.flowing.set()
+        gevent.sleep(0.01)
+        messages = [json.loads(m) for m in ws.sent]
+        self.assertEqual(messages[1]['message'], 'Invalid JSON')
+        self.assertEqual(messages[2]['state'], {'a': 1, 'b': 2})
+        self.assertEqual(messages[3]['state'], {'a': 3})
+
+    def test_coalesce_per_topic(self):
+        ws, outbox = self.stalled_outbox('coalesce')
+        outbox.put(build_message(200, state={'1': 1.0}, topic=Topic.BUS_VOLTAGES))
+        outbox.put(build_message(200, state={'running': True}, topic=Topic.RUN_STATUS))
+        outbox.put(build_message(200, state={'2': 0.9}, topic=Topic.BUS_VOLTAGES))
+        outbox.put(build_message(200, state={'a': 1}))
+        ws.flowing.set()
+        gevent.sleep(0.01)
+        messages = [json.loads(m) for m in ws.sent[1:]]
+        self.assertEqual([(message.get('topic'), message['state']) for message in messages],
+                         [(Topic.BUS_VOLTAGES, {'1': 1.0, '2': 0.9}), (Topic.RUN_STATUS, {'running': True}),
+                          (None, {'a': 1})])
+        self.assertEqual(outbox.stats()['dropped'], 1)
+
+    def test_disconnect(self):
+        ws, outbox = self.stalled_outbox('disconnect')
+        for step in range(1, 5):
+            outbox.put(build_message(200, state={'step': step}))
+        self.assertTrue(ws.closed)
+        self.assertTrue(outbox.closed)
+
+
+class TestBroadcast(unittest.TestCase):
+
+    def test_slow_client(self):
+        slow, fast = FakeWebSocket(), FakeWebSocket()
+        slow.flowing.clear()
+        connections = [PowerSocketServer(slow), PowerSocketServer(fast)]
+        try:
+            for connection in connections:
+                connection.on_open()
+            for step in range(200):
+                connections[1].broadcast(build_message(200, state={'step': step}))
+                gevent.sleep(0)
+            # The fast client got the config and every update, the slow one only falls behind itself
+            self.assertEqual(len(fast.sent), 201)
+            self.assertEqual(len(slow.sent), 0)
+            lagging = [stats for stats in PowerSocketServer.client_stats() if stats['dropped']]
+            self.assertEqual(len(lagging), 1)
+        finally:
+            for connection in connections:
+                connection.on_close('Test done')
+        self.assertEqual(PowerSocketServer.client_stats(), [])
+
+    def test_resync(self):
+        ws = FakeWebSocket()
+        connection = PowerSocketServer(ws)
+        try:
+            connection.on_open()
+            gevent.sleep(0)
+            revision = json.loads(ws.sent[0])['revision']
+            PowerSocketServer.state.update({'resync_test': 1})
+            PowerSocketServer.state.flush()
+            connection.on_message(json.dumps({'command': 'resync', 'revision': revision}))
+            gevent.sleep(0)
+            messages = [json.loads(m) for m in ws.sent]
+            # The broadcast delta, then the same one as answer
+            self.assertEqual(messages[1]['delta'], messages[2]['delta'])
+            self.assertEqual(messages[2]['delta']['patch'], [{'op': 'add', 'path': '/resync_test', 'value': 1}])
+            connection.on_message(json.dumps({'command': 'resync', 'revision': -5}))
+            gevent.sleep(0)
+            self.assertEqual(json.loads(ws.sent[-1])['state']['resync_test'], 1)
+        finally:
+            connection.on_close('Test done')
+            PowerSocketServer.state.delete('resync_test')
+
+    def test_config_changes(self):
+        # Made after the store was created, new clients still get them
+        PowerSocketServer.state.flush()
+        config.put('ConfigTest', 5)
+        ws = FakeWebSocket()
+        connection = PowerSocketServer(ws)
+        try:
+            connection.on_open()
+            gevent.sleep(0)
+            self.assertEqual(json.loads(ws.sent[0])['state']['configtest'], 5)
+        finally:
+            connection.on_close('Test done')
+
+    def test_send_queue_config(self):
+        # Read when a client connects, not when the module was imported
+        config.put('SendQueueSize', 7)
+        connection = PowerSocketServer(FakeWebSocket())
+        try:
+            connection.on_open()
+            self.assertEqual(connection.outbox.size, 7)
+        finally:
+            connection.on_close('Test done')
+            config.put('SendQueueSize', 100)
+
+
+class TestTopics(unittest.TestCase):
+
+    def setUp(self):
+        self.sockets = [FakeWebSocket() for _ in range(3)]
+        self.connections = [PowerSocketServer(ws) for ws in self.sockets]
+        for connection in self.connections:
+            connection.on_open()
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.on_close('Test done')
+
+    def received(self, i):
+        gevent.sleep(0)
+        # Skip the state every client gets on connect
+        return [json.loads(message) for message in self.sockets[i].sent[1:]]
+
+    def test_subscribe(self):
+        self.connections[0].on_message(json.dumps({'command': 'subscribe', 'topics': [Topic.BUS_VOLTAGES]}))
+        self.connections[1].on_message(json.dumps({'command': 'subscribe', 'topics': '*'}))
+        self.assertEqual(self.received(0)[0]['message'], {'topics': [Topic.BUS_VOLTAGES]})
+        self.assertEqual(PowerSocketServer.publish(Topic.BUS_VOLTAGES, state={'1': 1.01}), 2)
+        self.assertEqual(PowerSocketServer.publish(Topic.LINE_FLOWS, state={'1-2': 30}), 1)
+        self.assertEqual([m['topic'] for m in self.received(0)[1:]], [Topic.BUS_VOLTAGES])
+        self.assertEqual([m['topic'] for m in self.received(1)[1:]], [Topic.BUS_VOLTAGES, Topic.LINE_FLOWS])
+        self.assertEqual(self.received(2), [])
+        # Closed connections don't linger
+        self.connections[0].on_close('Test done')
+        self.assertEqual(PowerSocketServer.hub.subscribers(Topic.BUS_VOLTAGES), {self.connections[1]})
+
+    def test_signal(self):
+        dispatcher.send(signal=Signal.UPDATE_UI_SIGNAL, message=build_message(200, 'Solved'))
+        dispatcher.send(signal=Signal.UPDATE_UI_SIGNAL, message=build_message(200, 'Running', topic=Topic.RUN_STATUS),
+                        topic=Topic.RUN_STATUS)
+        # Once per client, not once per client per connection
+        for i in range(3):
+            self.assertEqual([m['message'] for m in self.received(i)], ['Solved'])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
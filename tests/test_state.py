@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_state
+----------------------------------
+
+Tests for `power.com.state`.
+"""
+
+import unittest
+
+import gevent
+
+from power.com.state import StateStore, apply_patch
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.deltas = []
+        self.store = StateStore({'paused': False}, publish=self.deltas.append, window=0.01, history=3)
+
+    def test_coalesce(self):
+        for step in range(10):
+            self.store.update({'voltages': {'1': 1.0 + step / 100, '2': 0.98}, 'step': step})
+        self.assertEqual(self.store.revision, 10)
+        self.assertEqual(self.deltas, [])
+        gevent.sleep(0.05)
+        delta, = self.deltas
+        self.assertEqual((delta['from'], delta['to']), (0, 10))
+        self.assertEqual(apply_patch({'paused': False}, delta['patch']), self.store.snapshot()[1])
+        # Only what changed
+        self.store.update({'voltages': {'1': 1.2, '2': 0.98}})
+        self.store.flush()
+        self.assertEqual(self.deltas[-1]['patch'], [{'op': 'replace', 'path': '/voltages/1', 'value': 1.2}])
+
+    def test_nested_remove(self):
+        self.store.update({'flows': {'a/b': 1, 'c': 2}})
+        self.store.update({'flows': {'c': 3}})
+        self.store.delete('paused')
+        self.store.flush()
+        self.assertEqual(apply_patch({'paused': False}, self.deltas[0]['patch']), {'flows': {'c': 3}})
+
+    def test_added_and_removed(self):
+        self.store.update({'x': 1})
+        self.store.delete('x')
+        self.store.flush()
+        self.assertEqual((self.deltas, self.store.revision), ([], 0))
+        # Coalesced against the state at the start of the window
+        self.store.update({'paused': True, 'flows': {'a': 1}})
+        self.store.update({'paused': False, 'flows': {'b': 2}})
+        self.store.delete('paused')
+        self.store.flush()
+        delta, = self.deltas
+        self.assertEqual(delta['patch'], [{'op': 'remove', 'path': '/paused'},
+                                          {'op': 'add', 'path': '/flows', 'value': {'b': 2}}])
+        self.assertEqual(apply_patch({'paused': False}, delta['patch']), self.store.snapshot()[1])
+
+    def test_since(self):
+        client = self.store.snapshot()[1]
+        for step in range(3):
+            self.store.update({'step': step})
+            self.store.flush()
+        delta = self.store.since(1)
+        self.assertEqual((delta['from'], delta['to']), (1, 3))
+        self.assertEqual(apply_patch(client, self.store.since(0)['patch']), self.store.snapshot()[1])
+        self.assertEqual(self.store.since(3)['patch'], [])
+        # Too old for the history, or never existed
+        for step in range(3, 6):
+            self.store.update({'step': step})
+            self.store.flush()
+        self.assertIsNone(self.store.since(1))
+        self.assertIsNone(self.store.since(100))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_store
+----------------------------------
+
+Tests for `power.store`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from power.backends import FakeBackend
+from power.cache import ResultCache
+from power.power import Power, Task
+from power.store import ColumnStore, task_key
+
+SCHEMA = {'bus': 'q', 'voltage': 'd'}
+
+
+def voltage(bus, thread_id, auto_sim):
+    return {'bus': bus, 'voltage': auto_sim.GetParametersSingleElement('Bus', ['BusNum', 'BusPUVolt'], [bus, ''])[1][1]}
+
+
+class TestColumnStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'sweep')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+
+    def test_append_and_reopen(self):
+        store = ColumnStore(self.path, SCHEMA, chunk_rows=4)
+        keys = [task_key(voltage, None, (i,), {}) for i in range(10)]
+        for i, key in enumerate(keys):
+            self.assertEqual(store.append(key, (i, i / 10)), i)
+        store.close()
+        self.assertRaises(ValueError, ColumnStore, self.path, {'bus': 'd'})
+        store = ColumnStore(self.path, readonly=True)
+        self.assertEqual(len(store), 10)
+        self.assertEqual(list(store.column('bus')), list(range(10)))
+        self.assertEqual(store.get(keys[3]), {'bus': 3, 'voltage': 0.3})
+        self.assertNotIn(task_key(voltage, None, (10,), {}), store)
+        self.assertRaises(IOError, store.append, keys[0], (0, 0))
+        store.close()
+
+    def test_uncommitted_row(self):
+        store = ColumnStore(self.path, SCHEMA)
+        store.append('00' * 32, (1, 1.0))
+        # A crash halfway through appending: values written, commit flag not
+        store._write('bus', 1, 2)
+        store._write('_key', 1, 5)
+        store.close()
+        store = ColumnStore(self.path)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.append('11' * 32, {'bus': 3}), 1)
+        self.assertEqual(store.get('11' * 32), {'bus': 3, 'voltage': 0.0})
+        store.close()
+
+    def test_power(self):
+        store = ColumnStore(self.path, SCHEMA, chunk_rows=8)
+        pw = Power(4, backend=FakeBackend(), store=store)
+        pw.create_pw_collection()
+        try:
+            task = Task(voltage, case='case.pwb', store=True)
+            rows = [row for _, row in pw.batch(task, range(1, 41))]
+            self.assertRaises(ValueError, Power(1, backend=FakeBackend()).submit, task, 1)
+        finally:
+            pw.reset()
+        self.assertEqual(sorted(rows), list(range(40)))
+        self.assertEqual(sorted(store.column('bus')), list(range(1, 41)))
+        self.assertTrue(all(store.committed()))
+        store.close()
+
+    def test_power_with_cache(self):
+        store = ColumnStore(self.path, SCHEMA)
+        cache = ResultCache(os.path.join(os.path.dirname(self.path), 'results.db'))
+        pw = Power(1, backend=FakeBackend(), store=store, cache=cache)
+        pw.create_pw_collection()
+        try:
+            task = Task(voltage, case='case.pwb', store=True)
+            rows = [pw.submit(task, 1).result(5) for _ in range(2)]
+        finally:
+            pw.reset()
+        # Both ran and got their own row, no row number came from the cache
+        self.assertEqual(rows, [0, 1])
+        self.assertEqual(len(cache), 0)
+        cache.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
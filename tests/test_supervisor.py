@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_supervisor
+----------------------------------
+
+Tests for `power.supervisor`.
+"""
+
+import time
+import unittest
+from concurrent.futures import CancelledError
+from threading import Event, current_thread
+
+from power.backends import FakeBackend
+from power.power import Power
+from power.supervisor import Supervisor, RetryPolicy, WorkerTimeout
+
+
+def fail_once(failure, failed, thread_id, auto_sim):
+    if not failed.is_set():
+        failed.set()
+        getattr(auto_sim, failure)()
+    auto_sim.OpenCase('case.pwb')
+    return thread_id
+
+
+def hang_once(hung, thread_id, auto_sim):
+    if not hung:
+        hung.append((current_thread(), auto_sim))
+        auto_sim.hang()
+    auto_sim.OpenCase('case.pwb')
+    return thread_id
+
+
+class StuckBackend(FakeBackend):
+    """Can't terminate a hung simulator, like COM"""
+    def __init__(self):
+        super().__init__()
+        self.released = []
+
+    def terminate(self, sim):
+        pass
+
+    def release(self, sim):
+        self.released.append(sim)
+
+
+def wait_for(event, thread_id, auto_sim):
+    event.wait(5)
+    return thread_id
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def start(self, **kwargs):
+        self.supervisor = Supervisor(interval=0.05, **kwargs)
+        self.pw = Power(2, backend=FakeBackend(), supervisor=self.supervisor)
+        self.pw.create_pw_collection()
+
+    def test_retry_after_timeout(self):
+        self.start(task_timeout=0.2, spares=1)
+        future = self.pw.submit(fail_once, 'hang', Event())
+        self.assertIn(future.result(5), [0, 1])
+        self.assertEqual(future.task.attempts, 2)
+        self.assertEqual(self.supervisor.restarts, 1)
+        self.assertEqual(self.pw.metrics.snapshot()['tasks']['failed'], 1)
+
+    def test_retry_after_crash(self):
+        self.start()
+        results = self.pw.add_task(fail_once, '1', 'crash', Event())
+        self.assertEqual(results[0][1], 1)
+        self.assertEqual(self.supervisor.restarts, 1)
+        # Both attempts are recorded
+        snapshot = self.pw.metrics.snapshot()
+        self.assertEqual((snapshot['tasks']['failed'], snapshot['tasks']['completed']), (1, 1))
+        self.assertEqual(snapshot['workers'][1]['tasks'], 2)
+        # The new simulator takes tasks like any other
+        self.assertEqual(sorted(result for task, result in self.pw.add_task(fail_once, None, 'crash', Event())
+                                if not task.exception), [0, 1])
+
+    def test_fail_without_retry(self):
+        self.start(task_timeout=0.2, policy=RetryPolicy(retries=0))
+        future = self.pw.submit(fail_once, 'hang', Event())
+        self.assertIsInstance(future.exception(5), WorkerTimeout)
+        self.assertTrue(future.task.exception)
+
+    def test_abandoned_thread(self):
+        self.supervisor = Supervisor(interval=0.05, task_timeout=0.2)
+        backend = StuckBackend()
+        self.pw = Power(2, backend=backend, supervisor=self.supervisor)
+        self.pw.create_pw_collection()
+        hung = []
+        self.assertIn(self.pw.submit(hang_once, hung).result(5), [0, 1])
+        thread, sim = hung[0]
+        try:
+            # Left behind, it can't keep the interpreter from exiting and its simulator isn't released under it
+            self.assertTrue(thread.is_alive())
+            self.assertTrue(thread.daemon)
+            self.assertNotIn(sim, backend.released)
+        finally:
+            sim.crash()
+            thread.join(5)
+        self.assertIn(sim, backend.released)
+        self.assertEqual(self.pw._tasks._dismissed, set())
+
+    def test_cancel_retried_task(self):
+        self.start()
+        event = Event()
+        running = [self.pw.submit(wait_for, event) for _ in range(2)]
+        while not all(future.running() for future in running):
+            time.sleep(0.01)
+        # Queued again after a failure, its future is already running
+        retried = self.pw.submit(wait_for, event)
+        retried.set_running_or_notify_cancel()
+        self.assertEqual(self.pw.cancel(retried), 1)
+        self.assertIsInstance(retried.exception(1), CancelledError)
+        event.set()
+        self.assertEqual(sorted(future.result(5) for future in running), [0, 1])
+
+    def tearDown(self):
+        self.pw.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_wire
+----------------------------------
+
+Tests for `power.com.wire`.
+"""
+
+import json
+import unittest
+import zlib
+
+import gevent
+
+from power.com import wire
+from power.lazy import optional
+from power.com.powersocketserver import PowerSocketServer, build_message
+from tests.test_socketserver import FakeWebSocket
+
+
+class TestWire(unittest.TestCase):
+
+    def setUp(self):
+        self.message = build_message(200, state={'voltages': [1.0 + i / 1000 for i in range(1000)]})
+
+    def test_json(self):
+        self.assertIs(wire.encode(self.message), self.message)
+        frame = wire.encode(self.message, 'json', compress=1024)
+        self.assertEqual(frame[0], wire.JSON | wire.COMPRESSED)
+        self.assertLess(len(frame), len(self.message))
+        self.assertEqual(wire.decode(frame), json.loads(self.message))
+
+    @unittest.skipIf(wire.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        frame = wire.encode(self.message, 'msgpack')
+        self.assertEqual(frame[0], wire.MSGPACK)
+        self.assertLess(len(frame), len(self.message))
+        self.assertEqual(wire.decode(frame), json.loads(self.message))
+        self.assertEqual(wire.decode(wire.encode(self.message, 'msgpack', compress=100)), json.loads(self.message))
+
+    @unittest.skipIf(wire.msgpack is None or optional('numpy') is None, 'msgpack or NumPy is not installed')
+    def test_msgpack_numpy(self):
+        numpy = optional('numpy')
+        message = build_message(200, state={'voltages': numpy.array([1.0, 0.98]), 'step': numpy.int64(3)})
+        expected = {'voltages': [1.0, 0.98], 'step': 3}
+        self.assertEqual(json.loads(message)['state'], expected)
+        self.assertEqual(wire.decode(wire.encode(message, 'msgpack'))['state'], expected)
+
+    def test_invalid(self):
+        for frame in (b'', b'\x7f{}', bytes((wire.JSON | wire.COMPRESSED,)) + b'nonsense', 'nonsense'):
+            self.assertRaises(ValueError, wire.decode, frame)
+        # Truncated, or decompressing to more than allowed
+        frame = bytes((wire.JSON | wire.COMPRESSED,)) + zlib.compress(json.dumps({'padding': ' ' * 10000}).encode())
+        self.assertRaises(ValueError, wire.decode, frame[:-4])
+        self.assertRaises(ValueError, wire.decode, frame, 1000)
+        self.assertEqual(len(wire.decode(frame)['padding']), 10000)
+
+
+class TestNegotiation(unittest.TestCase):
+
+    def open(self, query=''):
+        ws = FakeWebSocket()
+        ws.environ = {'QUERY_STRING': query}
+        connection = PowerSocketServer(ws)
+        connection.on_open()
+        self.addCleanup(connection.on_close, 'Test done')
+        return ws, connection
+
+    def test_command(self):
+        ws, connection = self.open()
+        gevent.sleep(0)
+        connection.on_message(json.dumps({'command': 'encoding', 'encoding': 'json', 'compress': 10}))
+        gevent.sleep(0)
+        self.assertIsInstance(ws.sent[0], str)
+        self.assertEqual(wire.decode(ws.sent[1])['message'], {'encoding': 'json', 'compress': 10})
+        connection.on_message(json.dumps({'command': 'encoding', 'encoding': 'xml'}))
+        gevent.sleep(0)
+        self.assertEqual(wire.decode(ws.sent[2])['status'], 400)
+
+    @unittest.skipIf(wire.msgpack is None, 'msgpack is not installed')
+    def test_handshake(self):
+        ws, connection = self.open('encoding=msgpack')
+        # Binary messages from the client work as well
+        connection.on_message(wire.encode(json.dumps({'command': 'subscribe', 'topics': ['run_status']}), 'msgpack'))
+        gevent.sleep(0)
+        self.assertTrue(all(isinstance(frame, bytes) for frame in ws.sent))
+        self.assertIn('revision', wire.decode(ws.sent[0]))
+        self.assertEqual(wire.decode(ws.sent[1])['message'], {'topics': ['run_status']})
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())